@@ -0,0 +1,319 @@
+# batch_transcribe.py
+
+"""
+Batch transcription and search for recorded voice queries.
+
+Decodes a directory of WAV/WebM utterances (WebM/Opus in a process pool),
+transcribes them through a pluggable recognizer with several requests in flight,
+normalizes the transcripts into keyword queries and runs one batched search.
+One JSON line is written per file.
+
+Usage:
+    python batch_transcribe.py recordings/ --output results.jsonl
+    python batch_transcribe.py recordings/ --recognizer transcript-file   # offline: reads <name>.txt
+    python batch_transcribe.py recordings/ --recognizer my_module:MyRecognizer
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import wave
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import REGISTRY, observe, span
+
+# --- Configuration ---
+AUDIO_EXTENSIONS = {'.wav', '.webm'}
+DEFAULT_DECODE_WORKERS = os.cpu_count() or 2
+DEFAULT_IN_FLIGHT = 8
+DEFAULT_TOP_K = 9
+LANGUAGE_CODE = 'en-US'
+# What the browser recorder in dashboard.py produces.
+WEBM_SAMPLE_RATE = 48000
+# WebM/Opus is decoded to 16 kHz mono LINEAR16, the format the streaming
+# recognizer uses too, when PyAV (`pip install av`) is installed.
+DECODE_SAMPLE_RATE = 16000
+
+AudioClip = namedtuple('AudioClip', ['path', 'content', 'encoding', 'sample_rate', 'channels'])
+
+
+# --- Decoding ---
+
+def find_audio_files(input_dir):
+    return sorted(
+        os.path.join(input_dir, fname)
+        for fname in os.listdir(input_dir)
+        if os.path.splitext(fname)[1].lower() in AUDIO_EXTENSIONS
+    )
+
+
+def can_decode_webm():
+    """True when PyAV is installed to decode WebM/Opus locally."""
+    return importlib.util.find_spec('av') is not None
+
+
+def decode_webm(path, sample_rate=DECODE_SAMPLE_RATE):
+    """
+    Decodes a WebM/Opus file to mono 16-bit PCM at `sample_rate` with PyAV.
+
+    Returns:
+        AudioClip
+    """
+    import av
+
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=sample_rate)
+    pcm = bytearray()
+    with av.open(path) as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                pcm += resampled.to_ndarray().tobytes()
+        # Flush the samples the resampler is still holding.
+        for resampled in resampler.resample(None):
+            pcm += resampled.to_ndarray().tobytes()
+    return AudioClip(path, bytes(pcm), 'LINEAR16', sample_rate, 1)
+
+
+def decode_audio_file(path, decode_webm_audio=None):
+    """
+    Reads one utterance into the form the recognizers expect.
+
+    WAV files are read as raw 16-bit PCM (LINEAR16). WebM/Opus is decoded to
+    16 kHz mono LINEAR16 when PyAV is installed, and otherwise passed through
+    as-is, since the Speech API accepts it directly.
+
+    Args:
+        decode_webm_audio (bool): Decode WebM locally; defaults to can_decode_webm().
+
+    Returns:
+        AudioClip
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.wav':
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16-bit PCM WAV is supported, got {8 * wav.getsampwidth()}-bit")
+            content = wav.readframes(wav.getnframes())
+            return AudioClip(path, content, 'LINEAR16', wav.getframerate(), wav.getnchannels())
+    if extension == '.webm':
+        if can_decode_webm() if decode_webm_audio is None else decode_webm_audio:
+            return decode_webm(path)
+        with open(path, 'rb') as f:
+            return AudioClip(path, f.read(), 'WEBM_OPUS', WEBM_SAMPLE_RATE, 1)
+    raise ValueError(f"{path}: unsupported audio format '{extension}'")
+
+
+def _decode_or_error(path):
+    # Runs in a worker process for WebM; errors come back as values so one
+    # bad file doesn't take down the pool, and the decode time comes back
+    # too because the worker's metrics registry isn't ours.
+    start = time.perf_counter()
+    try:
+        return decode_audio_file(path), None, time.perf_counter() - start
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+
+def decode_all(paths, workers=DEFAULT_DECODE_WORKERS):
+    """
+    Decodes every file, in input order, as (clip, error) pairs. Each file's
+    decode time is recorded as 'batch_audio_decode'.
+
+    Only Opus decoding is real CPU work, so only WebM files go to the
+    process pool (and only when PyAV can decode them). WAV frames are read
+    in this thread meanwhile: shipping them to a worker and back would cost
+    more than reading them.
+    """
+    decoded = [None] * len(paths)
+    heavy = [i for i, path in enumerate(paths) if path.lower().endswith('.webm')] if can_decode_webm() else []
+    pool = ProcessPoolExecutor(max_workers=workers) if heavy and workers > 1 else None
+    try:
+        futures = {i: pool.submit(_decode_or_error, paths[i]) for i in heavy} if pool else {}
+        for i, path in enumerate(paths):
+            if i not in futures:
+                decoded[i] = _decode_or_error(path)
+        for i, future in futures.items():
+            decoded[i] = future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    for _, _, seconds in decoded:
+        observe('batch_audio_decode', seconds)
+    return [(clip, error) for clip, error, _ in decoded]
+
+
+# --- Recognizers ---
+# A recognizer is any object with `recognize(clip) -> str | None`. It is
+# called from several threads at once, so it must be thread-safe.
+
+class GoogleSpeechRecognizer:
+    """Non-streaming Google Cloud Speech-to-Text, as used by dashboard.py."""
+
+    def __init__(self, credentials_path=None, language_code=LANGUAGE_CODE):
+        from google.cloud import speech
+
+        self._speech = speech
+        if credentials_path:
+            from google.oauth2 import service_account
+
+            credentials = service_account.Credentials.from_service_account_file(credentials_path)
+            self._client = speech.SpeechClient(credentials=credentials)
+        else:
+            self._client = speech.SpeechClient()
+        self._language_code = language_code
+
+    def recognize(self, clip):
+        speech = self._speech
+        config = speech.RecognitionConfig(
+            encoding=getattr(speech.RecognitionConfig.AudioEncoding, clip.encoding),
+            sample_rate_hertz=clip.sample_rate,
+            audio_channel_count=clip.channels,
+            language_code=self._language_code,
+        )
+        response = self._client.recognize(config=config, audio=speech.RecognitionAudio(content=clip.content))
+        if response.results:
+            return response.results[0].alternatives[0].transcript
+        return None
+
+
+class TranscriptFileRecognizer:
+    """
+    Offline recognizer that reads the transcript from a `<name>.txt` file next
+    to each recording. Handy for load-testing the search path with logged
+    queries without calling the Speech API.
+    """
+
+    def recognize(self, clip):
+        transcript_path = os.path.splitext(clip.path)[0] + '.txt'
+        if not os.path.exists(transcript_path):
+            return None
+        with open(transcript_path, encoding='utf-8') as f:
+            return f.read().strip() or None
+
+
+RECOGNIZERS = {
+    'google': GoogleSpeechRecognizer,
+    'transcript-file': TranscriptFileRecognizer,
+}
+
+
+def load_recognizer(name):
+    """Builds a recognizer by registry name or by 'module:ClassName'."""
+    if name in RECOGNIZERS:
+        return RECOGNIZERS[name]()
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError(f"Unknown recognizer '{name}'; use one of {sorted(RECOGNIZERS)} or 'module:ClassName'")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+# --- Pipeline ---
+
+def _timed_recognize(recognizer, clip):
+    start = time.perf_counter()
+    try:
+        return recognizer.recognize(clip), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    finally:
+        observe('batch_stt_recognize', time.perf_counter() - start)
+
+
+def run_batch(paths, recognizer, normalize=None, search_batch=None, top_k=DEFAULT_TOP_K,
+              decode_workers=DEFAULT_DECODE_WORKERS, max_in_flight=DEFAULT_IN_FLIGHT):
+    """
+    Decodes, transcribes, normalizes and searches a list of recordings.
+    Each file's timings are recorded under their own 'batch_*' stages, so
+    they don't mix with the live streaming pipeline's.
+
+    Args:
+        paths (list[str]): The audio files.
+        recognizer: Object with `recognize(clip) -> str | None`.
+        normalize (callable): transcript -> keyword query; defaults to search_client's spaCy.
+        search_batch (callable): (queries, top_k) -> result lists; defaults to search_client.
+        top_k (int): Results per query.
+        decode_workers (int): Processes used for decoding WebM/Opus.
+        max_in_flight (int): Concurrent recognizer requests.
+
+    Returns:
+        list[dict]: One record per input file, in input order.
+    """
+    if normalize is None or search_batch is None:
+        import search_client
+
+        normalize = normalize or (lambda transcript: " ".join(search_client.extract_keywords(transcript)))
+        search_batch = search_batch or search_client.search_images_batch
+
+    records = [{'file': path, 'transcript': None, 'query': None, 'results': [], 'error': None} for path in paths]
+
+    # 1. Decode; Opus decoding is CPU-bound and runs in a process pool.
+    decoded = decode_all(paths, decode_workers)
+
+    # 2. Transcribe with several requests in flight; recognition is I/O-bound.
+    clips = [(record, clip) for record, (clip, error) in zip(records, decoded) if clip is not None]
+    for record, (clip, error) in zip(records, decoded):
+        if error:
+            record['error'] = error
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        transcriptions = pool.map(lambda item: _timed_recognize(recognizer, item[1]), clips)
+        for (record, _), (transcript, error) in zip(clips, transcriptions):
+            record['transcript'] = transcript
+            record['error'] = error
+
+    # 3. Normalize each transcript into a keyword query.
+    for record in records:
+        if record['transcript']:
+            with span('batch_spacy'):
+                record['query'] = normalize(record['transcript'])
+
+    # 4. One batched search for every non-empty query.
+    searchable = [record for record in records if record['query']]
+    if searchable:
+        results = search_batch([record['query'] for record in searchable], top_k)
+        for record, paths_found in zip(searchable, results):
+            record['results'] = list(paths_found)
+    return records
+
+
+def write_jsonl(records, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe and search a directory of recorded voice queries.")
+    parser.add_argument('input_dir')
+    parser.add_argument('--output', default='batch_results.jsonl')
+    parser.add_argument('--recognizer', default='google',
+                        help=f"one of {sorted(RECOGNIZERS)} or 'module:ClassName'")
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+    parser.add_argument('--decode-workers', type=int, default=DEFAULT_DECODE_WORKERS)
+    parser.add_argument('--in-flight', type=int, default=DEFAULT_IN_FLIGHT)
+    args = parser.parse_args(argv)
+
+    paths = find_audio_files(args.input_dir)
+    if not paths:
+        print(f"Error: No WAV/WebM files found in '{args.input_dir}'.")
+        return 1
+    print(f"Found {len(paths)} recordings to process.")
+
+    start = time.perf_counter()
+    records = run_batch(paths, load_recognizer(args.recognizer), top_k=args.top_k,
+                        decode_workers=args.decode_workers, max_in_flight=args.in_flight)
+    elapsed = time.perf_counter() - start
+    write_jsonl(records, args.output)
+
+    failures = sum(1 for record in records if record['error'])
+    print(f"✅ Processed {len(records)} recordings in {elapsed:.1f}s ({len(records) / elapsed:.1f}/s), "
+          f"{failures} failed. Results written to '{args.output}'.")
+    print(REGISTRY.to_prometheus())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,570 @@
+# benchmark.py
+
+"""
+Offline benchmark suite for indexing and search.
+
+Generates synthetic CLIP-sized vector corpora (no network access needed),
+builds each FAISS index configuration, and measures build time, index size,
+QPS, latency percentiles and recall@k for each thread count. Results are
+written as JSON and can be compared against a stored baseline.
+
+Usage:
+    python benchmark.py --sizes 10000 100000 --configs Flat "IVF1024,Flat:nprobe=16" HNSW32 \\
+        --threads 1 4 --output bench.json
+    python benchmark.py --sizes 10000 --baseline bench.json   # exits 1 on regressions
+    python benchmark.py --engine --output engine.json         # real model + index
+    python benchmark.py --executor --sizes 100000             # intra- vs inter-query crossover
+    python benchmark.py --encoder --threads 4                 # PyTorch vs fp32/int8 ONNX text encoder
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+
+from search_executor import SearchExecutor
+
+# --- Configuration ---
+EMBEDDING_DIM = 512          # clip-ViT-B-32 embedding size
+DEFAULT_SIZES = (10_000, 100_000)
+DEFAULT_CONFIGS = ('Flat', 'IVF1024,Flat:nprobe=16', 'HNSW32:efSearch=64')
+DEFAULT_THREADS = (1, 4)
+NUM_QUERIES = 1000
+LATENCY_QUERIES = 200        # single-query calls timed for the latency percentiles
+TOP_K = 9
+CHUNK_SIZE = 100_000         # vectors generated/added at a time, keeps memory flat
+NUM_CLUSTERS = 256           # synthetic "concepts" the corpus is drawn around
+SEED = 1234
+
+# Allowed relative change before a result counts as a regression.
+QPS_TOLERANCE = 0.10
+LATENCY_TOLERANCE = 0.15
+RECALL_TOLERANCE = 0.01
+
+# Batch sizes and concurrent callers for the executor crossover benchmark.
+EXECUTOR_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+EXECUTOR_CONCURRENT_CALLERS = (1, 4, 16)
+# Each batch size is timed this many times per strategy; the median counts.
+EXECUTOR_REPEATS = 3
+
+# Text encoders compared by the encoder benchmark: the PyTorch baseline
+# and the fp32/int8 ONNX exports.
+ENCODER_CONFIGS = ('torch', 'fp32', 'int8')
+
+# Offline stand-ins for spoken queries, used by the end-to-end engine benchmark.
+ENGINE_QUERY_WORDS = (
+    'dog', 'cat', 'red car', 'traffic light', 'person riding a bike', 'pizza', 'beach',
+    'backpack', 'airplane in the sky', 'bowl of fruit', 'train station', 'kitchen',
+)
+
+
+# --- Synthetic Data ---
+
+def make_centroids(dim=EMBEDDING_DIM, num_clusters=NUM_CLUSTERS, seed=SEED):
+    """Returns the normalized cluster centres the synthetic corpus is drawn around."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((num_clusters, dim)).astype('float32')
+    faiss.normalize_L2(centroids)
+    return centroids
+
+
+def iter_corpus(n, centroids, chunk_size=CHUNK_SIZE, seed=SEED, noise=0.6):
+    """
+    Yields the synthetic corpus in chunks of normalized float32 vectors.
+
+    Every chunk is seeded from its offset, so the same (n, seed) always
+    produces the same vectors without ever holding the whole corpus in memory.
+    """
+    dim = centroids.shape[1]
+    for start in range(0, n, chunk_size):
+        size = min(chunk_size, n - start)
+        rng = np.random.default_rng([seed, start])
+        labels = rng.integers(0, len(centroids), size)
+        chunk = centroids[labels] + noise * rng.standard_normal((size, dim)).astype('float32') / np.sqrt(dim)
+        chunk = np.ascontiguousarray(chunk, dtype='float32')
+        faiss.normalize_L2(chunk)
+        yield start, chunk
+
+
+def make_queries(num_queries, centroids, seed=SEED + 1, noise=0.8):
+    """Returns normalized query vectors near the corpus clusters."""
+    rng = np.random.default_rng(seed)
+    dim = centroids.shape[1]
+    labels = rng.integers(0, len(centroids), num_queries)
+    queries = centroids[labels] + noise * rng.standard_normal((num_queries, dim)).astype('float32') / np.sqrt(dim)
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def ground_truth(n, centroids, queries, top_k=TOP_K):
+    """Exact top-k neighbour ids for each query, computed chunk by chunk."""
+    best_scores = np.full((len(queries), top_k), -np.inf, dtype='float32')
+    best_ids = np.full((len(queries), top_k), -1, dtype='int64')
+    for start, chunk in iter_corpus(n, centroids):
+        scores = queries @ chunk.T
+        k = min(top_k, chunk.shape[0])
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+        merged_ids = np.concatenate([best_ids, part + start], axis=1)
+        order = np.argsort(-merged_scores, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(merged_scores, order, axis=1)
+        best_ids = np.take_along_axis(merged_ids, order, axis=1)
+    return best_ids
+
+
+# --- Index Configurations ---
+
+def parse_config(config):
+    """
+    Splits a config string like "IVF1024,Flat:nprobe=16" into the FAISS
+    factory string and a dict of search-time parameters.
+    """
+    factory, _, params = config.partition(':')
+    search_params = {}
+    for item in filter(None, params.split(';')):
+        key, _, value = item.partition('=')
+        search_params[key.strip()] = int(value)
+    return factory, search_params
+
+
+def build_index(config, n, centroids, dim=EMBEDDING_DIM):
+    """
+    Builds (and trains, if needed) an inner-product index for the config.
+
+    Returns:
+        tuple: (index, build_seconds)
+    """
+    factory, search_params = parse_config(config)
+    start = time.perf_counter()
+    index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        # Train on the first chunk; IVF needs ~40 points per list to converge.
+        _, sample = next(iter_corpus(n, centroids, chunk_size=min(n, CHUNK_SIZE)))
+        index.train(sample)
+    for _, chunk in iter_corpus(n, centroids):
+        index.add(chunk)
+    build_seconds = time.perf_counter() - start
+
+    if search_params:
+        faiss.ParameterSpace().set_index_parameters(
+            index, ','.join(f"{key}={value}" for key, value in search_params.items())
+        )
+    return index, build_seconds
+
+
+def index_size_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def make_image_map(n):
+    """A map with the same shape as image_map.pkl, for the lookup benchmark."""
+    return {i: f"/data/coco2017/val2017/{i:012d}.jpg" for i in range(n)}
+
+
+# --- Measurements ---
+
+def percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples), q) * 1000) if samples else 0.0
+
+
+def recall_at_k(found_ids, true_ids):
+    """Fraction of the true top-k neighbours that were found, averaged over queries."""
+    hits = 0
+    for found, truth in zip(found_ids, true_ids):
+        hits += len(set(found.tolist()) & set(truth.tolist()))
+    return hits / true_ids.size
+
+
+def measure_index(index, queries, true_ids, image_map, top_k=TOP_K):
+    """Measures batched QPS, single-query latency, map lookup and recall."""
+    # Batched path: the whole query set in one call.
+    start = time.perf_counter()
+    _, batch_ids = index.search(queries, top_k)
+    batch_seconds = time.perf_counter() - start
+
+    # Single-query path: what search_images does for each voice command.
+    latencies = []
+    for query in queries[:LATENCY_QUERIES]:
+        start = time.perf_counter()
+        index.search(query.reshape(1, -1), top_k)
+        latencies.append(time.perf_counter() - start)
+
+    # Map lookup: turning ids into image paths.
+    lookups = []
+    for row in batch_ids[:LATENCY_QUERIES]:
+        start = time.perf_counter()
+        [image_map[i] for i in row if i != -1]
+        lookups.append(time.perf_counter() - start)
+
+    return {
+        'qps': len(queries) / batch_seconds if batch_seconds > 0 else float('inf'),
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+        'map_lookup_p99_ms': percentile_ms(lookups, 99),
+        f'recall_at_{top_k}': recall_at_k(batch_ids, true_ids),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, configs=DEFAULT_CONFIGS, threads=DEFAULT_THREADS,
+                  num_queries=NUM_QUERIES, top_k=TOP_K, seed=SEED):
+    """
+    Runs every (size, config, thread count) combination.
+
+    Returns:
+        list[dict]: One result row per combination.
+    """
+    centroids = make_centroids(seed=seed)
+    queries = make_queries(num_queries, centroids, seed=seed + 1)
+    results = []
+
+    for n in sizes:
+        print(f"Corpus of {n:,} vectors: computing ground truth...")
+        true_ids = ground_truth(n, centroids, queries, top_k)
+        image_map = make_image_map(n)
+
+        for config in configs:
+            index, build_seconds = build_index(config, n, centroids)
+            size = index_size_bytes(index)
+            for thread_count in threads:
+                faiss.omp_set_num_threads(thread_count)
+                row = {
+                    'config': config,
+                    'n': n,
+                    'threads': thread_count,
+                    'top_k': top_k,
+                    'build_s': build_seconds,
+                    'index_bytes': size,
+                }
+                row.update(measure_index(index, queries, true_ids, image_map, top_k))
+                print(f"  {config:<28} threads={thread_count:<3} qps={row['qps']:>10.0f} "
+                      f"p99={row['p99_ms']:.3f}ms recall@{top_k}={row[f'recall_at_{top_k}']:.3f}")
+                results.append(row)
+            del index
+
+    return results
+
+
+def run_engine_benchmark(top_k=TOP_K, repeats=5):
+    """
+    Times search_engine's real search_images and search_images_batch paths.
+    Requires the index files and a locally cached model. The queries repeat,
+    so the embedding and result caches are bypassed to time real searches.
+    """
+    import search_engine
+
+    queries = list(ENGINE_QUERY_WORDS) * repeats
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search_engine.search_images(query, top_k=top_k, use_cache=False)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    search_engine.search_images_batch(queries, top_k=top_k, use_cache=False)
+    batch_seconds = time.perf_counter() - start
+
+    return [{
+        'config': 'engine',
+        'n': int(search_engine.current_state().index.ntotal),
+        'threads': faiss.omp_get_max_threads(),
+        'top_k': top_k,
+        'qps': len(queries) / sum(latencies),
+        'batch_qps': len(queries) / batch_seconds,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+    }]
+
+
+def _max_rss_mb():
+    """Peak resident memory of this process so far, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _encoder_benchmark_row(config, model_dir, threads, repeats):
+    """
+    Times one text encoder. Runs in a fresh process per config, so the
+    peak RSS it reports is that encoder's alone.
+
+    Returns:
+        dict or None: The result row, or None if the config isn't available.
+    """
+    import clip_onnx
+
+    if config == 'torch':
+        import torch
+
+        torch.set_num_threads(threads)
+        encoder = clip_onnx.SentenceTransformerEncoder()
+    else:
+        quantized = config == 'int8'
+        encoder = clip_onnx.OnnxClipEncoder(model_dir, quantized_text=quantized, num_threads=threads)
+        if quantized and not encoder.manifest['files']['text'].get('int8'):
+            print("No int8 text model in the export; run `clip_onnx.py export --quantize`.")
+            return None
+    queries = list(ENGINE_QUERY_WORDS)
+    # The first call loads the session; keep it out of the timings.
+    encoder.encode(queries[:1])
+
+    latencies = []
+    for query in queries * repeats:
+        start = time.perf_counter()
+        encoder.encode([query])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        encoder.encode(queries)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'config': f'encoder-{config}',
+        'n': len(queries),
+        'threads': threads,
+        'top_k': 0,
+        'model_file': encoder.encoder_id('text'),
+        'qps': len(latencies) / sum(latencies),
+        'batch_qps': len(queries) * repeats / batch_seconds,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+        'max_rss_mb': _max_rss_mb(),
+    }
+
+
+def run_encoder_benchmark(model_dir=None, repeats=5, threads=None, configs=ENCODER_CONFIGS):
+    """
+    Compares the text encoders: the PyTorch SentenceTransformer baseline and
+    the fp32 and int8 ONNX towers. Reports single-query encode latency (the
+    voice path), batched throughput and peak memory, each config in its own
+    process with the same explicit thread count. The ONNX rows require an
+    export made with `python clip_onnx.py export --quantize`.
+    """
+    import clip_onnx
+
+    model_dir = model_dir or clip_onnx.ONNX_MODEL_DIR
+    threads = threads or os.cpu_count() or 1
+    results = []
+    print(f"Encoder benchmark with {threads} threads:")
+    for config in configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            try:
+                row = pool.submit(_encoder_benchmark_row, config, model_dir, threads, repeats).result()
+            except (ImportError, OSError) as e:
+                print(f"  {config}: skipped ({e})")
+                continue
+        if row is None:
+            continue
+        rss = 'n/a' if row['max_rss_mb'] is None else f"{row['max_rss_mb']:.0f}MB"
+        print(f"  {config}: p50={row['p50_ms']:.2f}ms p99={row['p99_ms']:.2f}ms "
+              f"batch qps={row['batch_qps']:.0f} peak rss={rss}")
+        results.append(row)
+    return results
+
+
+def _qps(search, queries, batch_size, top_k, min_seconds=0.5):
+    """Runs `search` over consecutive batches until min_seconds have passed."""
+    done, start, offset = 0, time.perf_counter(), 0
+    while time.perf_counter() - start < min_seconds:
+        batch = queries[offset:offset + batch_size]
+        if len(batch) < batch_size:
+            offset, batch = 0, queries[:batch_size]
+        search(batch, top_k)
+        done += len(batch)
+        offset += batch_size
+    return done / (time.perf_counter() - start)
+
+
+def _concurrent_qps(search, queries, callers, top_k, per_caller=200):
+    """Throughput of `callers` threads each issuing single-row searches."""
+    def worker(offset):
+        for i in range(per_caller):
+            row = (offset + i) % len(queries)
+            search(queries[row:row + 1], top_k)
+
+    threads = [threading.Thread(target=worker, args=(c * per_caller,)) for c in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return callers * per_caller / (time.perf_counter() - start)
+
+
+def find_crossover(batch_sizes, intra_qps, inter_qps):
+    """
+    Finds the smallest batch size from which intra-query parallelism stays
+    at least as fast as inter-query at every larger size tested, so one
+    noisy win at a small batch doesn't move the crossover.
+
+    Returns:
+        int or None: The crossover batch size, or None if inter-query wins
+        at the largest size.
+    """
+    crossover = None
+    for batch_size, intra, inter in sorted(zip(batch_sizes, intra_qps, inter_qps), reverse=True):
+        if intra < inter:
+            break
+        crossover = batch_size
+    return crossover
+
+
+def run_executor_benchmark(n=DEFAULT_SIZES[-1], config='Flat', top_k=TOP_K, seed=SEED,
+                           batch_sizes=EXECUTOR_BATCH_SIZES, callers=EXECUTOR_CONCURRENT_CALLERS,
+                           repeats=EXECUTOR_REPEATS):
+    """
+    Compares intra-query (one call, all cores) against inter-query (rows
+    split over single-threaded workers) parallelism for growing batch sizes,
+    and concurrent single-row callers with and without the executor.
+    Each batch size reports the median of `repeats` runs, alternating the
+    two strategies.
+
+    Returns:
+        tuple: (result rows, crossover batch size or None)
+    """
+    centroids = make_centroids(seed=seed)
+    queries = make_queries(max(max(batch_sizes), NUM_QUERIES), centroids, seed=seed + 1)
+    index, _ = build_index(config, n, centroids)
+    executor = SearchExecutor()
+    results, intra_qps, inter_qps = [], [], []
+
+    print(f"Executor benchmark on {config} with {n:,} vectors, {executor.num_workers} workers:")
+    for batch_size in batch_sizes:
+        intra_runs, inter_runs = [], []
+        for _ in range(repeats):
+            intra_runs.append(_qps(lambda q, k: executor.search_intra_query(index, q, k), queries, batch_size, top_k))
+            inter_runs.append(_qps(lambda q, k: executor.search_inter_query(index, q, k), queries, batch_size, top_k))
+        intra, inter = float(np.median(intra_runs)), float(np.median(inter_runs))
+        intra_qps.append(intra)
+        inter_qps.append(inter)
+        print(f"  batch={batch_size:<4} intra-query qps={intra:>10.0f}  inter-query qps={inter:>10.0f}")
+        for strategy, qps in (('intra', intra), ('inter', inter)):
+            results.append({'config': f'executor-{strategy}-b{batch_size}', 'n': n,
+                            'threads': executor.batch_threads if strategy == 'intra' else executor.num_workers,
+                            'top_k': top_k, 'qps': qps})
+
+    for count in callers:
+        direct = _concurrent_qps(index.search, queries, count, top_k)
+        pooled = _concurrent_qps(lambda q, k: executor.search(index, q, k), queries, count, top_k)
+        print(f"  {count:>3} concurrent callers: direct qps={direct:>10.0f}  executor qps={pooled:>10.0f}")
+        for name, qps in (('direct', direct), ('executor', pooled)):
+            results.append({'config': f'concurrent-{name}-c{count}', 'n': n, 'threads': count,
+                            'top_k': top_k, 'qps': qps})
+
+    crossover = find_crossover(batch_sizes, intra_qps, inter_qps)
+    if crossover is None:
+        print("Inter-query parallelism won at the largest batch size tested.")
+    else:
+        print(f"Crossover: intra-query wins from batch size {crossover} upwards; "
+              f"set search_executor.DEFAULT_CROSSOVER to match.")
+    executor.shutdown()
+    return results, crossover
+
+
+# --- Baseline Comparison ---
+
+def _result_key(row):
+    return row['config'], row['n'], row['threads'], row['top_k']
+
+
+def compare_to_baseline(results, baseline):
+    """
+    Compares result rows against baseline rows with the same
+    (config, n, threads, top_k).
+
+    Returns:
+        list[str]: Human-readable regressions; empty if none.
+    """
+    baseline_by_key = {_result_key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = baseline_by_key.get(_result_key(row))
+        if old is None:
+            continue
+        label = '{} n={} threads={}'.format(*_result_key(row)[:3])
+
+        if 'qps' in old and row['qps'] < old['qps'] * (1 - QPS_TOLERANCE):
+            regressions.append(f"{label}: qps {old['qps']:.0f} -> {row['qps']:.0f}")
+        if 'p99_ms' in old and row['p99_ms'] > old['p99_ms'] * (1 + LATENCY_TOLERANCE):
+            regressions.append(f"{label}: p99 {old['p99_ms']:.3f}ms -> {row['p99_ms']:.3f}ms")
+        recall_key = f"recall_at_{row['top_k']}"
+        if recall_key in old and row[recall_key] < old[recall_key] - RECALL_TOLERANCE:
+            regressions.append(f"{label}: recall {old[recall_key]:.3f} -> {row[recall_key]:.3f}")
+    return regressions
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'faiss': getattr(faiss, '__version__', 'unknown'),
+        'numpy': np.__version__,
+        'max_threads': faiss.omp_get_max_threads(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for indexing and search.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--configs', nargs='+', default=list(DEFAULT_CONFIGS),
+                        help='FAISS factory strings, optionally with ":param=value;..." search params')
+    parser.add_argument('--threads', type=int, nargs='+', default=list(DEFAULT_THREADS))
+    parser.add_argument('--queries', type=int, default=NUM_QUERIES)
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--engine', action='store_true',
+                        help='benchmark search_engine with the real model and index instead')
+    parser.add_argument('--executor', action='store_true',
+                        help='find the intra- vs inter-query crossover on the largest --sizes corpus')
+    parser.add_argument('--encoder', action='store_true',
+                        help='compare PyTorch and fp32/int8 ONNX text encode latency and memory '
+                             'at the largest --threads')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a previous --output file')
+    args = parser.parse_args(argv)
+
+    extra = {}
+    if args.engine:
+        results = run_engine_benchmark(top_k=args.top_k)
+    elif args.encoder:
+        results = run_encoder_benchmark(threads=max(args.threads))
+    elif args.executor:
+        results, extra['crossover'] = run_executor_benchmark(max(args.sizes), args.configs[0], args.top_k, args.seed)
+    else:
+        results = run_benchmark(args.sizes, args.configs, args.threads, args.queries, args.top_k, args.seed)
+
+    report = {'environment': environment_info(), 'seed': args.seed, 'results': results, **extra}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline)
+        if regressions:
+            print("\n--- Regressions against baseline ---")
+            for line in regressions:
+                print(f"❌ {line}")
+            return 1
+        print("✅ No regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+# clip_onnx.py
+
+"""
+Offline CLIP text/image encoders on ONNX Runtime.
+
+Exporting (needs torch + sentence-transformers, run once):
+    python clip_onnx.py export --output clip_onnx --quantize
+
+Loading at runtime (needs only onnxruntime + tokenizers, no network):
+    from clip_onnx import load_encoder
+    model = load_encoder()
+    vectors = model.encode(["a dog playing fetch"])
+
+`load_encoder` falls back to the PyTorch SentenceTransformer model when no
+exported directory is present, so every caller can use it unconditionally.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# --- Configuration ---
+MODEL_NAME = 'clip-ViT-B-32'
+ONNX_MODEL_DIR = 'clip_onnx'
+MANIFEST_NAME = 'manifest.json'
+TOKENIZER_NAME = 'tokenizer.json'
+# Use the int8 text tower when it has been exported. Text queries are what
+# we encode on the hot path; the image tower only runs while indexing.
+PREFER_QUANTIZED_TEXT = True
+PREFER_QUANTIZED_IMAGE = False
+ONNX_OPSET = 14
+
+
+# --- Runtime ---
+
+class OnnxClipEncoder:
+    """
+    Drop-in replacement for `SentenceTransformer(MODEL_NAME).encode` backed by
+    the exported ONNX towers. Sessions are created lazily, so a process that
+    only encodes text never loads the image tower.
+
+    `num_threads` sets ONNX Runtime's intra-op thread count; None keeps its
+    default of one thread per physical core.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized_text=PREFER_QUANTIZED_TEXT,
+                 quantized_image=PREFER_QUANTIZED_IMAGE, num_threads=None):
+        with open(os.path.join(model_dir, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        self.model_dir = model_dir
+        self.num_threads = num_threads
+        self._quantized_text = quantized_text
+        self._quantized_image = quantized_image
+        self._text_session = None
+        self._image_session = None
+        self._tokenizer = None
+
+    def _model_file(self, tower):
+        """Returns the ONNX file this encoder runs for `tower` ('text' or 'image')."""
+        quantized = self._quantized_text if tower == 'text' else self._quantized_image
+        files = self.manifest['files'][tower]
+        return files.get('int8') if quantized and files.get('int8') else files['fp32']
+
+    def encoder_id(self, tower='text'):
+        """
+        Names the exact model behind one tower. fp32 and int8 exports give
+        slightly different vectors, so cached embeddings must not be shared.
+        """
+        return f"{self.manifest.get('model_name', MODEL_NAME)}:onnx:{self._model_file(tower)}"
+
+    def _session(self, tower):
+        import onnxruntime as ort
+
+        filename = self._model_file(tower)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        return ort.InferenceSession(os.path.join(self.model_dir, filename), options,
+                                    providers=['CPUExecutionProvider'])
+
+    def _load_tokenizer(self):
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, TOKENIZER_NAME))
+        tokenizer.enable_truncation(self.manifest['max_length'])
+        tokenizer.enable_padding(pad_id=self.manifest['pad_token_id'], pad_token=self.manifest['pad_token'])
+        return tokenizer
+
+    def encode_text(self, texts):
+        if self._text_session is None:
+            self._tokenizer = self._load_tokenizer()
+            self._text_session = self._session('text')
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        (embeddings,) = self._text_session.run(None, {'input_ids': input_ids, 'attention_mask': attention_mask})
+        return embeddings.astype('float32')
+
+    def encode_images(self, images):
+        if self._image_session is None:
+            self._image_session = self._session('image')
+        pixel_values = np.stack([self._preprocess(image) for image in images])
+        (embeddings,) = self._image_session.run(None, {'pixel_values': pixel_values})
+        return embeddings.astype('float32')
+
+    def _preprocess(self, image):
+        """CLIP preprocessing: resize shortest side, centre crop, normalize, CHW."""
+        size = self.manifest['image_size']
+        image = image.convert('RGB')
+        scale = size / min(image.size)
+        resized = (max(size, round(image.width * scale)), max(size, round(image.height * scale)))
+        image = image.resize(resized, Image.BICUBIC)
+        left = (image.width - size) // 2
+        top = (image.height - size) // 2
+        image = image.crop((left, top, left + size, top + size))
+
+        pixels = np.asarray(image, dtype=np.float32) / 255.0
+        pixels = (pixels - np.array(self.manifest['image_mean'], dtype=np.float32)) \
+            / np.array(self.manifest['image_std'], dtype=np.float32)
+        return pixels.transpose(2, 0, 1)
+
+    def encode(self, inputs, batch_size=32, show_progress_bar=False, **kwargs):
+        """
+        Encodes a list of strings or a list of PIL images.
+
+        Returns:
+            np.ndarray: A (len(inputs), dim) float32 array (not normalized,
+            same as SentenceTransformer).
+        """
+        inputs = list(inputs)
+        if not inputs:
+            return np.zeros((0, self.manifest['dim']), dtype='float32')
+        batches = range(0, len(inputs), batch_size)
+        if show_progress_bar:
+            from tqdm import tqdm
+            batches = tqdm(batches, desc='Batches')
+
+        outputs = []
+        for start in batches:
+            batch = inputs[start:start + batch_size]
+            if isinstance(batch[0], str):
+                outputs.append(self.encode_text(batch))
+            else:
+                outputs.append(self.encode_images(batch))
+        return np.concatenate(outputs)
+
+
+class SentenceTransformerEncoder:
+    """Wraps the PyTorch model so `encode` always returns float32 NumPy arrays."""
+
+    def __init__(self, model_name=MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encoder_id(self, tower='text'):
+        return f"{self.model_name}:torch"
+
+    def encode(self, inputs, batch_size=32, show_progress_bar=False, **kwargs):
+        embeddings = self.model.encode(inputs, batch_size=batch_size, show_progress_bar=show_progress_bar,
+                                       convert_to_numpy=True)
+        return np.asarray(embeddings, dtype='float32')
+
+
+def load_encoder(model_dir=ONNX_MODEL_DIR):
+    """
+    Loads the CLIP encoder, preferring the local ONNX export.
+
+    Returns:
+        An object with an `encode(list_of_texts_or_images)` method.
+    """
+    if os.path.exists(os.path.join(model_dir, MANIFEST_NAME)):
+        try:
+            import onnxruntime  # noqa: F401
+            import tokenizers  # noqa: F401
+        except ImportError as e:
+            print(f"ONNX export found in '{model_dir}' but {e.name} is not installed; using PyTorch.")
+        else:
+            print(f"Loading ONNX CLIP encoder from '{model_dir}'...")
+            return OnnxClipEncoder(model_dir)
+
+    print(f"Loading the '{MODEL_NAME}' model with sentence-transformers...")
+    return SentenceTransformerEncoder(MODEL_NAME)
+
+
+# --- Export ---
+
+def export(output_dir=ONNX_MODEL_DIR, quantize=False, model_name=MODEL_NAME):
+    """
+    Exports the CLIP text and image towers of `model_name` to ONNX, plus the
+    tokenizer and preprocessing settings needed to run them offline.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Loading '{model_name}' for export...")
+    st_model = SentenceTransformer(model_name, device='cpu')
+    clip_module = st_model[0]
+    clip = clip_module.model.eval()
+    processor = clip_module.processor
+
+    class TextTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            return self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    class ImageTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    tokenizer = processor.tokenizer
+    max_length = tokenizer.model_max_length if tokenizer.model_max_length < 10_000 else 77
+    image_size = clip.config.vision_config.image_size
+
+    files = {'text': {'fp32': 'text_model.onnx'}, 'image': {'fp32': 'image_model.onnx'}}
+    dummy_text = tokenizer(["a photo of a dog"], return_tensors='pt', padding=True)
+    dummy_image = torch.zeros(1, 3, image_size, image_size)
+
+    with torch.no_grad():
+        print("Exporting text tower...")
+        torch.onnx.export(
+            TextTower(), (dummy_text['input_ids'], dummy_text['attention_mask']),
+            os.path.join(output_dir, files['text']['fp32']),
+            input_names=['input_ids', 'attention_mask'], output_names=['embeddings'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                          'attention_mask': {0: 'batch', 1: 'sequence'},
+                          'embeddings': {0: 'batch'}},
+            opset_version=ONNX_OPSET,
+        )
+        print("Exporting image tower...")
+        torch.onnx.export(
+            ImageTower(), (dummy_image,), os.path.join(output_dir, files['image']['fp32']),
+            input_names=['pixel_values'], output_names=['embeddings'],
+            dynamic_axes={'pixel_values': {0: 'batch'}, 'embeddings': {0: 'batch'}},
+            opset_version=ONNX_OPSET,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for tower in ('text', 'image'):
+            quantized_name = f"{tower}_model.int8.onnx"
+            print(f"Quantizing {tower} tower to int8...")
+            quantize_dynamic(os.path.join(output_dir, files[tower]['fp32']),
+                             os.path.join(output_dir, quantized_name), weight_type=QuantType.QInt8)
+            files[tower]['int8'] = quantized_name
+
+    # The fast tokenizer serialises to a single tokenizer.json.
+    tokenizer.save_pretrained(output_dir)
+    image_processor = processor.image_processor
+    manifest = {
+        'model_name': model_name,
+        'dim': int(clip.config.projection_dim),
+        'max_length': int(max_length),
+        'pad_token': tokenizer.pad_token,
+        'pad_token_id': int(tokenizer.pad_token_id),
+        'image_size': int(image_size),
+        'image_mean': list(image_processor.image_mean),
+        'image_std': list(image_processor.image_std),
+        'files': files,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ ONNX export written to '{output_dir}'.")
+    return manifest
+
+
+def check_parity(model_dir=ONNX_MODEL_DIR, texts=None):
+    """
+    Compares ONNX text embeddings against the PyTorch model.
+
+    Returns:
+        dict: The minimum cosine similarity per variant ('fp32', 'int8').
+    """
+    texts = texts or ["a photo of a dog playing fetch", "red car", "traffic light", "a bowl of fruit"]
+    reference = SentenceTransformerEncoder().encode(texts)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+
+    similarities = {}
+    variants = [('fp32', False)]
+    with open(os.path.join(model_dir, MANIFEST_NAME)) as f:
+        if json.load(f)['files']['text'].get('int8'):
+            variants.append(('int8', True))
+    for name, quantized in variants:
+        onnx_vectors = OnnxClipEncoder(model_dir, quantized_text=quantized).encode(texts)
+        onnx_vectors /= np.linalg.norm(onnx_vectors, axis=1, keepdims=True)
+        similarities[name] = float(np.min(np.sum(reference * onnx_vectors, axis=1)))
+    return similarities
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or check the ONNX CLIP encoders.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='export the text and image towers')
+    export_parser.add_argument('--output', default=ONNX_MODEL_DIR)
+    export_parser.add_argument('--quantize', action='store_true', help='also write dynamic int8 models')
+    check_parser = subparsers.add_parser('check', help='compare embeddings against PyTorch')
+    check_parser.add_argument('--model-dir', default=ONNX_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        export(args.output, quantize=args.quantize)
+    else:
+        for name, similarity in check_parity(args.model_dir).items():
+            print(f"{name}: min cosine similarity vs PyTorch = {similarity:.5f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
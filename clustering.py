@@ -0,0 +1,346 @@
+# clustering.py
+
+"""
+Offline mini-batch k-means over the stored image embeddings.
+
+Usage:
+    python clustering.py [--clusters 256] [--chunk-size 8192] [--epochs 3] [--ivf]
+
+Vectors are streamed in chunks from the version's embeddings.npy, which is
+memory-mapped, so clustering a 1M-image corpus only holds one chunk, the
+centroids and the per-image assignments in memory. Versions built before
+create_index.py saved embeddings.npy fall back to reading the FAISS index,
+which FAISS loads into memory in full (a flat index can't be mmapped).
+The results go into the index's version directory and are registered in
+its manifest:
+
+    clusters.npz       centroids, per-image assignments, cluster sizes and
+                       the ids of the images closest to each centroid
+    cluster_thumbs/    one small JPEG per exemplar, for the dashboard
+
+The dashboard's Dataset Explorer browses the corpus by cluster from these
+files alone. The centroids also serve as the coarse quantizer of an IVF
+index (`--ivf`), whose inverted lists are then exactly these clusters;
+search_engine searches it instead of the flat index once it is registered.
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import faiss
+import numpy as np
+
+import index_store
+
+# --- Configuration ---
+CLUSTERS_NAME = 'clusters.npz'
+CLUSTER_THUMBNAILS_DIR = 'cluster_thumbs'
+IVF_INDEX_NAME = 'ivf_index.faiss'
+NUM_CLUSTERS = 256
+CHUNK_SIZE = 8192            # vectors read from disk at a time
+EPOCHS = 3
+EXEMPLARS_PER_CLUSTER = 8
+EXEMPLAR_SIZE = (200, 200)
+# k-means++ seeding runs on a sample of about this many points per cluster.
+INIT_SAMPLE_PER_CLUSTER = 20
+SEED = 1234
+
+
+# --- Streaming ---
+
+def embeddings_source(embeddings):
+    """
+    Returns a `source(start, n)` callable over an array of embeddings. With
+    a memory-mapped array (np.load(..., mmap_mode='r')) each read pages in
+    only the rows it asks for.
+    """
+    return lambda start, n: embeddings[start:start + n]
+
+
+def index_source(index):
+    """
+    Returns a `source(start, n)` callable that reads vectors back out of a
+    FAISS index.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF lists can't be addressed by id until a direct map exists.
+        ivf.make_direct_map()
+    return index.reconstruct_n
+
+
+def iter_chunks(source, ntotal, chunk_size=CHUNK_SIZE, order=None):
+    """
+    Yields (start, vectors) chunks of a vector source.
+
+    Args:
+        source (callable): source(start, n) -> float32 array of shape (n, dim).
+        ntotal (int): Number of vectors in the source.
+        chunk_size (int): Rows per chunk.
+        order (iterable[int]): Chunk numbers to visit, default in order.
+    """
+    num_chunks = -(-ntotal // chunk_size)
+    for chunk in range(num_chunks) if order is None else order:
+        start = int(chunk) * chunk_size
+        vectors = np.asarray(source(start, min(chunk_size, ntotal - start)), dtype=np.float32)
+        yield start, vectors
+
+
+# --- K-Means ---
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _kmeans_plus_plus(sample, num_clusters, rng):
+    """Picks well-spread initial centroids from a sample (k-means++ on cosine distance)."""
+    chosen = [rng.integers(len(sample))]
+    distances = np.maximum(1.0 - sample @ sample[chosen[0]], 0.0)
+    for _ in range(1, num_clusters):
+        weights = distances ** 2
+        total = weights.sum()
+        if total > 0:
+            nxt = rng.choice(len(sample), p=weights / total)
+        else:
+            # Everything left duplicates a centroid; any unused point will do.
+            nxt = rng.choice(np.setdiff1d(np.arange(len(sample)), chosen))
+        chosen.append(nxt)
+        distances = np.minimum(distances, np.maximum(1.0 - sample @ sample[nxt], 0.0))
+    return sample[chosen].copy()
+
+
+def minibatch_kmeans(source, ntotal, num_clusters=NUM_CLUSTERS, chunk_size=CHUNK_SIZE,
+                     epochs=EPOCHS, seed=SEED):
+    """
+    Spherical mini-batch k-means (Sculley, 2010), one chunk per mini-batch.
+
+    The embeddings are L2-normalized and searched by inner product, so
+    points are assigned by cosine similarity and the centroids are kept on
+    the unit sphere. Each centroid moves towards the running mean of every
+    point it has been assigned, with a per-centroid learning rate of
+    1 / (points seen so far).
+
+    Args:
+        source (callable): source(start, n) -> float32 array of shape (n, dim).
+        ntotal (int): Number of vectors in the source.
+        num_clusters (int): k; capped at ntotal.
+        chunk_size (int): Rows per mini-batch.
+        epochs (int): Passes over the data, in a shuffled chunk order each time.
+        seed (int): Seed for the initial centroids and the chunk order.
+
+    Returns:
+        np.ndarray: float32 centroids of shape (num_clusters, dim).
+    """
+    if ntotal == 0:
+        raise ValueError("Cannot cluster an empty index")
+    rng = np.random.default_rng(seed)
+    num_clusters = min(num_clusters, ntotal)
+
+    # Seed from a uniform sample of rows, read one by one so that an index
+    # stored in some meaningful order (e.g. by folder) doesn't bias it.
+    sample_ids = np.sort(rng.choice(ntotal, size=min(ntotal, num_clusters * INIT_SAMPLE_PER_CLUSTER), replace=False))
+    sample = [np.asarray(source(int(i), 1), dtype=np.float32) for i in sample_ids]
+    centroids = _kmeans_plus_plus(_normalize(np.vstack(sample)), num_clusters, rng)
+    counts = np.zeros(num_clusters, dtype=np.int64)
+
+    num_chunks = -(-ntotal // chunk_size)
+    for _ in range(epochs):
+        for _, vectors in iter_chunks(source, ntotal, chunk_size, order=rng.permutation(num_chunks)):
+            labels = np.argmax(vectors @ centroids.T, axis=1)
+            batch_counts = np.bincount(labels, minlength=num_clusters)
+            batch_sums = np.zeros_like(centroids)
+            np.add.at(batch_sums, labels, vectors)
+
+            touched = batch_counts > 0
+            counts[touched] += batch_counts[touched]
+            rate = (batch_counts[touched] / counts[touched])[:, None]
+            means = batch_sums[touched] / batch_counts[touched][:, None]
+            centroids[touched] += rate * (means - centroids[touched])
+            centroids[touched] = _normalize(centroids[touched])
+
+    return centroids
+
+
+def assign(source, ntotal, centroids, chunk_size=CHUNK_SIZE, exemplars_per_cluster=EXEMPLARS_PER_CLUSTER):
+    """
+    Assigns every vector to its nearest centroid in one streaming pass.
+
+    Returns:
+        tuple: (assignments, sizes, exemplars). assignments[i] is the cluster
+        of image id i; exemplars[c] lists the ids closest to centroid c,
+        best first, padded with -1 for small clusters.
+    """
+    num_clusters = len(centroids)
+    assignments = np.empty(ntotal, dtype=np.int32)
+    similarities = np.empty(ntotal, dtype=np.float32)
+    for start, vectors in iter_chunks(source, ntotal, chunk_size):
+        scores = vectors @ centroids.T
+        labels = np.argmax(scores, axis=1)
+        assignments[start:start + len(vectors)] = labels
+        similarities[start:start + len(vectors)] = scores[np.arange(len(vectors)), labels]
+
+    sizes = np.bincount(assignments, minlength=num_clusters).astype(np.int64)
+
+    # Sort by cluster, then by similarity descending; each cluster's best
+    # members are then the first rows of its run.
+    order = np.lexsort((-similarities, assignments))
+    run_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    exemplars = np.full((num_clusters, exemplars_per_cluster), -1, dtype=np.int64)
+    for c in np.flatnonzero(sizes):
+        members = order[run_starts[c]:run_starts[c] + min(sizes[c], exemplars_per_cluster)]
+        exemplars[c, :len(members)] = members
+    return assignments, sizes, exemplars
+
+
+class ClusterModel:
+    """The persisted clustering of one index version."""
+
+    def __init__(self, centroids, assignments, sizes, exemplars):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.sizes = sizes
+        self.exemplars = exemplars
+
+    @property
+    def num_clusters(self):
+        return len(self.centroids)
+
+    def members(self, cluster, offset=0, limit=None):
+        """Returns the image ids in a cluster, in id order."""
+        ids = np.flatnonzero(self.assignments == cluster)
+        return ids[offset:None if limit is None else offset + limit]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, assignments=self.assignments,
+                 sizes=self.sizes, exemplars=self.exemplars)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['centroids'], data['assignments'], data['sizes'], data['exemplars'])
+
+
+def build_clusters(source, ntotal, num_clusters=NUM_CLUSTERS, chunk_size=CHUNK_SIZE, epochs=EPOCHS,
+                   exemplars_per_cluster=EXEMPLARS_PER_CLUSTER, seed=SEED):
+    """Runs k-means and the assignment pass; returns a ClusterModel."""
+    centroids = minibatch_kmeans(source, ntotal, num_clusters, chunk_size, epochs, seed)
+    assignments, sizes, exemplars = assign(source, ntotal, centroids, chunk_size, exemplars_per_cluster)
+    return ClusterModel(centroids, assignments, sizes, exemplars)
+
+
+# --- Coarse Quantizer ---
+
+def make_coarse_quantizer(centroids):
+    """Wraps the centroids in a flat inner-product index usable as an IVF quantizer."""
+    quantizer = faiss.IndexFlatIP(centroids.shape[1])
+    quantizer.add(np.ascontiguousarray(centroids, dtype=np.float32))
+    return quantizer
+
+
+def build_ivf_index(source, ntotal, centroids, chunk_size=CHUNK_SIZE):
+    """
+    Builds an IndexIVFFlat on the precomputed centroids, skipping FAISS's own
+    training pass and adding the vectors chunk by chunk.
+    """
+    quantizer = make_coarse_quantizer(centroids)
+    ivf = faiss.IndexIVFFlat(quantizer, centroids.shape[1], len(centroids), faiss.METRIC_INNER_PRODUCT)
+    ivf.is_trained = True
+    for _, vectors in iter_chunks(source, ntotal, chunk_size):
+        ivf.add(vectors)
+    return ivf
+
+
+# --- Exemplar Thumbnails ---
+
+def exemplar_thumbnail_name(cluster, rank):
+    return f"{cluster:05d}_{rank}.jpg"
+
+
+def write_exemplar_thumbnails(model, image_map, out_dir, size=EXEMPLAR_SIZE):
+    """Saves a small JPEG for every exemplar, named by exemplar_thumbnail_name."""
+    from thumbnails import iter_thumbnails
+
+    os.makedirs(out_dir, exist_ok=True)
+    names, paths = [], []
+    for cluster, row in enumerate(model.exemplars):
+        for rank, image_id in enumerate(row):
+            if image_id >= 0:
+                names.append(exemplar_thumbnail_name(cluster, rank))
+                paths.append(image_map[int(image_id)])
+
+    failures = 0
+    for i, path, image, error in iter_thumbnails(paths, size):
+        if error is not None:
+            failures += 1
+            print(f"Could not make a thumbnail of '{path}': {error}")
+            continue
+        image.convert('RGB').save(os.path.join(out_dir, names[i]), quality=85)
+    return len(names) - failures
+
+
+# --- Main ---
+
+def load_clusters(version_dir):
+    """Returns the ClusterModel of a version, or None if it hasn't been clustered."""
+    path = index_store.optional_file(version_dir, 'clusters')
+    if path is None or not os.path.exists(path):
+        return None
+    return ClusterModel.load(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster the image embeddings of the live index.")
+    parser.add_argument('--root', default=index_store.INDEX_ROOT)
+    parser.add_argument('--clusters', type=int, default=NUM_CLUSTERS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--exemplars', type=int, default=EXEMPLARS_PER_CLUSTER)
+    parser.add_argument('--no-thumbnails', action='store_true', help="Skip writing exemplar thumbnails.")
+    parser.add_argument('--ivf', action='store_true', help="Also build an IVF index on the centroids.")
+    args = parser.parse_args(argv)
+
+    version, version_dir, faiss_path, map_path = index_store.resolve(args.root)
+    if version_dir is None:
+        print("Error: clustering needs a versioned index. Rebuild it with create_index.py first.")
+        return 1
+
+    embeddings_path = index_store.optional_file(version_dir, 'embeddings')
+    if embeddings_path is not None and os.path.exists(embeddings_path):
+        embeddings = np.load(embeddings_path, mmap_mode='r')
+        source, ntotal = embeddings_source(embeddings), len(embeddings)
+    else:
+        print("No embeddings.npy in this version; reading the vectors from the FAISS index, "
+              "which is loaded into memory in full. Rebuild with create_index.py to stream from disk.")
+        index = faiss.read_index(faiss_path)
+        source, ntotal = index_source(index), index.ntotal
+    print(f"Clustering {ntotal} vectors of version '{version}' into {args.clusters} clusters...")
+
+    start = time.perf_counter()
+    model = build_clusters(source, ntotal, args.clusters, args.chunk_size, args.epochs, args.exemplars)
+    model.save(os.path.join(version_dir, CLUSTERS_NAME))
+    index_store.register_file(version_dir, 'clusters', CLUSTERS_NAME)
+    print(f"✅ {model.num_clusters} clusters saved in {time.perf_counter() - start:.1f}s "
+          f"(largest {model.sizes.max()}, smallest {model.sizes.min()}).")
+
+    if not args.no_thumbnails:
+        with open(map_path, 'rb') as f:
+            image_map = pickle.load(f)
+        written = write_exemplar_thumbnails(model, image_map, os.path.join(version_dir, CLUSTER_THUMBNAILS_DIR))
+        index_store.register_file(version_dir, 'cluster_thumbnails', CLUSTER_THUMBNAILS_DIR)
+        print(f"Wrote {written} exemplar thumbnails.")
+
+    if args.ivf:
+        ivf = build_ivf_index(source, ntotal, model.centroids, args.chunk_size)
+        faiss.write_index(ivf, os.path.join(version_dir, IVF_INDEX_NAME))
+        index_store.register_file(version_dir, 'ivf_index', IVF_INDEX_NAME)
+        print(f"Wrote an IVF{model.num_clusters},Flat index using the centroids as its coarse quantizer. "
+              f"Running searchers switch to it on their next reload (SIGHUP) or restart.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
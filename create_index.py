@@ -4,11 +4,14 @@ import os
 import pickle
 import numpy as np
 from PIL import Image
-from sentence_transformers import SentenceTransformer
 import faiss
 from tqdm import tqdm
 import kagglehub
 
+import index_store
+from clip_onnx import load_encoder
+from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex, load_coco_documents
+
 # --- Configuration ---
 print("Downloading COCO 2017 dataset from Kaggle Hub...")
 # This will download the dataset to a local cache on your Mac.
@@ -23,9 +26,12 @@ except Exception as e:
 
 # The specific folder within the dataset we want to index.
 IMAGE_DIR = os.path.join(dataset_path, 'coco2017', 'val2017')
+# COCO captions/instances, used for the lexical (BM25) half of hybrid search.
+ANNOTATIONS_DIR = os.path.join(dataset_path, 'coco2017', 'annotations')
 MODEL_NAME = 'clip-ViT-B-32'
-FAISS_INDEX_PATH = 'image_index.faiss'
-IMAGE_MAP_PATH = 'image_map.pkl'
+# Every build goes into its own version directory under INDEX_ROOT, and
+# running searchers switch to it once it is published.
+INDEX_ROOT = index_store.INDEX_ROOT
 
 # --- Main Indexing Logic ---
 
@@ -37,8 +43,8 @@ def create_index():
     print("Starting the image indexing process...")
 
     # 1. Load the pre-trained model.
-    print(f"Loading the '{MODEL_NAME}' model...")
-    model = SentenceTransformer(MODEL_NAME)
+    # Uses the local ONNX export when present, otherwise the PyTorch model.
+    model = load_encoder()
 
     # 2. Find all valid image files.
     valid_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
@@ -64,10 +70,9 @@ def create_index():
     image_embeddings = model.encode(
         [Image.open(filepath) for filepath in image_paths],
         batch_size=32,
-        convert_to_tensor=True,
         show_progress_bar=True
     )
-    image_embeddings_np = image_embeddings.cpu().numpy().astype('float32')
+    image_embeddings_np = image_embeddings.astype('float32')
     faiss.normalize_L2(image_embeddings_np)
     print("Embeddings generated.")
 
@@ -77,15 +82,42 @@ def create_index():
     index.add(image_embeddings_np)
     print(f"FAISS index created with {index.ntotal} vectors.")
 
-    # 5. Save the index and the image path map.
-    print(f"Saving FAISS index to '{FAISS_INDEX_PATH}'...")
-    faiss.write_index(index, FAISS_INDEX_PATH)
+    # 5. Save the index and the image path map into a new version directory.
+    version_dir = index_store.new_version_dir(INDEX_ROOT)
+    faiss_index_path = os.path.join(version_dir, index_store.FAISS_INDEX_NAME)
+    image_map_path = os.path.join(version_dir, index_store.IMAGE_MAP_NAME)
+
+    print(f"Saving FAISS index to '{faiss_index_path}'...")
+    faiss.write_index(index, faiss_index_path)
 
     image_map = {i: path for i, path in enumerate(image_paths)}
-    with open(IMAGE_MAP_PATH, 'wb') as f:
+    with open(image_map_path, 'wb') as f:
         pickle.dump(image_map, f)
-
-    print(f"Image path map saved to '{IMAGE_MAP_PATH}'.")
+    print(f"Image path map saved to '{image_map_path}'.")
+
+    # Also keep the vectors as a plain .npy, which offline jobs such as
+    # clustering.py can memory-map and stream instead of loading the index.
+    np.save(os.path.join(version_dir, index_store.EMBEDDINGS_NAME), image_embeddings_np)
+    extra_files = {'embeddings': index_store.EMBEDDINGS_NAME}
+
+    # 6. Build the caption/tag inverted index, if the annotations are available.
+    documents = load_coco_documents(ANNOTATIONS_DIR, image_paths)
+    if documents is not None:
+        lexical = LexicalIndex.build(documents)
+        lexical.save(os.path.join(version_dir, LEXICAL_INDEX_NAME))
+        extra_files['lexical_index'] = LEXICAL_INDEX_NAME
+        print(f"Lexical index built with {len(lexical.terms)} terms over {lexical.num_docs} images.")
+    else:
+        print(f"No COCO annotations in '{ANNOTATIONS_DIR}'; skipping the lexical index.")
+
+    # 7. Publish it. Running search processes reload it in the background.
+    index_store.write_manifest(
+        version_dir, extra_files=extra_files, ntotal=int(index.ntotal), dim=int(embedding_dim), model=MODEL_NAME, image_dir=IMAGE_DIR,
+        encoder=model.encoder_id('image'),
+    )
+    version = index_store.publish(version_dir, INDEX_ROOT)
+    index_store.prune(INDEX_ROOT)
+    print(f"Published index version '{version}'.")
     print("\n--- Indexing complete! ---")
     print("You can now run the main_app.py file.")
 
@@ -4,26 +4,38 @@
 #
 # INSTRUCTIONS:
 # 1. Save this code as `dashboard.py`.
-# 2. Make sure you have the following files in the SAME FOLDER:
-#    - image_index.faiss
-#    - image_map.pkl
-#    - realtimestt-473705-2f082486c0a4.json (Your Google Cloud credentials)
+# 2. Build the index with create_index.py, and put your Google Cloud
+#    credentials (realtimestt-473705-2f082486c0a4.json) in the SAME FOLDER.
+#    Searches go through search_server.py when it is running, and through
+#    search_engine.py in this process otherwise.
 # 3. Run the dashboard with the command: streamlit run dashboard.py
 #
 # --------------------------------------------------------------------------
 
 import streamlit as st
-import faiss
 import pickle
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from PIL import Image
-import spacy
+import index_store
+import search_client
 import plotly.express as px
 import pandas as pd
 import os
+import json
+import time
 from streamlit_mic_recorder import mic_recorder
 from google.cloud import speech
+from clustering import exemplar_thumbnail_name, load_clusters
+from metrics import REGISTRY, PIPELINE_STAGES, observe, span, trace
+from thumbnails import iter_thumbnails
+
+# Thumbnails are decoded at this size instead of full resolution.
+RESULT_IMAGE_SIZE = (400, 400)
+# Cluster browser paging in the Dataset Explorer.
+CLUSTER_PAGE_SIZE = 24
+CLUSTER_THUMBNAIL_SIZE = (200, 200)
+
+# Metrics written by other front ends (main_app.py dumps its registry here).
+EXTERNAL_METRICS_PATH = 'metrics.json'
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -36,34 +48,37 @@ st.set_page_config(
 
 # --- MODEL AND DATA LOADING ---
 @st.cache_resource
-def load_models_and_clients():
+def load_speech_client():
     """
-    Loads all necessary AI models, clients, and the FAISS index.
+    Loads the Google Cloud Speech client. The search models are not loaded
+    here: search_client uses the shared search server when it is running,
+    and loads search_engine in this process otherwise.
     """
-    nlp = spacy.load("en_core_web_sm")
-    model = SentenceTransformer('clip-ViT-B-32')
-    index = faiss.read_index('image_index.faiss')
     # Add Google Cloud Speech Client initialization
     # It will look for your credentials file.
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "realtimestt-473705-2f082486c0a4.json"
-    speech_client = speech.SpeechClient()
-    return nlp, model, index, speech_client
+    return speech.SpeechClient()
 
 
-@st.cache_data
-def load_image_map():
+@st.cache_resource(max_entries=1)
+def load_cluster_browser(version):
     """
-    Loads the mapping from index ID to image file path.
+    Loads the clustering of one index version (see clustering.py) and its
+    image map, without touching the vectors. Returns None if the version
+    hasn't been clustered.
     """
-    with open('image_map.pkl', 'rb') as f:
+    version_dir, _, map_path = index_store.locate(version)
+    clusters = load_clusters(version_dir)
+    if clusters is None:
+        return None
+    with open(map_path, 'rb') as f:
         image_map = pickle.load(f)
-    return image_map
+    return clusters, image_map, index_store.optional_file(version_dir, 'cluster_thumbnails')
 
 
 # Load all resources.
-with st.spinner('Loading AI models and index... This may take a moment.'):
-    nlp, model, index, speech_client = load_models_and_clients()
-    image_map = load_image_map()
+with st.spinner('Connecting to Google Cloud Speech...'):
+    speech_client = load_speech_client()
 
 
 # --- BACKEND FUNCTIONS ---
@@ -82,7 +97,8 @@ def transcribe_audio_data(audio_bytes):
             language_code="en-US",
             use_enhanced=True
         )
-        response = speech_client.recognize(config=config, audio=audio)
+        with span('stt_final'):
+            response = speech_client.recognize(config=config, audio=audio)
         if response.results:
             return response.results[0].alternatives[0].transcript
         else:
@@ -93,23 +109,52 @@ def transcribe_audio_data(audio_bytes):
 
 
 def process_query_nlp(text_query):
-    """Processes the raw text query using spaCy."""
-    doc = nlp(text_query.lower())
-    keywords = [
-        token.lemma_
-        for token in doc
-        if not token.is_stop and not token.is_punct
-    ]
+    """Processes the raw text query using spaCy (the server's, or a local one)."""
+    with span('spacy'):
+        keywords = search_client.extract_keywords(text_query)
     return " ".join(keywords)
 
 
-def search_images(text_query, top_k=9):
-    """Performs the semantic search."""
-    query_embedding = model.encode([text_query])
-    faiss.normalize_L2(query_embedding)
-    distances, indices = index.search(query_embedding, top_k)
-    results = [image_map[i] for i in indices[0]]
-    return results
+def search_images_stream(text_query, top_k=9, transcript=None):
+    """
+    Yields SearchUpdates as results become ready: the semantic hits first,
+    then the fused re-ranking. Goes through the search server if one is
+    running, otherwise through search_engine in this process, and is recorded
+    in the query log either way.
+    """
+    yield from search_client.search_images_stream(text_query, top_k=top_k, transcript=transcript)
+
+
+def metrics_table(snapshot):
+    """Turns a metrics snapshot into a per-stage table in milliseconds."""
+    stages = snapshot.get('stages', {})
+    ordered = [s for s in PIPELINE_STAGES if s in stages] + sorted(set(stages) - set(PIPELINE_STAGES))
+    rows = []
+    for stage in ordered:
+        summary = stages[stage]
+        rows.append({
+            'Stage': stage,
+            'Count': summary['count'],
+            'p50 (ms)': summary['p50'] * 1000,
+            'p95 (ms)': summary['p95'] * 1000,
+            'p99 (ms)': summary['p99'] * 1000,
+            'Max (ms)': summary['max'] * 1000,
+        })
+    return pd.DataFrame(rows)
+
+
+def render_metrics_panel(title, snapshot):
+    st.subheader(title)
+    df = metrics_table(snapshot)
+    if df.empty:
+        st.info("No samples recorded yet.")
+        return
+    st.dataframe(df.style.format(precision=2), use_container_width=True, hide_index=True)
+    fig = px.bar(df, x='Stage', y=['p50 (ms)', 'p95 (ms)', 'p99 (ms)'], barmode='group',
+                 title='Latency percentiles per stage')
+    st.plotly_chart(fig, use_container_width=True)
+    if snapshot.get('counters'):
+        st.json(snapshot['counters'])
 
 
 # --- SIDEBAR NAVIGATION ---
@@ -119,7 +164,7 @@ with st.sidebar:
 
     page = st.radio(
         "Navigate",
-        ("About the Project", "Interactive Demo", "Dataset Explorer", "Architecture Explained"),
+        ("About the Project", "Interactive Demo", "Dataset Explorer", "Pipeline Metrics", "Architecture Explained"),
         label_visibility="hidden"
     )
     st.info("This dashboard showcases the functionality of a semantic image search system built with Python and AI.")
@@ -166,46 +211,128 @@ elif page == "Interactive Demo":
         if transcript:
             st.success(f"**You said:** {transcript}")
 
-            with st.spinner("Processing your query and searching the dataset..."):
-                # Process and search using the transcribed text
-                processed_query = process_query_nlp(transcript)
-                st.write(f"**Processed Keywords:** `{processed_query}`")
-
-                results = search_images(processed_query, top_k=9)
+            # Traced end to end, so the query log gets this search's stage timings.
+            with trace():
+                with st.spinner("Processing your query and searching the dataset..."):
+                    # Process and search using the transcribed text
+                    processed_query = process_query_nlp(transcript)
+                    st.write(f"**Processed Keywords:** `{processed_query}`")
 
                 st.subheader("Search Results")
                 cols = st.columns(3)
-                for i, image_path in enumerate(results):
-                    if os.path.exists(image_path):
-                        image = Image.open(image_path)
-                        with cols[i % 3]:
-                            st.image(image, caption=f"Result {i + 1}", use_column_width=True)
-                    else:
-                        with cols[i % 3]:
-                            st.warning("Image not found")
+                # One placeholder per slot, filled in as each thumbnail is decoded.
+                slots = [cols[i % 3].empty() for i in range(9)]
+                shown = [None] * len(slots)
+                search_started = time.perf_counter()
+                first_image = True
+
+                for update in search_images_stream(processed_query, top_k=9, transcript=transcript):
+                    changed = [(i, path) for i, path in enumerate(update.paths) if shown[i] != path]
+                    for i, path in changed:
+                        shown[i] = path
+                        slots[i].caption(f"Result {i + 1}: loading...")
+                    for i in range(len(update.paths), len(slots)):
+                        slots[i].empty()
+
+                    rank_of = {path: i for i, path in changed}
+                    for _, path, image, error in iter_thumbnails([path for _, path in changed], RESULT_IMAGE_SIZE):
+                        i = rank_of[path]
+                        if image is None:
+                            slots[i].warning("Image not found")
+                            continue
+                        with span('paint'):
+                            slots[i].image(image, caption=f"Result {i + 1}", use_column_width=True)
+                        if first_image:
+                            observe('time_to_first_image', time.perf_counter() - search_started)
+                            first_image = False
         else:
             st.error("Could not transcribe audio. Please try speaking again.")
 
 
 # --- PAGE 3: DATASET EXPLORER ---
 elif page == "Dataset Explorer":
-    # ... (Content remains the same as before)
-    st.header("📊 Dataset Explorer: COCO 2017")
-    st.write("The model was trained on the COCO (Common Objects in Context) dataset.")
-    common_objects_data = {
-        'Object': ['person', 'car', 'chair', 'bottle', 'cup', 'bowl', 'dining table', 'book', 'traffic light', 'boat',
-                   'bird', 'cat', 'dog', 'bench', 'backpack'],
-        'Frequency': [262465, 43956, 38674, 23792, 21873, 20984, 20385, 18919, 18698, 16998, 16304, 15993, 15822, 15486,
-                      14282]
-    }
-    df = pd.DataFrame(common_objects_data)
-    num_objects = st.slider("Select number of top objects to display:", 5, 15, 10)
-    fig = px.bar(df.head(num_objects).sort_values(by='Frequency', ascending=True), x='Frequency', y='Object',
-                 orientation='h', title=f'Top {num_objects} Most Common Objects in COCO Dataset')
-    st.plotly_chart(fig, use_container_width=True)
+    st.header("📊 Dataset Explorer")
+    version = index_store.current_version()
+    browser = load_cluster_browser(version) if version else None
+
+    if browser is None:
+        st.info("The live index hasn't been clustered yet. Run `python clustering.py` to browse it by cluster.")
+    else:
+        clusters, cluster_image_map, thumbs_dir = browser
+        st.subheader(f"Embedding Clusters (index version `{version}`)")
+        st.write(f"{len(clusters.assignments)} images grouped into {clusters.num_clusters} clusters "
+                 "by mini-batch k-means over their CLIP embeddings.")
+        sizes = pd.DataFrame({'Cluster': np.arange(clusters.num_clusters), 'Images': clusters.sizes})
+        sizes = sizes.sort_values(by='Images', ascending=False)
+        fig = px.bar(sizes, x=sizes['Cluster'].astype(str), y='Images', title='Images per cluster',
+                     labels={'x': 'Cluster'})
+        st.plotly_chart(fig, use_container_width=True)
+
+        cluster = st.selectbox("Browse cluster:", sizes['Cluster'].tolist(),
+                               format_func=lambda c: f"Cluster {c} ({clusters.sizes[c]} images)")
+
+        st.markdown("**Closest to the centroid**")
+        exemplar_ids = [int(i) for i in clusters.exemplars[cluster] if i >= 0]
+        cols = st.columns(max(1, len(exemplar_ids)))
+        for rank, (col, image_id) in enumerate(zip(cols, exemplar_ids)):
+            thumb_path = thumbs_dir and os.path.join(thumbs_dir, exemplar_thumbnail_name(cluster, rank))
+            if thumb_path and os.path.exists(thumb_path):
+                col.image(thumb_path, use_column_width=True)
+            else:
+                col.image(cluster_image_map[image_id], use_column_width=True)
+
+        st.markdown("**All images in the cluster**")
+        num_pages = max(1, -(-int(clusters.sizes[cluster]) // CLUSTER_PAGE_SIZE))
+        page_number = st.number_input("Page", min_value=1, max_value=num_pages, value=1)
+        member_ids = clusters.members(cluster, (page_number - 1) * CLUSTER_PAGE_SIZE, CLUSTER_PAGE_SIZE)
+        cols = st.columns(6)
+        slots = [cols[i % 6].empty() for i in range(len(member_ids))]
+        member_paths = [cluster_image_map[int(i)] for i in member_ids]
+        for rank, path, image, error in iter_thumbnails(member_paths, CLUSTER_THUMBNAIL_SIZE):
+            if error is None:
+                slots[rank].image(image, caption=os.path.basename(path), use_column_width=True)
+            else:
+                slots[rank].warning(f"Could not load {os.path.basename(path)}")
+
+    with st.expander("COCO 2017 object frequencies"):
+        common_objects_data = {
+            'Object': ['person', 'car', 'chair', 'bottle', 'cup', 'bowl', 'dining table', 'book', 'traffic light', 'boat',
+                       'bird', 'cat', 'dog', 'bench', 'backpack'],
+            'Frequency': [262465, 43956, 38674, 23792, 21873, 20984, 20385, 18919, 18698, 16998, 16304, 15993, 15822, 15486,
+                          14282]
+        }
+        df = pd.DataFrame(common_objects_data)
+        num_objects = st.slider("Select number of top objects to display:", 5, 15, 10)
+        fig = px.bar(df.head(num_objects).sort_values(by='Frequency', ascending=True), x='Frequency', y='Object',
+                     orientation='h', title=f'Top {num_objects} Most Common Objects in COCO Dataset')
+        st.plotly_chart(fig, use_container_width=True)
+
+
+# --- PAGE 4: PIPELINE METRICS ---
+elif page == "Pipeline Metrics":
+    st.header("⏱️ Pipeline Metrics")
+    st.write("Per-stage latency of the voice → NLP → embed → FAISS → render pipeline.")
+    st.button("Refresh")
+
+    render_metrics_panel("This dashboard", REGISTRY.snapshot())
+    st.download_button("Download Prometheus metrics", REGISTRY.to_prometheus(),
+                       file_name="metrics.prom", mime="text/plain")
+
+    client = search_client.get_client()
+    if client is not None:
+        try:
+            server_metrics = json.loads(client.metrics_json())
+        except Exception as e:
+            st.warning(f"Could not fetch metrics from the search server: {e}")
+        else:
+            render_metrics_panel("Search server", server_metrics)
+
+    if os.path.exists(EXTERNAL_METRICS_PATH):
+        with open(EXTERNAL_METRICS_PATH) as f:
+            render_metrics_panel(f"Desktop app ({EXTERNAL_METRICS_PATH})", json.load(f))
 
 
-# --- PAGE 4: ARCHITECTURE EXPLAINED ---
+# --- PAGE 5: ARCHITECTURE EXPLAINED ---
 elif page == "Architecture Explained":
     # ... (Content remains the same as before)
     st.header("🏗️ Project Architecture")
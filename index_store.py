@@ -0,0 +1,213 @@
+# index_store.py
+
+"""
+Versioned on-disk layout for the search index.
+
+    indexes/
+        CURRENT                      <- name of the live version, swapped atomically
+        20261019-120000/
+            manifest.json
+            image_index.faiss
+            image_map.pkl
+        20261020-093000/
+            ...
+
+create_index.py writes every build into a fresh version directory and only
+then points CURRENT at it, so a reader never sees a half-written index.
+Running searchers notice the new CURRENT (see IndexWatcher) and reload.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+# --- Configuration ---
+INDEX_ROOT = 'indexes'
+CURRENT_FILE = 'CURRENT'
+MANIFEST_NAME = 'manifest.json'
+FAISS_INDEX_NAME = 'image_index.faiss'
+IMAGE_MAP_NAME = 'image_map.pkl'
+# The raw normalized vectors, for offline jobs that stream them from disk.
+EMBEDDINGS_NAME = 'embeddings.npy'
+KEEP_VERSIONS = 3
+
+# The flat files used before versioning; still served when no CURRENT exists.
+LEGACY_FAISS_INDEX_PATH = 'image_index.faiss'
+LEGACY_IMAGE_MAP_PATH = 'image_map.pkl'
+LEGACY_VERSION = 'legacy'
+
+
+def new_version_dir(root=INDEX_ROOT):
+    """Creates and returns an empty, uniquely named version directory."""
+    os.makedirs(root, exist_ok=True)
+    base = time.strftime('%Y%m%d-%H%M%S')
+    version, suffix = base, 1
+    while True:
+        path = os.path.join(root, version)
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            suffix += 1
+            version = f"{base}-{suffix}"
+
+
+def write_manifest(version_dir, extra_files=None, **info):
+    """
+    Writes manifest.json for a finished build.
+
+    Args:
+        version_dir (str): The directory returned by new_version_dir.
+        extra_files (dict): Optional artifacts built alongside the index,
+            e.g. {'lexical_index': 'lexical_index.npz'}.
+        **info: Extra fields to record (e.g. ntotal, dim, model).
+    """
+    files = {'faiss_index': FAISS_INDEX_NAME, 'image_map': IMAGE_MAP_NAME}
+    files.update(extra_files or {})
+    manifest = {
+        'version': os.path.basename(os.path.normpath(version_dir)),
+        'created_at': time.time(),
+        'files': files,
+    }
+    manifest.update(info)
+    _atomic_write(os.path.join(version_dir, MANIFEST_NAME), json.dumps(manifest, indent=2))
+    return manifest
+
+
+def read_manifest(version_dir):
+    with open(os.path.join(version_dir, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def publish(version_dir, root=INDEX_ROOT):
+    """Atomically makes `version_dir` the live index."""
+    if not os.path.exists(os.path.join(version_dir, MANIFEST_NAME)):
+        raise FileNotFoundError(f"Refusing to publish '{version_dir}' without a {MANIFEST_NAME}")
+    version = os.path.basename(os.path.normpath(version_dir))
+    _atomic_write(os.path.join(root, CURRENT_FILE), version + "\n")
+    return version
+
+
+def current_version(root=INDEX_ROOT):
+    """Returns the name of the live version, or None if nothing is published."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve(root=INDEX_ROOT):
+    """
+    Finds the files of the live index.
+
+    Returns:
+        tuple: (version, version_dir, faiss_index_path, image_map_path).
+        version_dir is None for the legacy flat files.
+    """
+    version = current_version(root) or LEGACY_VERSION
+    return (version,) + locate(version, root)
+
+
+def locate(version, root=INDEX_ROOT):
+    """
+    Finds the files of a specific version, live or not.
+
+    Returns:
+        tuple: (version_dir, faiss_index_path, image_map_path); version_dir
+        is None for LEGACY_VERSION.
+    """
+    if version == LEGACY_VERSION:
+        return None, LEGACY_FAISS_INDEX_PATH, LEGACY_IMAGE_MAP_PATH
+    version_dir = os.path.join(root, version)
+    files = read_manifest(version_dir)['files']
+    return (version_dir,
+            os.path.join(version_dir, files['faiss_index']),
+            os.path.join(version_dir, files['image_map']))
+
+
+def fingerprint(version, *paths):
+    """
+    Identifies the exact files behind an index, for keying cached results.
+    The version name alone isn't enough: the legacy flat files keep the
+    name 'legacy' when rebuilt in place.
+
+    Returns:
+        str: The version plus the size and mtime of each file.
+    """
+    parts = [version]
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{stat.st_size}-{stat.st_mtime_ns}")
+    return ":".join(parts)
+
+
+def register_file(version_dir, key, name):
+    """Records an artifact built after publishing (e.g. clusters) in a version's manifest."""
+    manifest = read_manifest(version_dir)
+    manifest['files'][key] = name
+    _atomic_write(os.path.join(version_dir, MANIFEST_NAME), json.dumps(manifest, indent=2))
+    return manifest
+
+
+def optional_file(version_dir, key):
+    """Returns the path of an optional artifact of a version, or None if it wasn't built."""
+    if version_dir is None:
+        return None
+    name = read_manifest(version_dir)['files'].get(key)
+    return os.path.join(version_dir, name) if name else None
+
+
+def prune(root=INDEX_ROOT, keep=KEEP_VERSIONS):
+    """Deletes all but the newest `keep` versions, never the live one."""
+    live = current_version(root)
+    versions = sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name))
+    )
+    for name in versions[:-keep] if keep else versions:
+        if name != live:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def _atomic_write(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IndexWatcher(threading.Thread):
+    """
+    Polls CURRENT and calls `on_change(version)` whenever the live version
+    changes. Polling a tiny file keeps this dependency-free and works the
+    same on every platform. A version whose reload fails is retried on the
+    next poll.
+    """
+
+    def __init__(self, on_change, root=INDEX_ROOT, poll_interval=2.0):
+        super().__init__(name='index-watcher', daemon=True)
+        self._on_change = on_change
+        self._root = root
+        self._poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._last_version = current_version(root)
+
+    def run(self):
+        while not self._stop_event.wait(self._poll_interval):
+            version = current_version(self._root)
+            if version is None or version == self._last_version:
+                continue
+            try:
+                self._on_change(version)
+            except Exception as e:
+                print(f"Index reload for version '{version}' failed, retrying: {e}")
+                continue
+            self._last_version = version
+
+    def stop(self):
+        self._stop_event.set()
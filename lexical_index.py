@@ -0,0 +1,200 @@
+# lexical_index.py
+
+"""
+A compact BM25 inverted index over image captions and tags.
+
+CLIP is good at "a dog playing in the snow" but can miss exact objects like
+"traffic light" or "backpack". This index catches those by plain word
+matching, and search_engine fuses both rankings with reciprocal-rank fusion.
+
+The postings are stored as CSR arrays, with the BM25 weight of every
+(term, image) pair precomputed at build time, so a query is just a few
+vectorised slice-and-add operations:
+
+    indptr[t] : indptr[t + 1]   -> the postings of term t
+    doc_ids[...]                -> the image ids containing it
+    weights[...]                -> their BM25 contribution
+"""
+
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# --- Configuration ---
+LEXICAL_INDEX_NAME = 'lexical_index.npz'
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Tags are short and exact, so they count more than a caption mention.
+TAG_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the their there this to was with".split()
+)
+
+
+def tokenize(text):
+    """Lower-cases, splits on non-alphanumerics, drops stop words and folds simple plurals."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 search over the CSR postings."""
+
+    def __init__(self, terms, indptr, doc_ids, weights, num_docs):
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = int(num_docs)
+
+    @classmethod
+    def build(cls, documents, k1=BM25_K1, b=BM25_B):
+        """
+        Builds the index from one text per image.
+
+        Args:
+            documents (list[str]): documents[i] is the caption/tag text of image id i.
+
+        Returns:
+            LexicalIndex
+        """
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text or ''))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((doc_id, tf))
+
+        num_docs = len(documents)
+        avg_length = float(doc_lengths.mean()) if num_docs and doc_lengths.any() else 1.0
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, weights = [], []
+        for t, term in enumerate(terms):
+            entries = postings[term]
+            ids = np.fromiter((doc_id for doc_id, _ in entries), dtype=np.int32, count=len(entries))
+            tf = np.fromiter((tf for _, tf in entries), dtype=np.float32, count=len(entries))
+            idf = np.log(1 + (num_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = k1 * (1 - b + b * doc_lengths[ids] / avg_length)
+            doc_ids.append(ids)
+            weights.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+            indptr[t + 1] = indptr[t] + len(entries)
+
+        return cls(
+            terms,
+            indptr,
+            np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+            num_docs,
+        )
+
+    def save(self, path):
+        np.savez(path, terms=np.array(self.terms, dtype=str), indptr=self.indptr,
+                 doc_ids=self.doc_ids, weights=self.weights, num_docs=np.int64(self.num_docs))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['terms'].tolist(), data['indptr'], data['doc_ids'], data['weights'],
+                       int(data['num_docs']))
+
+    def search(self, text_query, top_k=10):
+        """
+        Scores every image containing a query term.
+
+        Returns:
+            tuple: (ids, scores) as arrays, best first; empty if nothing matches.
+        """
+        term_ids = {self.vocab[t] for t in tokenize(text_query) if t in self.vocab}
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for t in term_ids:
+            start, end = self.indptr[t], self.indptr[t + 1]
+            # Each image appears at most once per term, so plain fancy-index add is safe.
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        order = np.argsort(-scores[candidates], kind='stable')
+        return candidates[order], scores[candidates[order]]
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=RRF_K, with_scores=False):
+    """
+    Merges several ranked id lists: each id scores sum(1 / (k + rank)).
+
+    Args:
+        rankings (list[list[int]]): Ranked ids, best first, one list per retriever.
+        top_k (int): How many fused ids to return.
+        with_scores (bool): Also return the fused score of each id.
+
+    Returns:
+        list[int]: The fused ranking, or (ids, scores) with `with_scores`.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] += 1.0 / (k + rank + 1)
+    ids = sorted(fused, key=lambda doc_id: -fused[doc_id])[:top_k]
+    if with_scores:
+        return ids, [fused[doc_id] for doc_id in ids]
+    return ids
+
+
+def load_coco_documents(annotations_dir, image_paths, split='val2017'):
+    """
+    Builds one caption/tag document per image from the COCO annotation files.
+
+    Args:
+        annotations_dir (str): The COCO `annotations` directory.
+        image_paths (list[str]): The indexed images, in index-id order.
+
+    Returns:
+        list[str] or None: documents aligned with image_paths, or None if no
+        annotation files were found.
+    """
+    texts = defaultdict(list)
+    found = False
+
+    captions_path = os.path.join(annotations_dir, f'captions_{split}.json')
+    if os.path.exists(captions_path):
+        found = True
+        with open(captions_path) as f:
+            captions = json.load(f)
+        file_names = {image['id']: image['file_name'] for image in captions['images']}
+        for annotation in captions['annotations']:
+            texts[file_names[annotation['image_id']]].append(annotation['caption'])
+
+    instances_path = os.path.join(annotations_dir, f'instances_{split}.json')
+    if os.path.exists(instances_path):
+        found = True
+        with open(instances_path) as f:
+            instances = json.load(f)
+        file_names = {image['id']: image['file_name'] for image in instances['images']}
+        categories = {category['id']: category['name'] for category in instances['categories']}
+        tags = defaultdict(set)
+        for annotation in instances['annotations']:
+            tags[file_names[annotation['image_id']]].add(categories[annotation['category_id']])
+        for file_name, names in tags.items():
+            texts[file_name].extend(sorted(names) * TAG_WEIGHT)
+
+    if not found:
+        return None
+    return [" ".join(texts.get(os.path.basename(path), [])) for path in image_paths]
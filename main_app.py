@@ -2,29 +2,51 @@
 
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import threading
 import queue
-import spacy
+import time
 
 # --- IMPORT YOUR EXISTING MODULES ---
 # These are your completed .py files that act as tools for this main app.
-from realtimesttfinal import MicrophoneStream, listen_print_loop, SAMPLE_RATE, CHUNK_SIZE
-from search_engine import search_images
+from realtimesttfinal import MicrophoneStream
+from stream_pipeline import GoogleStreamingRecognizer, StreamPipeline
+import search_client
+from search_client import search_images_stream
+from metrics import REGISTRY, observe, span, trace
+import query_log
+import warmup
+from thumbnails import iter_thumbnails
+from text_processing import extract_keywords, load_nlp
 
 # These are for the voice recognition part
 from google.oauth2 import service_account
 from google.cloud import speech
 
 # --- GLOBAL SETUP ---
-# Load the NLP model once at the start.
-print("Loading NLP model...")
-nlp = spacy.load("en_core_web_sm")
-print("NLP model loaded.")
+# Load the NLP model once at the start, unless a shared search server
+# (search_server.py) is running and already owns it.
+if search_client.server_available():
+    print("Using the shared search server for NLP and search.")
+    nlp = None
+else:
+    print("Loading NLP model...")
+    nlp = load_nlp()
+    print("NLP model loaded.")
 
 # A queue is a safe way to pass messages from the background voice thread to the main GUI thread.
 gui_queue = queue.Queue()
 
+# Where the GUI periodically dumps its latency metrics, so the dashboard's
+# "Pipeline Metrics" page can show this process too. Set to None to disable.
+METRICS_EXPORT_PATH = 'metrics.json'
+METRICS_EXPORT_INTERVAL_MS = 10000
+# How often the GUI drains the message queue. Short, so thumbnails appear
+# as soon as they are decoded.
+QUEUE_POLL_INTERVAL_MS = 20
+# Precompute the most popular queries in the background at startup (see warmup.py).
+WARMUP_ON_START = True
+
 
 # --- BACKGROUND LOGIC ---
 # This section defines the work that happens behind the scenes.
@@ -33,22 +55,36 @@ def process_voice_command(transcript):
     """
     This is the "brain" that connects voice to search. It runs in the background.
     """
-    doc = nlp(transcript.lower())
-    keywords = [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
-
-    if not keywords:
-        gui_queue.put(("status", "Could not find keywords. Please try again."))
-        return
-
-    search_query = " ".join(keywords)
-    # Send a status update to the GUI
-    gui_queue.put(("status", f"Searching for: '{search_query}'..."))
-
-    # Perform the search
-    found_images = search_images(search_query, top_k=9)
-
-    # Send the results and a final status update back to the GUI
-    gui_queue.put(("results", found_images))
+    with trace():
+        with span('spacy'):
+            if nlp is not None:
+                keywords = extract_keywords(nlp, transcript)
+            else:
+                keywords = search_client.extract_keywords(transcript)
+
+        if not keywords:
+            gui_queue.put(("status", "Could not find keywords. Please try again."))
+            return
+
+        search_query = " ".join(keywords)
+        # Send a status update to the GUI
+        gui_queue.put(("status", f"Searching for: '{search_query}'..."))
+
+        # Perform the search, streaming each phase of results to the GUI as it
+        # arrives: first the layout, then every thumbnail as soon as it is decoded.
+        gui_queue.put(("query_started", time.perf_counter()))
+        decoded = set()
+        for update in search_images_stream(search_query, top_k=9, transcript=transcript):
+            gui_queue.put(("results", update.paths))
+            # A re-ranked update mostly reuses images the GUI already has.
+            for _, path, image, error in iter_thumbnails([p for p in update.paths if p not in decoded]):
+                decoded.add(path)
+                if image is None:
+                    print(f"Error displaying image {path}: {error}")
+                    continue
+                gui_queue.put(("thumbnail", (path, image)))
+
+    # Send a final status update back to the GUI
     gui_queue.put(("status", "Ready. Speak your next command."))
 
 
@@ -75,11 +111,16 @@ def voice_recognition_thread():
         streaming_config = speech.StreamingRecognitionConfig(config=config, interim_results=True)
 
         with MicrophoneStream(SAMPLE_RATE, CHUNK_SIZE) as stream:
-            audio_generator = stream.generator()
-            requests = (speech.StreamingRecognizeRequest(audio_content=content) for content in audio_generator)
-            responses = client.streaming_recognize(streaming_config, requests)
-            # This loop will now send its results to our new process_voice_command function
-            listen_print_loop(responses, process_voice_command)
+            # The pipeline rolls over to a fresh stream before the API's time
+            # limit and reconnects with backoff after errors, so listening
+            # never dies; final transcripts go to process_voice_command.
+            pipeline = StreamPipeline(
+                stream.buffer,
+                GoogleStreamingRecognizer(client, streaming_config),
+                process_voice_command,
+                on_status=lambda message: gui_queue.put(("status", message)),
+            )
+            pipeline.run()
     except Exception as e:
         print(f"FATAL ERROR in voice thread: {e}")
         gui_queue.put(("status", f"VOICE ERROR: {e}"))
@@ -102,47 +143,84 @@ class ImageSearchApp(tk.Tk):
         self.results_frame = ttk.Frame(self)
         self.results_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         self.image_labels = []
+        # The grid slot showing each path, and the PhotoImages painted so far
+        # for the current results, reused when the results are re-ranked.
+        self.slots = {}
+        self.photos = {}
+        self.query_started = None
 
         # Start a recurring check of the message queue
         self.process_queue()
+        self.export_metrics()
 
     def process_queue(self):
-        """Checks the queue for messages from the background thread and updates the GUI."""
+        """Drains the queue of messages from the background thread and updates the GUI."""
         try:
-            message_type, data = gui_queue.get(block=False)
-            if message_type == "status":
-                self.status_label.config(text=data)
-            elif message_type == "results":
-                self.display_images(data)
+            while True:
+                message_type, data = gui_queue.get(block=False)
+                if message_type == "status":
+                    self.status_label.config(text=data)
+                elif message_type == "query_started":
+                    self.query_started = data
+                elif message_type == "results":
+                    self.display_images(data)
+                elif message_type == "thumbnail":
+                    self.display_thumbnail(*data)
         except queue.Empty:
-            # If the queue is empty, do nothing
+            # Nothing left for now
             pass
         finally:
-            # Schedule this function to run again after 100ms
-            self.after(100, self.process_queue)
+            self.after(QUEUE_POLL_INTERVAL_MS, self.process_queue)
+
+    def export_metrics(self):
+        """Periodically writes the latency metrics of this process to disk."""
+        if METRICS_EXPORT_PATH is None:
+            return
+        try:
+            REGISTRY.write_json(METRICS_EXPORT_PATH)
+        except OSError as e:
+            print(f"Could not export metrics to {METRICS_EXPORT_PATH}: {e}")
+        self.after(METRICS_EXPORT_INTERVAL_MS, self.export_metrics)
 
     def display_images(self, image_paths):
-        """Clears the old images and displays the new ones found from the search."""
+        """
+        Lays out a grid slot for each result. Thumbnails already painted for
+        these paths are shown immediately; the rest arrive via display_thumbnail.
+        """
         # Clear any previous images
         for label in self.image_labels:
             label.destroy()
         self.image_labels.clear()
+        self.slots.clear()
+        self.photos = {path: photo for path, photo in self.photos.items() if path in image_paths}
 
-        # Display the new set of images in a 3-column grid
+        # Lay out the new set of images in a 3-column grid
         for i, path in enumerate(image_paths):
-            try:
-                img = Image.open(path)
-                img.thumbnail((150, 150))  # Create a thumbnail
-                photo = ImageTk.PhotoImage(img)
-
-                label = ttk.Label(self.results_frame, image=photo, padding=5)
-                label.image = photo  # Important: Keep a reference to avoid garbage collection!
-
-                row, col = divmod(i, 3)  # Arrange in a grid
-                label.grid(row=row, column=col, padx=5, pady=5)
-                self.image_labels.append(label)
-            except Exception as e:
-                print(f"Error displaying image {path}: {e}")
+            label = ttk.Label(self.results_frame, text="Loading...", width=20, anchor="center", padding=5)
+            row, col = divmod(i, 3)  # Arrange in a grid
+            label.grid(row=row, column=col, padx=5, pady=5)
+            self.image_labels.append(label)
+            self.slots[path] = label
+            if path in self.photos:
+                self._paint(label, self.photos[path])
+
+    def display_thumbnail(self, path, image):
+        """Paints a decoded thumbnail into its slot, if it is still on screen."""
+        label = self.slots.get(path)
+        if label is None:
+            return
+        with span('paint'):
+            photo = ImageTk.PhotoImage(image)
+            self.photos[path] = photo
+            self._paint(label, photo)
+        if self.query_started is not None:
+            observe('time_to_first_image', time.perf_counter() - self.query_started)
+            self.query_started = None
+
+    @staticmethod
+    def _paint(label, photo):
+        label.config(image=photo, text="", width=0)
+        label.image = photo  # Important: Keep a reference to avoid garbage collection!
 
 
 # --- APPLICATION LAUNCH ---
@@ -154,5 +232,14 @@ if __name__ == '__main__':
     voice_thread = threading.Thread(target=voice_recognition_thread, daemon=True)
     voice_thread.start()
 
-    # 3. Start the GUI event loop (this makes the window appear and become interactive)
-    app.mainloop()
\ No newline at end of file
+    # 3. Warm the search cache with popular queries while the user gets ready to speak
+    if WARMUP_ON_START:
+        warmup.warm_up_in_background()
+
+    # 4. Start the GUI event loop (this makes the window appear and become interactive)
+    app.mainloop()
+
+    # 5. Flush the searches still waiting to be logged, and keep the warm cache for next time.
+    if search_client.QUERY_LOG_ENABLED:
+        query_log.get_writer().close()
+    warmup.save_local_cache()
\ No newline at end of file
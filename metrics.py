@@ -0,0 +1,243 @@
+# metrics.py
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# --- Configuration ---
+# How many recent samples each stage keeps for percentile estimates.
+# Older samples still count towards `count` and `sum`, but not the quantiles.
+WINDOW_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = 'voice_search'
+
+# The pipeline stages we time, in the order a voice query flows through them.
+PIPELINE_STAGES = (
+    'audio_capture',
+    'stt_final',
+    'spacy',
+    'text_encode',
+    'faiss_search',
+    'lexical_search',
+    'map_lookup',
+    'image_decode',
+    'paint',
+    'time_to_first_image',
+)
+
+
+class Histogram:
+    """A thread-safe latency histogram over a sliding window of samples."""
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Records a single duration, in seconds."""
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """
+        Returns the q-th quantile (0 <= q <= 1) of the current window,
+        linearly interpolated between the closest ranks.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        return _interpolate(samples, q)
+
+    def summary(self):
+        """Returns count, sum, max and the configured quantiles as a dict."""
+        with self._lock:
+            samples = sorted(self._samples)
+            summary = {'count': self.count, 'sum': self.sum, 'max': self.max}
+        for q in QUANTILES:
+            summary[_quantile_key(q)] = _interpolate(samples, q)
+        return summary
+
+
+def _interpolate(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    position = q * (len(sorted_samples) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    fraction = position - lower
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * fraction
+
+
+def _quantile_key(q):
+    return f"p{round(q * 100):d}"
+
+
+class MetricsRegistry:
+    """Holds the per-stage histograms and plain counters for one process."""
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self._window_size = window_size
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        """Returns the histogram for a stage, creating it on first use."""
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = Histogram(self._window_size)
+            return hist
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """
+        Returns a JSON-serialisable view of every histogram and counter.
+
+        Returns:
+            dict: {'stages': {stage: summary}, 'counters': {name: value}}
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            'generated_at': time.time(),
+            'stages': {stage: hist.summary() for stage, hist in sorted(histograms.items())},
+            'counters': counters,
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} Latency of each voice search pipeline stage.")
+        lines.append(f"# TYPE {name} summary")
+        for stage, summary in snapshot['stages'].items():
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {summary[_quantile_key(q)]:.9f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {summary["sum"]:.9f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+
+        for counter, value in sorted(snapshot['counters'].items()):
+            counter_name = f"{METRIC_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {counter_name} counter")
+            lines.append(f"{counter_name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        """Atomically writes the current snapshot to `path`."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_json(indent=2))
+        os.replace(tmp_path, path)
+
+
+# The registry every module in this process records into.
+REGISTRY = MetricsRegistry()
+
+# Per-request stage timings, so one query can be reported as a whole.
+_current_trace = ContextVar('current_trace', default=None)
+# Worker threads running in a copy of the caller's context share its trace.
+_trace_lock = threading.Lock()
+
+
+@contextmanager
+def span(stage, registry=None):
+    """
+    Times the enclosed block and records it under `stage`.
+
+    Usage:
+        with span('faiss_search'):
+            distances, indices = index.search(query, top_k)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        (registry or REGISTRY).observe(stage, elapsed)
+        add_to_trace({stage: elapsed})
+
+
+@contextmanager
+def trace():
+    """
+    Collects the stage timings of every span entered inside the block, e.g.
+    for logging one query end to end. Spans on other threads count too when
+    their work was submitted with `contextvars.copy_context().run`.
+
+    Usage:
+        with trace() as timings:
+            search_images("dog")
+        print(timings)  # {'text_encode': 0.011, 'faiss_search': 0.002, ...}
+    """
+    timings = {}
+    token = _current_trace.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_trace.reset(token)
+
+
+def add_to_trace(timings):
+    """
+    Adds stage timings to the current trace, if there is one. Used for
+    timings measured elsewhere, e.g. returned by the search server.
+    """
+    trace_timings = _current_trace.get()
+    if trace_timings is None:
+        return
+    with _trace_lock:
+        for stage, seconds in timings.items():
+            trace_timings[stage] = trace_timings.get(stage, 0.0) + seconds
+
+
+def trace_timings():
+    """Returns a copy of the current trace's timings so far, or {} outside a trace."""
+    trace_timings = _current_trace.get()
+    if trace_timings is None:
+        return {}
+    with _trace_lock:
+        return dict(trace_timings)
+
+
+def observe(stage, seconds):
+    REGISTRY.observe(stage, seconds)
+
+
+def increment(name, value=1):
+    REGISTRY.increment(name, value)
+
+
+if __name__ == '__main__':
+    # Quick smoke test of the exporters.
+    for i in range(100):
+        observe('faiss_search', i / 1000)
+    print(REGISTRY.to_prometheus())
@@ -0,0 +1,380 @@
+# query_log.py
+
+"""
+Append-only log of what users search for, and a tool to replay it.
+
+    python query_log.py dump query_logs/
+    python query_log.py replay query_logs/ --rate 20 [--sample 0.1] [--server]
+
+Writing is off the search path: `QueryLogWriter.log()` only enqueues the
+record, and a background thread appends whole batches as one block. When
+the queue is full, records are dropped and counted (`query_log_dropped`)
+rather than slowing a search down.
+
+File format (*.qlog, integers big-endian like search_protocol):
+
+    file   := MAGIC block*
+    block  := uint32 body_length + body
+    body   := uint32 n
+              float64[n]        timestamps (unix seconds)
+              string list       transcripts
+              string list       normalized queries
+              uint16[n]         result counts k_i
+              int64[sum k_i]    result ids, best first
+              float32[sum k_i]  result scores
+              string list       stage names (S of them)
+              float32[n * S]    stage timings in seconds, NaN where absent
+
+Blocks are columnar, so a reader after, say, only the queries can skip
+straight past the rest. A new file is started once the current one
+exceeds `rotate_bytes`.
+"""
+
+import argparse
+import glob
+import math
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import MetricsRegistry, increment, span
+from search_protocol import pack_strings, unpack_strings
+
+# --- Configuration ---
+QUERY_LOG_DIR = os.environ.get('VOICE_SEARCH_QUERY_LOG', 'query_logs')
+ROTATE_BYTES = 64 * 1024 * 1024
+FLUSH_INTERVAL = 1.0         # seconds a record may wait before its batch is written
+MAX_BATCH = 512
+QUEUE_SIZE = 10_000
+REPLAY_WORKERS = 8
+TOP_K = 9
+
+MAGIC = b'QLOG\x01\n'
+FILE_SUFFIX = '.qlog'
+
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+
+QueryRecord = namedtuple('QueryRecord', ['timestamp', 'transcript', 'query', 'ids', 'scores', 'timings'])
+
+
+# --- Encoding ---
+
+def encode_block(records):
+    """Packs a batch of QueryRecords into one columnar block (without the length prefix)."""
+    n = len(records)
+    counts = [len(r.ids) for r in records]
+    ids = [int(i) for r in records for i in r.ids]
+    scores = [float(s) for r in records for s in r.scores]
+    stages = sorted({stage for r in records for stage in r.timings})
+    timings = [r.timings.get(stage, math.nan) for r in records for stage in stages]
+    return b''.join((
+        _U32.pack(n),
+        struct.pack(f'!{n}d', *(r.timestamp for r in records)),
+        pack_strings([r.transcript or '' for r in records]),
+        pack_strings([r.query for r in records]),
+        struct.pack(f'!{n}H', *counts),
+        struct.pack(f'!{len(ids)}q', *ids),
+        struct.pack(f'!{len(scores)}f', *scores),
+        pack_strings(stages),
+        struct.pack(f'!{len(timings)}f', *timings),
+    ))
+
+
+def decode_block(body):
+    """Unpacks a block written by encode_block into a list of QueryRecords."""
+    (n,) = _U32.unpack_from(body)
+    offset = _U32.size
+    timestamps = struct.unpack_from(f'!{n}d', body, offset)
+    offset += 8 * n
+    transcripts, offset = unpack_strings(body, offset)
+    queries, offset = unpack_strings(body, offset)
+    counts = struct.unpack_from(f'!{n}H', body, offset)
+    offset += 2 * n
+    total = sum(counts)
+    ids = struct.unpack_from(f'!{total}q', body, offset)
+    offset += 8 * total
+    scores = struct.unpack_from(f'!{total}f', body, offset)
+    offset += 4 * total
+    stages, offset = unpack_strings(body, offset)
+    timings = struct.unpack_from(f'!{n * len(stages)}f', body, offset)
+
+    records, start = [], 0
+    for i in range(n):
+        row = timings[i * len(stages):(i + 1) * len(stages)]
+        records.append(QueryRecord(
+            timestamps[i], transcripts[i], queries[i],
+            list(ids[start:start + counts[i]]), list(scores[start:start + counts[i]]),
+            {stage: t for stage, t in zip(stages, row) if not math.isnan(t)},
+        ))
+        start += counts[i]
+    return records
+
+
+# --- Writing ---
+
+class QueryLogWriter(threading.Thread):
+    """
+    Background writer for the query log.
+
+    Args:
+        directory (str): Where the .qlog files go.
+        rotate_bytes (int): Start a new file once the current one is this big.
+        flush_interval (float): Longest time a record waits before being written.
+        max_batch (int): Most records written in one block.
+        queue_size (int): Records buffered before new ones are dropped.
+    """
+
+    def __init__(self, directory=QUERY_LOG_DIR, rotate_bytes=ROTATE_BYTES, flush_interval=FLUSH_INTERVAL,
+                 max_batch=MAX_BATCH, queue_size=QUEUE_SIZE):
+        super().__init__(name='query-log-writer', daemon=True)
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._sequence = 0
+        self._closed = False
+
+    def log(self, transcript, query, ids=(), scores=(), timings=None, timestamp=None):
+        """Queues one search for writing. Never blocks."""
+        if self._closed:
+            return
+        record = QueryRecord(time.time() if timestamp is None else timestamp, transcript, query,
+                             list(ids), list(scores), dict(timings or {}))
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            increment('query_log_dropped')
+
+    def run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            records = [r for r in batch if r is not None]
+            if records:
+                try:
+                    self._write(records)
+                except OSError as e:
+                    increment('query_log_dropped', len(records))
+                    print(f"Could not write {len(records)} query log records: {e}")
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _write(self, records):
+        if self._file is None or self._file.tell() >= self.rotate_bytes:
+            self._rotate()
+        body = encode_block(records)
+        self._file.write(_U32.pack(len(body)) + body)
+        self._file.flush()
+        increment('query_log_records', len(records))
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"queries-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:04d}{FILE_SUFFIX}"
+        self._file = open(os.path.join(self.directory, name), 'wb')
+        self._file.write(MAGIC)
+
+    def close(self, timeout=5.0):
+        """Writes whatever is still queued and stops the thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(directory=QUERY_LOG_DIR):
+    """Returns the process-wide writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = QueryLogWriter(directory)
+            _writer.start()
+        return _writer
+
+
+# --- Reading ---
+
+def log_files(path):
+    """Lists the .qlog files at `path` (a file or a directory), oldest first."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f'*{FILE_SUFFIX}')))
+    return [path]
+
+
+def read_log(path):
+    """
+    Yields every QueryRecord under `path`, in the order they were written.
+    A block cut short by a crash ends that file quietly.
+    """
+    for file_path in log_files(path):
+        with open(file_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                print(f"Skipping '{file_path}': not a query log")
+                continue
+            while True:
+                header = f.read(_U32.size)
+                if len(header) < _U32.size:
+                    break
+                (length,) = _U32.unpack(header)
+                body = f.read(length)
+                if len(body) < length:
+                    break
+                yield from decode_block(body)
+
+
+# --- Replay ---
+
+def replay(records, search_fn, rate=None, speedup=1.0, workers=REPLAY_WORKERS):
+    """
+    Re-issues logged queries against a search function.
+
+    Queries are sent open-loop: each is started at its scheduled time, on a
+    worker pool, however long the earlier ones take, so a slower index shows
+    up as higher latency instead of a lower offered rate.
+
+    Args:
+        records (list[QueryRecord]): The queries to replay, in order.
+        search_fn (callable): search_fn(query) -> result ids, best first.
+        rate (float): Queries per second; if None, the logged inter-arrival
+            times are kept, divided by `speedup`.
+        speedup (float): Replay speed relative to the original traffic.
+        workers (int): Concurrent searches allowed.
+
+    Returns:
+        dict: Offered/achieved QPS, latency percentiles, errors, and the
+        mean overlap of the new top-k with the logged one.
+    """
+    registry = MetricsRegistry(window_size=max(1, len(records)))
+    overlaps, errors = [], []
+
+    def run_one(record):
+        try:
+            with span('replay_search', registry=registry):
+                ids = search_fn(record.query)
+        except Exception as e:
+            errors.append(e)
+            return
+        if record.ids:
+            logged = set(record.ids)
+            overlaps.append(len(logged.intersection(ids[:len(logged)])) / len(logged))
+
+    if rate:
+        offsets = [i / rate for i in range(len(records))]
+    else:
+        first = records[0].timestamp if records else 0.0
+        offsets = [(r.timestamp - first) / speedup for r in records]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replay') as pool:
+        for record, offset in zip(records, offsets):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_one, record)
+    elapsed = time.perf_counter() - start
+
+    summary = registry.snapshot()['stages'].get('replay_search', {})
+    return {
+        'queries': len(records),
+        'errors': len(errors),
+        'offered_qps': len(records) / offsets[-1] if len(records) > 1 and offsets[-1] > 0 else None,
+        'achieved_qps': len(records) / elapsed if elapsed > 0 else None,
+        'p50_ms': summary.get('p50', 0.0) * 1000,
+        'p95_ms': summary.get('p95', 0.0) * 1000,
+        'p99_ms': summary.get('p99', 0.0) * 1000,
+        'mean_overlap_at_k': sum(overlaps) / len(overlaps) if overlaps else None,
+    }
+
+
+def _final_ids(updates):
+    ids = []
+    for update in updates:
+        ids = update.ids
+    return list(ids)
+
+
+def make_search_fn(use_server=False, top_k=TOP_K):
+    """
+    Builds a search_fn for `replay` against the search server or an
+    in-process engine. The result cache is bypassed: logged queries repeat,
+    and a replay should time (and compare) real searches.
+    """
+    if use_server:
+        from search_client import get_client
+        client = get_client()
+        if client is None:
+            raise RuntimeError("No search server is running")
+        return lambda query: _final_ids(client.search_images_stream(query, top_k=top_k, use_cache=False))
+
+    import search_engine
+    return lambda query: _final_ids(search_engine.search_images_stream(query, top_k=top_k, use_cache=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or replay the query log.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    dump = sub.add_parser('dump', help="Print logged queries.")
+    dump.add_argument('path', nargs='?', default=QUERY_LOG_DIR)
+
+    rep = sub.add_parser('replay', help="Replay logged queries against a search engine.")
+    rep.add_argument('path', nargs='?', default=QUERY_LOG_DIR)
+    rep.add_argument('--rate', type=float, help="Fixed queries per second (default: original timing).")
+    rep.add_argument('--speedup', type=float, default=1.0, help="Speed factor on the original timing.")
+    rep.add_argument('--sample', type=float, default=1.0, help="Fraction of the log to replay.")
+    rep.add_argument('--limit', type=int, help="Replay at most this many queries.")
+    rep.add_argument('--workers', type=int, default=REPLAY_WORKERS)
+    rep.add_argument('--top-k', type=int, default=TOP_K)
+    rep.add_argument('--server', action='store_true', help="Send queries to the running search server.")
+    rep.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    records = read_log(args.path)
+    if args.command == 'dump':
+        for r in records:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.timestamp))
+            total = sum(r.timings.values())
+            print(f"{stamp}  {r.query!r:40}  {len(r.ids)} results  {total * 1000:7.1f} ms  ({r.transcript!r})")
+        return 0
+
+    rng = random.Random(args.seed)
+    records = [r for r in records if r.query and rng.random() < args.sample]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("Nothing to replay.")
+        return 1
+
+    print(f"Replaying {len(records)} queries...")
+    result = replay(records, make_search_fn(args.server, args.top_k), args.rate, args.speedup, args.workers)
+    for key, value in result.items():
+        print(f"  {key:18} {value if value is None or isinstance(value, int) else f'{value:.3f}'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,28 @@
-import queue
 import re
 import sys
 import threading
+import time
 # Add this new import for the credentials
 from google.oauth2 import service_account
 
 import numpy as np
 import sounddevice as sd
 from google.cloud import speech
-import spacy
-from search_engine import search_images
-
-# Load the spaCy model once when the script starts.
-print("Loading NLP model...")
-nlp = spacy.load("en_core_web_sm")
-print("NLP model loaded.")
+import search_client
+from search_client import search_images_stream
+from metrics import observe, span, trace
+from stream_pipeline import MAX_BUFFERED_CHUNKS, AudioBuffer, GoogleStreamingRecognizer, StreamPipeline
+from text_processing import extract_keywords, load_nlp
+
+# Load the spaCy model once when the script starts, unless a shared
+# search server (search_server.py) is running and already owns it.
+if search_client.server_available():
+    print("Using the shared search server for NLP and search.")
+    nlp = None
+else:
+    print("Loading NLP model...")
+    nlp = load_nlp()
+    print("NLP model loaded.")
 
 # Audio recording parameters
 SAMPLE_RATE = 16000
@@ -24,12 +32,19 @@ CHUNK_SIZE = int(SAMPLE_RATE / 10)  # 100ms
 class MicrophoneStream:
     """Opens a recording stream as a generator yielding the audio chunks."""
 
-    def __init__(self, rate, chunk):
+    def __init__(self, rate, chunk, max_buffered_chunks=MAX_BUFFERED_CHUNKS):
         self._rate = rate
         self._chunk = chunk
-        self._buff = queue.Queue()
+        # Bounded: if nothing reads the microphone (e.g. while the recognizer
+        # reconnects), the oldest audio is dropped instead of piling up.
+        self._buff = AudioBuffer(max_buffered_chunks)
         self.closed = True
 
+    @property
+    def buffer(self):
+        """The AudioBuffer the captured chunks go into, e.g. for a StreamPipeline."""
+        return self._buff
+
     def __enter__(self):
         self._audio_interface = sd.InputStream(
             samplerate=self._rate,
@@ -47,7 +62,7 @@ class MicrophoneStream:
         self._audio_interface.stop()
         self._audio_interface.close()
         self.closed = True
-        self._buff.put(None)
+        self._buff.close()
         print("🎤 Microphone stream closed.")
 
     def _fill_buffer(self, indata, frames, time, status):
@@ -57,87 +72,19 @@ class MicrophoneStream:
         self.put(indata.tobytes())
 
     def put(self, data):
-        """Adds data to the buffer."""
+        """Adds data to the buffer, stamped with its capture time."""
         self._buff.put(data)
 
     def generator(self):
         """A generator function that yields audio chunks from the buffer."""
         while not self.closed:
-            chunk = self._buff.get()
-            if chunk is None:
+            batch = self._buff.get_batch()
+            if batch is None:
                 return
-            data = [chunk]
-
-            while True:
-                try:
-                    chunk = self._buff.get(block=False)
-                    if chunk is None:
-                        return
-                    data.append(chunk)
-                except queue.Empty:
-                    break
-
-            yield b"".join(data)
-
-
-
-def listen_print_loop(responses, callback):  # <-- MODIFIED: Add a callback parameter
-    """
-    Iterates through server responses, prints them, and calls a callback
-    on the final transcript.
-    """
-    for response in responses:
-        if not response.results:
-            continue
-
-        result = response.results[0]
-        if not result.alternatives:
-            continue
-
-        transcript = result.alternatives[0].transcript
-
-        if result.is_final:
-            # Display the final transcript and clean up the line.
-            sys.stdout.write(f"\r{transcript}\n")
-
-            # --- NEW PART ---
-            # Instead of just printing, send the final transcript to our processor
-            callback(transcript)
-            # ----------------
-        else:
-            # Display the partial transcript
-            sys.stdout.write(f"\r{transcript}" + " " * 20)
-            sys.stdout.flush()
-
-
-# --- NEW FUNCTION ---
-def listen_print_loop(responses, callback):  # <-- MODIFIED: Add a callback parameter
-    """
-    Iterates through server responses, prints them, and calls a callback
-    on the final transcript.
-    """
-    for response in responses:
-        if not response.results:
-            continue
-
-        result = response.results[0]
-        if not result.alternatives:
-            continue
-
-        transcript = result.alternatives[0].transcript
-
-        if result.is_final:
-            # Display the final transcript and clean up the line.
-            sys.stdout.write(f"\r{transcript}\n")
-
-            # --- NEW PART ---
-            # Instead of just printing, send the final transcript to our processor
-            callback(transcript)
-            # ----------------
-        else:
-            # Display the partial transcript
-            sys.stdout.write(f"\r{transcript}" + " " * 20)
-            sys.stdout.flush()
+            captured_at, data = batch
+            # How long the oldest chunk in this batch waited to be sent.
+            observe('audio_capture', time.perf_counter() - captured_at)
+            yield data
 
 
 # --- NEW FUNCTION ---
@@ -147,24 +94,28 @@ def process_voice_command(transcript):
     processes it, and triggers the image search.
     """
     print(f"🤖 Processing command: '{transcript}'")
-    doc = nlp(transcript.lower())
-    keywords = []
-    for token in doc:
-        if not token.is_stop and not token.is_punct:
-            keywords.append(token.lemma_)
+    # Traced end to end, so the query log gets this command's stage timings.
+    with trace():
+        with span('spacy'):
+            if nlp is not None:
+                keywords = extract_keywords(nlp, transcript)
+            else:
+                keywords = search_client.extract_keywords(transcript)
 
         if not keywords:
             print("Could not extract any meaningful keywords.")
             return
-    print(f"🔑 Extracted Keywords: {keywords}")
-    # find_and_display_images(keywords) will be called from here later
-    # --- INTEGRATION POINT ---
-    # Join the keywords to form a clean search query.
-    search_query = " ".join(keywords)
-    print(f"🔎 Performing semantic search for: '{search_query}'")
-
-    # Call your new search function!
-    found_images = search_images(search_query, top_k=5)
+        print(f"🔑 Extracted Keywords: {keywords}")
+        # find_and_display_images(keywords) will be called from here later
+        # --- INTEGRATION POINT ---
+        # Join the keywords to form a clean search query.
+        search_query = " ".join(keywords)
+        print(f"🔎 Performing semantic search for: '{search_query}'")
+
+        # Call your new search function! Only the final ranking is printed.
+        found_images = []
+        for update in search_images_stream(search_query, top_k=5, transcript=transcript):
+            found_images = update.paths
 
     print("\n--- Search Results ---")
     for image_path in found_images:
@@ -193,17 +144,14 @@ def main():
 
     try:
         with MicrophoneStream(SAMPLE_RATE, CHUNK_SIZE) as stream:
-            audio_generator = stream.generator()
-            requests = (
-                speech.StreamingRecognizeRequest(audio_content=content)
-                for content in audio_generator
+            # Keeps recognizing across the API's stream time limit and
+            # network errors, until the microphone closes.
+            pipeline = StreamPipeline(
+                stream.buffer,
+                GoogleStreamingRecognizer(client, streaming_config),
+                process_voice_command,
             )
-
-            responses = client.streaming_recognize(streaming_config, requests)
-
-            # --- MODIFIED FUNCTION CALL ---
-            # We now pass our new 'process_voice_command' function as the callback.
-            listen_print_loop(responses, process_voice_command)
+            pipeline.run()
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,148 @@
+# result_cache.py
+
+"""
+Bounded caches of query embeddings and search results, saved to disk so a
+restarted searcher starts warm (see warmup.py).
+
+Results are only valid for the index files that produced them, so every
+entry is keyed by the index fingerprint (index_store.fingerprint) and
+anything from another build, even one rebuilt in place, is a miss.
+Embeddings depend only on the text encoder and survive index swaps.
+"""
+
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# --- Configuration ---
+RESULT_CACHE_PATH = os.environ.get('VOICE_SEARCH_CACHE', 'search_cache.pkl')
+MAX_RESULTS = 4096
+MAX_EMBEDDINGS = 4096
+CACHE_FORMAT = 2
+
+
+class _LRU:
+    """A least-recently-used map; not thread-safe on its own."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def items(self):
+        return list(self._data.items())
+
+    def discard_if(self, predicate):
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """
+    Thread-safe embedding and result caches for one search engine.
+
+    Args:
+        max_results (int): Search results kept, least recently used dropped first.
+        max_embeddings (int): Query embeddings kept.
+    """
+
+    def __init__(self, max_results=MAX_RESULTS, max_embeddings=MAX_EMBEDDINGS):
+        self._results = _LRU(max_results)
+        self._embeddings = _LRU(max_embeddings)
+        self._lock = threading.Lock()
+
+    # --- Results ---
+
+    def get_results(self, fingerprint, text_query, top_k, mode):
+        with self._lock:
+            return self._results.get((fingerprint, mode, top_k, text_query))
+
+    def put_results(self, fingerprint, text_query, top_k, mode, update):
+        with self._lock:
+            self._results.put((fingerprint, mode, top_k, text_query), update)
+
+    def retain_index(self, fingerprint):
+        """Drops every result that doesn't belong to the index `fingerprint`."""
+        with self._lock:
+            self._results.discard_if(lambda key: key[0] != fingerprint)
+
+    # --- Embeddings ---
+
+    def get_embedding(self, text_query):
+        with self._lock:
+            return self._embeddings.get(text_query)
+
+    def put_embedding(self, text_query, vector):
+        with self._lock:
+            self._embeddings.put(text_query, vector)
+
+    # --- Persistence ---
+
+    def stats(self):
+        with self._lock:
+            return {'results': len(self._results), 'embeddings': len(self._embeddings)}
+
+    def save(self, path, encoder):
+        """
+        Atomically writes both caches to `path`.
+
+        Args:
+            encoder (str): Names the text encoder, so embeddings from a
+                different model are never loaded back.
+        """
+        with self._lock:
+            data = {
+                'format': CACHE_FORMAT,
+                'encoder': encoder,
+                'results': self._results.items(),
+                'embeddings': self._embeddings.items(),
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path, encoder, fingerprint=None):
+        """
+        Loads a saved cache, keeping embeddings only if they came from the
+        same encoder and results only if they belong to the index `fingerprint`.
+
+        Returns:
+            int: How many entries were loaded.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Ignoring unreadable search cache '{path}': {e}")
+            return 0
+        if data.get('format') != CACHE_FORMAT or data.get('encoder') != encoder:
+            return 0
+
+        loaded = 0
+        with self._lock:
+            for text_query, vector in data['embeddings']:
+                self._embeddings.put(text_query, vector)
+                loaded += 1
+            for key, update in data['results']:
+                if fingerprint is None or key[0] == fingerprint:
+                    self._results.put(key, update)
+                    loaded += 1
+        return loaded
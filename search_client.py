@@ -0,0 +1,286 @@
+# search_client.py
+
+"""
+Thin client for search_server.py, used by every front end.
+
+The module-level `search_images`, `search_images_stream`,
+`search_images_batch` and `extract_keywords` go through the shared search
+server when one is running, and otherwise fall back to loading the models in
+this process, so front ends can call them without caring which mode they are
+in. Every search made through `search_images_stream` is also recorded in the
+query log (see query_log.py).
+"""
+
+import itertools
+import os
+import queue
+import socket
+import threading
+from concurrent.futures import Future
+
+import query_log
+import search_protocol as protocol
+from metrics import add_to_trace, span, trace_timings
+
+# --- Configuration ---
+REQUEST_TIMEOUT = 30.0
+# Record every search (transcript, query, results, stage timings) to the
+# query log in query_log.QUERY_LOG_DIR, for replay and analysis.
+QUERY_LOG_ENABLED = not os.environ.get('VOICE_SEARCH_NO_QUERY_LOG')
+
+
+class SearchServerError(RuntimeError):
+    """Raised when the server reports that a request failed."""
+
+
+class _StreamSink:
+    """Collects the partial frames of one streaming request, in Future's shape."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def push(self, payload):
+        self._queue.put(('partial', payload))
+
+    def set_result(self, payload):
+        self._queue.put(('done', payload))
+
+    def set_exception(self, error):
+        self._queue.put(('error', error))
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return 'error', TimeoutError("Timed out waiting for the search server")
+
+
+class SearchClient:
+    """
+    One persistent connection to the search server.
+
+    Requests from any number of threads are multiplexed over the same socket:
+    each gets a request id and a Future, and a background reader thread
+    resolves the futures as responses arrive, in whatever order.
+    """
+
+    def __init__(self, socket_path=protocol.SOCKET_PATH, timeout=REQUEST_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.closed = False
+        self._reader = threading.Thread(target=self._read_responses, name='search-client-reader', daemon=True)
+        self._reader.start()
+
+    def _read_responses(self):
+        error = ConnectionError("Search server closed the connection")
+        try:
+            while True:
+                frame = protocol.recv_frame(self._sock)
+                if frame is None:
+                    break
+                request_id, status, payload = frame
+                with self._pending_lock:
+                    if status == protocol.STATUS_PARTIAL:
+                        future = self._pending.get(request_id)
+                    else:
+                        future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if status == protocol.STATUS_PARTIAL:
+                    future.push(payload)
+                    continue
+                if status == protocol.STATUS_OK:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(SearchServerError(payload.decode('utf-8', 'replace')))
+        except (OSError, protocol.ProtocolError) as e:
+            error = ConnectionError(f"Search server connection lost: {e}")
+        finally:
+            self.closed = True
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(error)
+
+    def submit(self, opcode, payload=b'', future=None):
+        """
+        Sends a request without waiting for it. The future carries its
+        `request_id`, so a caller that gives up on it can `discard` it.
+
+        Returns:
+            Future: Resolves to the raw response payload.
+        """
+        if self.closed:
+            raise ConnectionError("Search client is closed")
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future = future or Future()
+        future.request_id = request_id
+        with self._pending_lock:
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self._sock.sendall(protocol.pack_frame(request_id, opcode, payload))
+        except OSError:
+            self.discard(future)
+            self.close()
+            raise
+        return future
+
+    def discard(self, future):
+        """Stops tracking a request; a late response to it is dropped."""
+        with self._pending_lock:
+            self._pending.pop(future.request_id, None)
+
+    def call(self, opcode, payload=b''):
+        future = self.submit(opcode, payload)
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            # Already gone unless we timed out; don't leak the entry then.
+            self.discard(future)
+
+    def stream(self, opcode, payload=b''):
+        """Sends a streaming request and yields each partial payload as it arrives."""
+        sink = self.submit(opcode, payload, future=_StreamSink())
+        try:
+            while True:
+                kind, value = sink.get(self.timeout)
+                if kind == 'partial':
+                    yield value
+                elif kind == 'done':
+                    return
+                else:
+                    raise value
+        finally:
+            # Covers timeouts and callers that stop iterating early.
+            self.discard(sink)
+
+    def ping(self):
+        self.call(protocol.OP_PING)
+
+    def search_images(self, text_query, top_k=5):
+        payload = self.call(protocol.OP_SEARCH, protocol.pack_search(text_query, top_k))
+        return protocol.unpack_strings(payload)[0]
+
+    def search_images_batch(self, text_queries, top_k=5):
+        payload = self.call(protocol.OP_SEARCH_BATCH, protocol.pack_search_batch(list(text_queries), top_k))
+        return protocol.unpack_string_lists(payload)
+
+    def search_images_stream(self, text_query, top_k=5, use_cache=None):
+        payload = protocol.pack_search_stream(text_query, top_k, use_cache)
+        for payload in self.stream(protocol.OP_SEARCH_STREAM, payload):
+            yield protocol.unpack_update(payload)
+
+    def extract_keywords(self, transcript):
+        return protocol.unpack_strings(self.call(protocol.OP_KEYWORDS, transcript.encode('utf-8')))[0]
+
+    def metrics_json(self):
+        return self.call(protocol.OP_METRICS).decode('utf-8')
+
+    def close(self):
+        self.closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+# --- Shared client ---
+# One connection per process, reused by every caller and re-opened if the
+# server restarts.
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(socket_path=protocol.SOCKET_PATH):
+    """
+    Returns the shared client, connecting on first use.
+
+    Returns:
+        SearchClient or None: None when no server is listening.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None and not _client.closed and _client.socket_path == socket_path:
+            return _client
+        if not os.path.exists(socket_path):
+            return None
+        try:
+            _client = SearchClient(socket_path)
+        except OSError:
+            return None
+        return _client
+
+
+def server_available(socket_path=protocol.SOCKET_PATH):
+    return get_client(socket_path) is not None
+
+
+# --- Local fallback ---
+# Only imported when there is no server, so a thin client never pays for
+# loading CLIP, FAISS or spaCy.
+
+def _local_search_engine():
+    import search_engine
+
+    return search_engine
+
+
+def search_images(text_query, top_k=5):
+    """Searches through the shared server if one is running, otherwise in-process."""
+    client = get_client()
+    if client is not None:
+        with span('search_rpc'):
+            return client.search_images(text_query, top_k)
+    return _local_search_engine().search_images(text_query, top_k=top_k)
+
+
+def search_images_stream(text_query, top_k=5, use_cache=None, transcript=None):
+    """
+    Yields SearchUpdates as results become available (see
+    search_engine.search_images_stream), through the server if one is running.
+    The server's stage timings are added to the caller's trace.
+
+    Once the final update has been consumed, the search is written to the
+    query log with `transcript` and the caller's trace so far, so wrap the
+    whole query in `metrics.trace()` to log its end-to-end timings.
+    """
+    client = get_client()
+    update = None
+    if client is not None:
+        for update in client.search_images_stream(text_query, top_k, use_cache):
+            if update.timings:
+                add_to_trace(update.timings)
+            yield update
+    else:
+        for update in _local_search_engine().search_images_stream(text_query, top_k=top_k, use_cache=use_cache):
+            yield update
+    if QUERY_LOG_ENABLED and update is not None:
+        query_log.get_writer().log(transcript, text_query, update.ids, update.scores, trace_timings())
+
+
+def search_images_batch(text_queries, top_k=5):
+    client = get_client()
+    if client is not None:
+        with span('search_rpc'):
+            return client.search_images_batch(text_queries, top_k)
+    return _local_search_engine().search_images_batch(text_queries, top_k=top_k)
+
+
+def extract_keywords(transcript):
+    """Extracts query keywords through the shared server's spaCy, or a local one."""
+    client = get_client()
+    if client is not None:
+        return client.extract_keywords(transcript)
+
+    from text_processing import extract_keywords as local_extract_keywords, load_nlp
+
+    return local_extract_keywords(load_nlp(), transcript)
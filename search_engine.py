@@ -2,65 +2,412 @@
 
 import faiss
 import pickle
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from PIL import Image
 import os
+import signal
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import index_store
+from clip_onnx import load_encoder
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metrics import increment, span
+from result_cache import RESULT_CACHE_PATH, ResultCache
+from search_executor import get_executor
+from search_protocol import SearchUpdate
 
 # --- Configuration ---
-# These must match the files created by your indexing script
-FAISS_INDEX_PATH = 'image_index.faiss'
-IMAGE_MAP_PATH = 'image_map.pkl'
+# The index files are resolved through index_store: the version named in
+# indexes/CURRENT, or the legacy flat files written by older create_index runs.
+INDEX_ROOT = index_store.INDEX_ROOT
 MODEL_NAME = 'clip-ViT-B-32'
+# Pick up new index builds without a restart.
+AUTO_RELOAD = True
+RELOAD_POLL_INTERVAL = 2.0
+# 'hybrid' fuses CLIP with the caption/tag BM25 index when the build has one;
+# 'semantic' uses CLIP alone.
+SEARCH_MODE = 'hybrid'
+# How deep each retriever's ranking goes before fusion.
+HYBRID_DEPTH = 50
+# Search the IVF index that `clustering.py --ivf` builds on the k-means
+# centroids, when the live version has one, scanning only the IVF_NPROBE
+# clusters nearest to each query.
+PREFER_IVF_INDEX = True
+IVF_NPROBE = 16
+# Precomputed embeddings and results (see warmup.py) live here between runs.
+CACHE_PATH = RESULT_CACHE_PATH
+# Set VOICE_SEARCH_NO_CACHE=1 to measure real search latency (benchmarks,
+# query log replays); each search function also takes use_cache.
+CACHE_ENABLED = not os.environ.get('VOICE_SEARCH_NO_CACHE')
+
+# Everything a search needs from one index build. Searches grab the current
+# state once and use it throughout, so swapping in a new one never mixes an
+# index with another build's image map.
+# `fingerprint` identifies the exact files, and keys the result cache.
+IndexState = namedtuple('IndexState', ['version', 'index', 'image_map', 'lexical', 'fingerprint'])
+
+
+def _index_path(version_dir, faiss_path):
+    """The FAISS index file to search: the clustering IVF index if built and preferred."""
+    ivf_path = index_store.optional_file(version_dir, 'ivf_index') if PREFER_IVF_INDEX else None
+    return ivf_path or faiss_path
+
+
+def load_index_state(root=INDEX_ROOT):
+    """Loads the live FAISS index, image map and (if built) lexical index from disk."""
+    version, version_dir, faiss_path, map_path = index_store.resolve(root)
+    index_path = _index_path(version_dir, faiss_path)
+    fingerprint = index_store.fingerprint(version, index_path, map_path)
+    index = faiss.read_index(index_path)
+    if index_path != faiss_path:
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    with open(map_path, 'rb') as f:
+        image_map = pickle.load(f)
+    lexical_path = index_store.optional_file(version_dir, 'lexical_index')
+    lexical = LexicalIndex.load(lexical_path) if lexical_path else None
+
+    # Run one throwaway search so the first real query after a swap
+    # doesn't pay the cold-start cost.
+    if index.ntotal:
+        index.search(np.zeros((1, index.d), dtype='float32'), 1)
+    return IndexState(version, index, image_map, lexical, fingerprint)
+
 
 # --- Load all necessary components ---
 print("Loading search engine components...")
 
-# 1. Load the FAISS index
-index = faiss.read_index(FAISS_INDEX_PATH)
-
-# 2. Load the image path map
-with open(IMAGE_MAP_PATH, 'rb') as f:
-    image_map = pickle.load(f)
+# 1. Load the FAISS index and the image path map
+_state = load_index_state()
+_reload_lock = threading.Lock()
+# Every FAISS call goes through one executor that owns the OpenMP threads.
+_executor = get_executor()
+# Runs the lexical pass while the calling thread encodes and searches FAISS.
+_lexical_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='lexical-search')
 
-# 3. Load the pre-trained CLIP model
+# 2. Load the pre-trained CLIP model (the local ONNX export when present)
 # This MUST be the same model used for indexing
-model = SentenceTransformer(MODEL_NAME)
+model = load_encoder()
+
+# 3. Reload the embeddings and results cached by the previous run.
+# Names the model file too, so fp32 and int8 embeddings never mix.
+_encoder_id = model.encoder_id('text')
+_cache = ResultCache()
+if _cache.load(CACHE_PATH, _encoder_id, _state.fingerprint):
+    print(f"Loaded search cache {_cache.stats()} from '{CACHE_PATH}'.")
+# The queries last passed to warm_cache, re-warmed on every index swap.
+_warm_queries = None
+
+print(f"✅ Search engine is ready (index version '{_state.version}', {_state.index.ntotal} images).")
+
+
+# --- Hot Reload ---
+
+def current_state():
+    """Returns the IndexState that new searches will use."""
+    return _state
+
+
+def reload_index(force=False):
+    """
+    Loads the live index version and atomically swaps it in. Searches already
+    running keep using the state they started with.
+
+    Returns:
+        bool: True if a new version was swapped in.
+    """
+    global _state
+    with _reload_lock:
+        version, version_dir, faiss_path, map_path = index_store.resolve(INDEX_ROOT)
+        index_path = _index_path(version_dir, faiss_path)
+        if index_store.fingerprint(version, index_path, map_path) == _state.fingerprint and not force:
+            return False
+        print(f"Loading index version '{version}' in the background...")
+        new_state = load_index_state(INDEX_ROOT)
+        if _warm_queries is not None:
+            # Warm the new version before it goes live, not after.
+            warm_cache(*_warm_queries, state=new_state)
+        previous = _state
+        _state = new_state
+        _cache.retain_index(new_state.fingerprint)
+        increment('index_reloads')
+        print(f"✅ Swapped index '{previous.version}' -> '{new_state.version}' ({new_state.index.ntotal} images).")
+        return True
+
+
+def reload_in_background():
+    thread = threading.Thread(target=reload_index, name='index-reload', daemon=True)
+    thread.start()
+    return thread
 
-print("✅ Search engine is ready.")
+
+_watcher = None
+
+
+def start_index_watcher(poll_interval=RELOAD_POLL_INTERVAL):
+    """Starts reloading automatically whenever create_index publishes a new version."""
+    global _watcher
+    if _watcher is None:
+        _watcher = index_store.IndexWatcher(lambda version: reload_index(), INDEX_ROOT, poll_interval)
+        _watcher.start()
+    return _watcher
+
+
+def install_reload_signal_handler():
+    """Makes SIGHUP trigger a background reload (main thread, POSIX only)."""
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_in_background())
+
+
+if AUTO_RELOAD:
+    start_index_watcher()
+    install_reload_signal_handler()
 
 
 # --- The Core Search Function ---
 
-def search_images(text_query, top_k=5):
+def _use_cache(use_cache):
+    return CACHE_ENABLED if use_cache is None else use_cache
+
+
+def encode_queries(text_queries, use_cache=None):
     """
-    Performs a semantic search for a text query against the image index.
+    Encodes text queries into L2-normalized float32 vectors, ready for FAISS.
+
+    Args:
+        text_queries (list[str]): The queries to encode.
+        use_cache (bool): Reuse and store cached embeddings; defaults to CACHE_ENABLED.
+
+    Returns:
+        np.ndarray: A (len(text_queries), dim) float32 array.
+    """
+    use_cache = _use_cache(use_cache)
+    vectors = [_cache.get_embedding(text_query) if use_cache else None for text_query in text_queries]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if len(missing) < len(vectors):
+        increment('embedding_cache_hits', len(vectors) - len(missing))
+    if missing:
+        with span('text_encode'):
+            query_embedding_np = model.encode([text_queries[i] for i in missing]).astype('float32')
+
+            # Normalize (same as we did for images).
+            faiss.normalize_L2(query_embedding_np)
+        for i, vector in zip(missing, query_embedding_np):
+            if use_cache:
+                _cache.put_embedding(text_queries[i], vector)
+            vectors[i] = vector
+    return np.vstack(vectors).astype('float32', copy=False)
+
+
+def _lexical_rankings(lexical, text_queries, depth):
+    with span('lexical_search'):
+        return [lexical.search(text_query, depth)[0].tolist() for text_query in text_queries]
+
+
+def _effective_mode(mode, state):
+    """Hybrid only when asked for and the index has a lexical part."""
+    if (mode or SEARCH_MODE) == 'hybrid' and state.lexical is not None:
+        return 'hybrid'
+    return 'semantic'
+
+
+def _cached(state, text_query, top_k, mode, use_cache):
+    if not use_cache:
+        return None
+    update = _cache.get_results(state.fingerprint, text_query, top_k, mode)
+    if update is not None:
+        increment('result_cache_hits')
+    return update
+
+
+def _search_updates(text_queries, top_k, state, mode, use_cache):
+    """
+    Runs the full search for many queries with one encode and one FAISS
+    call, and stores each final result in the result cache.
+
+    Args:
+        mode (str): The effective mode, 'hybrid' or 'semantic'.
+
+    Returns:
+        list[SearchUpdate]: The final results, in query order.
+    """
+    hybrid = mode == 'hybrid'
+    depth = max(top_k, HYBRID_DEPTH) if hybrid else top_k
+    if hybrid:
+        lexical_future = _lexical_pool.submit(_lexical_rankings, state.lexical, text_queries, depth)
+
+    query_embeddings = encode_queries(text_queries, use_cache)
+    with span('faiss_search'):
+        distances, indices = _executor.search(state.index, query_embeddings, depth)
+    lexical_rankings = lexical_future.result() if hybrid else [None] * len(text_queries)
+
+    updates = []
+    with span('map_lookup'):
+        for text_query, row, scores, lexical in zip(text_queries, indices, distances, lexical_rankings):
+            ids = [int(i) for i in row if i != -1]
+            if lexical is None:
+                ids = ids[:top_k]
+                scores = [float(d) for d in scores[:len(ids)]]
+            else:
+                ids, scores = reciprocal_rank_fusion([ids, lexical], top_k, with_scores=True)
+            update = SearchUpdate(mode, [state.image_map[i] for i in ids], True, ids, scores)
+            if use_cache:
+                _cache.put_results(state.fingerprint, text_query, top_k, mode, update)
+            updates.append(update)
+    return updates
+
+
+def search_images(text_query, top_k=5, mode=None, use_cache=None):
+    """
+    Searches the image index for a text query.
 
     Args:
         text_query (str): The user's search query.
         top_k (int): The number of top results to return.
+        mode (str): 'hybrid' or 'semantic'; defaults to SEARCH_MODE. Hybrid
+            falls back to semantic when the index has no lexical part.
+        use_cache (bool): Serve and store cached results; defaults to CACHE_ENABLED.
 
     Returns:
         list[str]: A list of file paths for the top matching images.
     """
-    # 1. Encode the text query into a vector embedding.
-    query_embedding = model.encode([text_query], convert_to_tensor=True)
-
-    # 2. Convert to NumPy and normalize (same as we did for images).
-    query_embedding_np = query_embedding.cpu().numpy().astype('float32')
-    faiss.normalize_L2(query_embedding_np)
-
-    # 3. Search the FAISS index for the k nearest neighbors.
-    # The search function returns distances and the indices of the neighbors.
-    distances, indices = index.search(query_embedding_np, top_k)
+    # Pin the index version for the whole query, in case a reload swaps it.
+    state = _state
+    mode = _effective_mode(mode, state)
+    use_cache = _use_cache(use_cache)
 
-    # 4. Use the indices to look up the original image paths from our map.
-    results = [image_map[i] for i in indices[0]]
+    update = _cached(state, text_query, top_k, mode, use_cache)
+    if update is None:
+        # Encode the query, search FAISS (and BM25), and map the hits to paths.
+        update = _search_updates([text_query], top_k, state, mode, use_cache)[0]
+    results = list(update.paths)
 
     print(f"Found {len(results)} results for '{text_query}'")
     return results
 
 
+def search_images_stream(text_query, top_k=5, mode=None, use_cache=None):
+    """
+    Searches like `search_images`, but yields results as soon as each phase
+    is ready, so front ends can start painting before the search is done:
+
+    1. 'semantic': the CLIP/FAISS top hits, available right after the FAISS call.
+    2. 'fused': in hybrid mode, the final re-ranking with the lexical
+       results. Front ends only need to repaint the slots that changed.
+
+    A query already in the result cache yields a single 'cached' update.
+
+    Yields:
+        SearchUpdate: (phase, paths, final); each update carries the full
+        ranked list for that phase.
+    """
+    state = _state
+    mode = _effective_mode(mode, state)
+    use_cache = _use_cache(use_cache)
+    cached = _cached(state, text_query, top_k, mode, use_cache)
+    if cached is not None:
+        yield cached._replace(phase='cached', final=True)
+        return
+
+    hybrid = mode == 'hybrid'
+    depth = max(top_k, HYBRID_DEPTH) if hybrid else top_k
+    if hybrid:
+        lexical_future = _lexical_pool.submit(_lexical_rankings, state.lexical, [text_query], depth)
+
+    query_embeddings = encode_queries([text_query], use_cache)
+    with span('faiss_search'):
+        distances, indices = _executor.search(state.index, query_embeddings, depth)
+    semantic_ids = [int(i) for i in indices[0] if i != -1]
+    semantic_scores = [float(d) for d in distances[0][:len(semantic_ids)]]
+    with span('map_lookup'):
+        semantic_paths = [state.image_map[i] for i in semantic_ids[:top_k]]
+    semantic = SearchUpdate('semantic', semantic_paths, not hybrid, semantic_ids[:top_k], semantic_scores[:top_k])
+    if not hybrid and use_cache:
+        _cache.put_results(state.fingerprint, text_query, top_k, mode, semantic)
+    yield semantic
+    if not hybrid:
+        return
+
+    lexical = lexical_future.result()[0]
+    fused_ids, fused_scores = reciprocal_rank_fusion([semantic_ids, lexical], top_k, with_scores=True)
+    with span('map_lookup'):
+        fused_paths = [state.image_map[i] for i in fused_ids]
+    fused = SearchUpdate('fused', fused_paths, True, fused_ids, fused_scores)
+    if use_cache:
+        _cache.put_results(state.fingerprint, text_query, top_k, mode, fused)
+    yield fused
+
+
+def search_images_batch(text_queries, top_k=5, mode=None, use_cache=None):
+    """
+    Searches for many text queries at once, with a single encode and a
+    single FAISS call. Much cheaper per query than calling `search_images`
+    in a loop.
+
+    Args:
+        text_queries (list[str]): The search queries.
+        top_k (int): The number of top results to return per query.
+        mode (str): 'hybrid' or 'semantic'; defaults to SEARCH_MODE.
+        use_cache (bool): Serve and store cached results; defaults to CACHE_ENABLED.
+
+    Returns:
+        list[list[str]]: The top matching image paths for each query, in order.
+    """
+    if not text_queries:
+        return []
+    state = _state
+    mode = _effective_mode(mode, state)
+    use_cache = _use_cache(use_cache)
+    updates = [_cached(state, text_query, top_k, mode, use_cache) for text_query in text_queries]
+    missing = [i for i, update in enumerate(updates) if update is None]
+    if missing:
+        found = _search_updates([text_queries[i] for i in missing], top_k, state, mode, use_cache)
+        for i, update in zip(missing, found):
+            updates[i] = update
+    return [list(update.paths) for update in updates]
+
+
+# --- Warm-up ---
+
+def warm_cache(text_queries, top_k=5, mode=None, state=None):
+    """
+    Precomputes the embeddings and final results of many queries in one
+    batched pass and stores them in the result cache, so later searches
+    for them skip the encoder and FAISS entirely. Remembers the queries and
+    re-warms them whenever a new index version is loaded. Does nothing when
+    caching is disabled (CACHE_ENABLED).
+
+    Args:
+        text_queries (list[str]): The queries to warm, e.g. warmup.popular_queries().
+        top_k (int): The result count the front ends ask for.
+        mode (str): 'hybrid' or 'semantic'; defaults to SEARCH_MODE.
+        state (IndexState): The index to warm; defaults to the live one.
+
+    Returns:
+        list[SearchUpdate]: The final results, in query order; empty when
+        caching is disabled.
+    """
+    global _warm_queries
+    if not CACHE_ENABLED:
+        return []
+    text_queries = list(dict.fromkeys(text_queries))
+    _warm_queries = (text_queries, top_k, mode)
+    if not text_queries:
+        return []
+    state = state or _state
+    return _search_updates(text_queries, top_k, state, _effective_mode(mode, state), use_cache=True)
+
+
+def save_cache(path=None):
+    """Persists the embedding and result caches for the next start."""
+    path = path or CACHE_PATH
+    try:
+        _cache.save(path, _encoder_id)
+    except OSError as e:
+        print(f"Could not save the search cache to '{path}': {e}")
+
+
 # Example of how to use it:
 if __name__ == '__main__':
     # This is just for testing the search engine directly.
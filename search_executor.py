@@ -0,0 +1,113 @@
+# search_executor.py
+
+"""
+Owns FAISS's OpenMP thread usage for the whole process.
+
+Left alone, every thread that calls `index.search` (the GUI's voice thread,
+the search server's workers, the dashboard) spins up its own full-width
+OpenMP team, so concurrent queries oversubscribe the cores, while a single
+1-row query can't use them at all. Instead, all searches go through one
+SearchExecutor:
+
+- Small requests (fewer than `crossover` rows) run on a fixed pool of
+  workers, each limited to `threads_per_worker` OpenMP threads. Many
+  concurrent queries then spread across the cores (inter-query parallelism),
+  and a multi-row request is split into row chunks across the workers.
+- Large batches run one at a time on a dedicated worker that uses
+  `batch_threads` OpenMP threads for the whole call (intra-query
+  parallelism), which is what FAISS does best for big batches.
+
+`python benchmark.py --executor` measures where the crossover lies on a
+given machine.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+# --- Configuration ---
+CPU_COUNT = os.cpu_count() or 1
+DEFAULT_THREADS_PER_WORKER = 1
+# Batches with at least this many rows use intra-query parallelism.
+DEFAULT_CROSSOVER = 64
+
+
+class SearchExecutor:
+    """
+    Runs FAISS searches with a controlled number of OpenMP threads.
+
+    Args:
+        num_workers (int): Workers for small requests; defaults to one per
+            `threads_per_worker` cores.
+        threads_per_worker (int): OpenMP threads each small-request worker may use.
+        batch_threads (int): OpenMP threads for large batches; defaults to all cores.
+        crossover (int): Row count at which a request counts as a large batch.
+    """
+
+    def __init__(self, num_workers=None, threads_per_worker=DEFAULT_THREADS_PER_WORKER,
+                 batch_threads=None, crossover=DEFAULT_CROSSOVER):
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.num_workers = num_workers or max(1, CPU_COUNT // self.threads_per_worker)
+        self.batch_threads = batch_threads or CPU_COUNT
+        self.crossover = crossover
+
+        # omp_set_num_threads applies to the calling thread, so each worker
+        # sets its own limit once, when it starts.
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.num_workers, thread_name_prefix='faiss-worker',
+            initializer=faiss.omp_set_num_threads, initargs=(self.threads_per_worker,),
+        )
+        self._batch_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='faiss-batch',
+            initializer=faiss.omp_set_num_threads, initargs=(self.batch_threads,),
+        )
+
+    def search(self, index, queries, k):
+        """
+        Same contract as `index.search(queries, k)`, picking the parallelism
+        strategy by batch size.
+
+        Returns:
+            tuple: (distances, indices), each (len(queries), k).
+        """
+        if len(queries) >= self.crossover:
+            return self.search_intra_query(index, queries, k)
+        return self.search_inter_query(index, queries, k)
+
+    def search_intra_query(self, index, queries, k):
+        """One call using `batch_threads` OpenMP threads."""
+        return self._batch_pool.submit(index.search, queries, k).result()
+
+    def search_inter_query(self, index, queries, k):
+        """Splits the rows across the worker pool, each worker single-call."""
+        n = len(queries)
+        if n <= 1 or self.num_workers == 1:
+            return self._pool.submit(index.search, queries, k).result()
+
+        chunk_size = -(-n // min(n, self.num_workers))
+        futures = [
+            self._pool.submit(index.search, queries[start:start + chunk_size], k)
+            for start in range(0, n, chunk_size)
+        ]
+        results = [future.result() for future in futures]
+        return np.vstack([d for d, _ in results]), np.vstack([i for _, i in results])
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+        self._batch_pool.shutdown(wait=False)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the process-wide executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = SearchExecutor()
+        return _executor
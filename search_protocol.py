@@ -0,0 +1,223 @@
+# search_protocol.py
+
+"""
+The binary wire format spoken between search_server.py and search_client.py.
+
+Every message, in both directions, is one frame:
+
+    +-------------+-----------+----------------+-----------------+
+    | request_id  | code      | payload_length | payload         |
+    | uint32      | uint8     | uint32         | payload_length  |
+    +-------------+-----------+----------------+-----------------+
+
+For requests `code` is the opcode; for responses it is a status. Request ids
+let a client keep many requests in flight on one connection: the server
+answers them as they complete, in any order. Streaming requests get any
+number of STATUS_PARTIAL frames followed by one empty STATUS_OK frame.
+
+Payload encodings (all integers big-endian):
+    string        uint16 length + UTF-8 bytes
+    string list   uint32 count + strings
+    OP_SEARCH          uint16 top_k + UTF-8 query        -> string list
+    OP_SEARCH_BATCH    uint16 top_k + string list        -> uint32 count + string lists
+    OP_KEYWORDS        UTF-8 transcript                  -> string list
+    OP_METRICS         empty                             -> UTF-8 JSON
+    OP_SEARCH_STREAM   uint16 top_k + uint8 flags        -> partial frames of
+                       + UTF-8 query                        string phase + uint8 final + string list
+                                                            + uint32 n + int64[n] ids + float32[n] scores
+                                                            [+ uint32 count + (string stage, float64 seconds)*]
+    The final update of a stream carries the server's stage timings.
+    OP_PING            empty                             -> empty
+"""
+
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+# --- Configuration ---
+SOCKET_PATH = os.environ.get(
+    'VOICE_SEARCH_SOCKET', os.path.join(tempfile.gettempdir(), 'voice_image_search.sock')
+)
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+HEADER = struct.Struct('!IBI')
+
+# Request opcodes
+OP_PING = 0
+OP_SEARCH = 1
+OP_SEARCH_BATCH = 2
+OP_KEYWORDS = 3
+OP_METRICS = 4
+OP_SEARCH_STREAM = 5
+
+# Response statuses
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_PARTIAL = 2
+
+# OP_SEARCH_STREAM flags
+FLAG_NO_CACHE = 0x01
+
+# One step of a streamed search: `paths` is the full ranked list as of this
+# phase ('semantic' first, then e.g. 'fused'), and `final` marks the last one.
+# `ids` and `scores` are the index ids and similarity (or fusion) scores of
+# those paths, for logging; they may be empty. `timings` maps stage names to
+# seconds spent on the search server, or is None.
+SearchUpdate = namedtuple('SearchUpdate', ['phase', 'paths', 'final', 'ids', 'scores', 'timings'],
+                          defaults=((), (), None))
+
+_U8 = struct.Struct('!B')
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_F64 = struct.Struct('!d')
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a malformed frame."""
+
+
+# --- Framing ---
+
+def pack_frame(request_id, code, payload=b''):
+    return HEADER.pack(request_id, code, len(payload)) + payload
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    """
+    Reads one frame from a socket.
+
+    Returns:
+        tuple: (request_id, code, payload), or None if the peer closed the connection.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    request_id, code, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the {MAX_PAYLOAD} byte limit")
+    payload = _recv_exactly(sock, length) if length else b''
+    if payload is None:
+        return None
+    return request_id, code, payload
+
+
+# --- Payload encoding ---
+
+def pack_string(value):
+    data = value.encode('utf-8')
+    if len(data) > 0xFFFF:
+        raise ProtocolError("String too long for the wire format")
+    return _U16.pack(len(data)) + data
+
+
+def unpack_string(buf, offset=0):
+    (length,) = _U16.unpack_from(buf, offset)
+    offset += _U16.size
+    return buf[offset:offset + length].decode('utf-8'), offset + length
+
+
+def pack_strings(values):
+    return _U32.pack(len(values)) + b''.join(pack_string(v) for v in values)
+
+
+def unpack_strings(buf, offset=0):
+    (count,) = _U32.unpack_from(buf, offset)
+    offset += _U32.size
+    values = []
+    for _ in range(count):
+        value, offset = unpack_string(buf, offset)
+        values.append(value)
+    return values, offset
+
+
+def pack_search(text_query, top_k):
+    return _U16.pack(top_k) + text_query.encode('utf-8')
+
+
+def unpack_search(payload):
+    (top_k,) = _U16.unpack_from(payload)
+    return payload[_U16.size:].decode('utf-8'), top_k
+
+
+def pack_search_stream(text_query, top_k, use_cache=None):
+    flags = FLAG_NO_CACHE if use_cache is False else 0
+    return _U16.pack(top_k) + _U8.pack(flags) + text_query.encode('utf-8')
+
+
+def unpack_search_stream(payload):
+    """
+    Returns:
+        tuple: (text_query, top_k, use_cache); use_cache is None for the
+        server's default.
+    """
+    (top_k,) = _U16.unpack_from(payload)
+    (flags,) = _U8.unpack_from(payload, _U16.size)
+    text_query = payload[_U16.size + _U8.size:].decode('utf-8')
+    return text_query, top_k, False if flags & FLAG_NO_CACHE else None
+
+
+def pack_search_batch(text_queries, top_k):
+    return _U16.pack(top_k) + pack_strings(text_queries)
+
+
+def unpack_search_batch(payload):
+    (top_k,) = _U16.unpack_from(payload)
+    text_queries, _ = unpack_strings(payload, _U16.size)
+    return text_queries, top_k
+
+
+def pack_string_lists(lists):
+    return _U32.pack(len(lists)) + b''.join(pack_strings(values) for values in lists)
+
+
+def unpack_string_lists(buf):
+    (count,) = _U32.unpack_from(buf)
+    offset = _U32.size
+    lists = []
+    for _ in range(count):
+        values, offset = unpack_strings(buf, offset)
+        lists.append(values)
+    return lists
+
+
+def pack_update(update):
+    n = len(update.ids)
+    payload = (pack_string(update.phase) + _U8.pack(int(update.final)) + pack_strings(update.paths)
+               + _U32.pack(n) + struct.pack(f'!{n}q{n}f', *update.ids, *update.scores))
+    if update.timings:
+        payload += _U32.pack(len(update.timings)) + b''.join(
+            pack_string(stage) + _F64.pack(seconds) for stage, seconds in update.timings.items()
+        )
+    return payload
+
+
+def unpack_update(payload):
+    phase, offset = unpack_string(payload)
+    (final,) = _U8.unpack_from(payload, offset)
+    paths, offset = unpack_strings(payload, offset + _U8.size)
+    (n,) = _U32.unpack_from(payload, offset)
+    offset += _U32.size
+    values = struct.unpack_from(f'!{n}q{n}f', payload, offset)
+    offset += n * 12
+
+    timings = None
+    if offset < len(payload):
+        (count,) = _U32.unpack_from(payload, offset)
+        offset += _U32.size
+        timings = {}
+        for _ in range(count):
+            stage, offset = unpack_string(payload, offset)
+            (timings[stage],) = _F64.unpack_from(payload, offset)
+            offset += _F64.size
+    return SearchUpdate(phase, paths, bool(final), list(values[:n]), list(values[n:]), timings)
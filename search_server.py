@@ -0,0 +1,191 @@
+# search_server.py
+
+"""
+Local search daemon. Owns one copy of the CLIP encoder, the spaCy pipeline
+and the FAISS index, and serves every front end (main_app.py,
+realtimesttfinal.py, dashboard.py) over a Unix domain socket.
+
+Usage:
+    python search_server.py [--socket /tmp/voice_image_search.sock] [--workers 4] [--no-warmup]
+
+Front ends pick the server up automatically through search_client.py when
+the socket exists, and fall back to loading the models themselves otherwise.
+"""
+
+import argparse
+import inspect
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import search_protocol as protocol
+from metrics import REGISTRY, trace
+
+# --- Configuration ---
+DEFAULT_WORKERS = 4
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """
+    Reads frames off one client connection and hands each request to the
+    shared worker pool, so a slow search never blocks the requests queued
+    behind it on the same connection.
+    """
+
+    def handle(self):
+        send_lock = threading.Lock()
+        while True:
+            try:
+                frame = protocol.recv_frame(self.request)
+            except (OSError, protocol.ProtocolError) as e:
+                print(f"Dropping client connection: {e}")
+                return
+            if frame is None:
+                return
+            self.server.executor.submit(self._dispatch, frame, send_lock)
+
+    def _dispatch(self, frame, send_lock):
+        request_id, opcode, payload = frame
+        handler = self.server.handlers.get(opcode)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown opcode {opcode}")
+            response = handler(payload)
+            if inspect.isgenerator(response):
+                # Streaming handler: every yielded payload goes out as soon
+                # as it is ready, then an empty OK closes the stream.
+                for partial in response:
+                    if not self._send(send_lock, request_id, protocol.STATUS_PARTIAL, partial):
+                        response.close()
+                        return
+                response = b''
+            status = protocol.STATUS_OK
+        except Exception as e:
+            status, response = protocol.STATUS_ERROR, f"{type(e).__name__}: {e}".encode('utf-8')
+        self._send(send_lock, request_id, status, response)
+
+    def _send(self, send_lock, request_id, status, payload):
+        try:
+            with send_lock:
+                self.request.sendall(protocol.pack_frame(request_id, status, payload))
+            return True
+        except OSError:
+            # The client went away; its reader will notice.
+            return False
+
+
+class SearchServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A Unix socket server with one thread per connection and a shared pool of
+    workers executing the requests.
+
+    Args:
+        socket_path (str): Where to bind the socket.
+        handlers (dict): Maps opcodes to callables taking payload bytes and
+            returning payload bytes, or a generator of them for streaming replies.
+        max_workers (int): Size of the request worker pool.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, handlers, max_workers=DEFAULT_WORKERS):
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+        self.handlers = handlers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search-worker')
+        super().__init__(socket_path, _ConnectionHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(socket_path):
+    """Removes a socket file left behind by a dead server, refusing to steal a live one."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError(f"Another search server is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def build_handlers(search_engine, nlp):
+    """Wires the protocol opcodes to the loaded search engine and spaCy pipeline."""
+    from text_processing import extract_keywords
+
+    def search(payload):
+        text_query, top_k = protocol.unpack_search(payload)
+        return protocol.pack_strings(search_engine.search_images(text_query, top_k=top_k))
+
+    def search_batch(payload):
+        text_queries, top_k = protocol.unpack_search_batch(payload)
+        return protocol.pack_string_lists(search_engine.search_images_batch(text_queries, top_k=top_k))
+
+    def search_stream(payload):
+        text_query, top_k, use_cache = protocol.unpack_search_stream(payload)
+        with trace() as timings:
+            for update in search_engine.search_images_stream(text_query, top_k=top_k, use_cache=use_cache):
+                if update.final:
+                    # Every stage has run by now; the client logs them with its own.
+                    update = update._replace(timings=dict(timings))
+                yield protocol.pack_update(update)
+
+    def keywords(payload):
+        return protocol.pack_strings(extract_keywords(nlp, payload.decode('utf-8')))
+
+    return {
+        protocol.OP_PING: lambda payload: b'',
+        protocol.OP_SEARCH: search,
+        protocol.OP_SEARCH_BATCH: search_batch,
+        protocol.OP_SEARCH_STREAM: search_stream,
+        protocol.OP_KEYWORDS: keywords,
+        protocol.OP_METRICS: lambda payload: REGISTRY.to_json().encode('utf-8'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve image search over a Unix domain socket.")
+    parser.add_argument('--socket', default=protocol.SOCKET_PATH)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--no-warmup', action='store_true', help="Don't precompute popular queries at startup.")
+    args = parser.parse_args(argv)
+
+    # Loading these is the whole point of the daemon: once, for everyone.
+    import search_engine
+    import warmup
+    from text_processing import load_nlp
+
+    print("Loading NLP model...")
+    nlp = load_nlp()
+
+    server = SearchServer(args.socket, build_handlers(search_engine, nlp), max_workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    if not args.no_warmup:
+        # Popular queries get precomputed while the first requests are already served.
+        threading.Thread(target=warmup.warm_up, args=(search_engine,), name='warmup', daemon=True).start()
+    print(f"✅ Search server listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        search_engine.save_cache()
+        print("Search server stopped.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -51,6 +51,19 @@ setup(
         "gpu": [
             "faiss-gpu>=1.7.4",
         ],
+        "onnx": [
+            "onnxruntime>=1.16.0",
+            "tokenizers>=0.15.0",
+        ],
+        "audio": [
+            "av>=10.0.0",
+        ],
+        "onnx-export": [
+            "onnx>=1.15.0",
+            "onnxruntime>=1.16.0",
+            "sentence-transformers>=2.2.2",
+            "torch>=2.0.0",
+        ],
     },
     entry_points={
         "console_scripts": [
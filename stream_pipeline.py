@@ -0,0 +1,338 @@
+# stream_pipeline.py
+
+"""
+A supervised microphone -> streaming recognizer pipeline.
+
+A single `streaming_recognize` call is not enough for an app that listens
+all day: the API closes streams after about five minutes, network errors
+end them at any time, and while nothing is consuming the microphone its
+buffer keeps growing. StreamPipeline keeps recognition running:
+
+- Rollover: each recognizer stream is closed cleanly before
+  `stream_limit` seconds and a new one is opened.
+- Overlap: audio not yet covered by a final transcript (up to its
+  `result_end_time`) is kept in a ring buffer and replayed at the start of
+  the next stream, so words spoken across a rollover or a reconnect aren't
+  lost.
+- Bounded buffering: AudioBuffer holds at most `max_chunks` chunks and
+  drops the oldest when full (counted as `audio_chunks_dropped`).
+- Recovery: a failed stream is retried with exponential backoff.
+
+The recognizer is any callable taking an iterator of audio bytes and
+returning an iterator of responses shaped like Google's
+StreamingRecognizeResponse, so tests can drive it with a local fake.
+"""
+
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+from metrics import increment, observe
+
+# --- Configuration ---
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2   # 16-bit mono LINEAR16
+# Google closes streams at ~305 s; roll over comfortably before that.
+STREAM_LIMIT_SECONDS = 290.0
+# At most this much not-yet-finalized audio is replayed into a new stream.
+OVERLAP_SECONDS = 5.0
+# 100 ms chunks, so about 10 s of audio may queue up while reconnecting.
+MAX_BUFFERED_CHUNKS = 100
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+POLL_INTERVAL = 0.1
+
+
+class AudioBuffer:
+    """
+    A bounded queue of timestamped audio chunks between the capture
+    callback and the recognizer. When full, the oldest chunk is dropped:
+    for live speech the newest audio matters most.
+    """
+
+    def __init__(self, max_chunks=MAX_BUFFERED_CHUNKS):
+        self._queue = queue.Queue(maxsize=max_chunks)
+
+    def put(self, data, captured_at=None):
+        """Adds a chunk without ever blocking the audio callback."""
+        self._put((time.perf_counter() if captured_at is None else captured_at, data))
+
+    def close(self):
+        """Tells the consumer that no more audio is coming."""
+        self._put(None)
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    increment('audio_chunks_dropped')
+                except queue.Empty:
+                    pass
+
+    def get_batch(self, timeout=None):
+        """
+        Waits for audio and returns everything buffered so far as one batch.
+
+        Returns:
+            tuple: (captured_at of the oldest chunk, joined bytes), or None
+            once the buffer is closed.
+
+        Raises:
+            queue.Empty: If nothing arrived within `timeout`.
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is None:
+            return None
+        captured_at, chunk = item
+        data = [chunk]
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Keep the close marker for the next call.
+                self._put(None)
+                break
+            data.append(item[1])
+        return captured_at, b"".join(data)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class OverlapBuffer:
+    """
+    Ring buffer of the most recent audio, capped at `max_bytes`. Every byte
+    has an absolute offset (bytes appended before it), so a recognizer's
+    result offsets can be mapped back onto the buffer.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._chunks = deque()   # (offset, data)
+        self._size = 0
+        self._end = 0
+        # Appended to from the recognizer's request thread, trimmed from ours.
+        self._lock = threading.Lock()
+
+    def append(self, data):
+        with self._lock:
+            self._chunks.append((self._end, data))
+            self._end += len(data)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._chunks) > 1:
+                self._size -= len(self._chunks.popleft()[1])
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (offset of the first buffered byte, list of chunks).
+        """
+        with self._lock:
+            start = self._chunks[0][0] if self._chunks else self._end
+            return start, [data for _, data in self._chunks]
+
+    def discard_until(self, offset):
+        """Drops the audio before absolute byte `offset`, keeping everything after it."""
+        with self._lock:
+            while self._chunks and self._chunks[0][0] + len(self._chunks[0][1]) <= offset:
+                self._size -= len(self._chunks.popleft()[1])
+            if self._chunks and self._chunks[0][0] < offset:
+                start, data = self._chunks[0]
+                cut = offset - start
+                self._chunks[0] = (offset, data[cut:])
+                self._size -= cut
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._size = 0
+
+
+class GoogleStreamingRecognizer:
+    """Adapts a google.cloud.speech SpeechClient to the recognizer interface."""
+
+    def __init__(self, client, streaming_config):
+        from google.cloud import speech
+
+        self._speech = speech
+        self._client = client
+        self._streaming_config = streaming_config
+
+    def __call__(self, audio_chunks):
+        requests = (self._speech.StreamingRecognizeRequest(audio_content=content) for content in audio_chunks)
+        return self._client.streaming_recognize(self._streaming_config, requests)
+
+
+def _seconds(duration):
+    """Converts a result offset (timedelta or protobuf Duration) to seconds, or None."""
+    if duration is None:
+        return None
+    if hasattr(duration, 'total_seconds'):
+        return duration.total_seconds()
+    return duration.seconds + duration.nanos / 1e9
+
+
+def print_partial(transcript):
+    """Shows an interim transcript on the current console line."""
+    sys.stdout.write(f"\r{transcript}" + " " * 20)
+    sys.stdout.flush()
+
+
+class StreamPipeline:
+    """
+    Feeds an AudioBuffer into a recognizer, one stream after another.
+
+    Args:
+        audio (AudioBuffer): Where the captured audio arrives.
+        recognize (callable): recognize(audio_chunks) -> iterator of responses.
+        on_transcript (callable): Called with each final transcript.
+        on_partial (callable): Called with each interim transcript.
+        on_status (callable): Called with human-readable status changes.
+        stream_limit (float): Seconds before a stream is rolled over.
+        overlap_seconds (float): Most unfinalized audio replayed into a new stream.
+        bytes_per_second (int): Audio data rate, to size the overlap and map
+            result end times to bytes.
+        backoff_initial (float): First retry delay after a failure, doubled each time.
+        backoff_max (float): Longest retry delay.
+        max_retries (int): Consecutive failures tolerated; None retries forever.
+    """
+
+    def __init__(self, audio, recognize, on_transcript, on_partial=print_partial, on_status=None,
+                 stream_limit=STREAM_LIMIT_SECONDS, overlap_seconds=OVERLAP_SECONDS,
+                 bytes_per_second=BYTES_PER_SECOND, backoff_initial=BACKOFF_INITIAL,
+                 backoff_max=BACKOFF_MAX, max_retries=None):
+        self.audio = audio
+        self.recognize = recognize
+        self.on_transcript = on_transcript
+        self.on_partial = on_partial
+        self.on_status = on_status
+        self.stream_limit = stream_limit
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+        self.bytes_per_second = bytes_per_second
+        self.sessions = 0
+        self._overlap = OverlapBuffer(int(overlap_seconds * bytes_per_second))
+        # Overlap offset of the first byte sent on the current stream, which
+        # the recognizer's result_end_time is measured from.
+        self._session_start = 0
+        self._session_responded = False
+        self._stop_event = threading.Event()
+        self._source_closed = False
+        self._utterance_started_at = None
+
+    def stop(self):
+        """Ends the current stream and makes `run` return."""
+        self._stop_event.set()
+
+    def run(self):
+        """Recognizes until the audio buffer is closed or `stop` is called."""
+        failures = 0
+        while not self._stop_event.is_set() and not self._source_closed:
+            self.sessions += 1
+            self._session_responded = False
+            try:
+                self._run_session()
+            except Exception as e:
+                # A stream that transcribed something before failing was
+                # working; only back-to-back dead streams escalate the backoff.
+                failures = 1 if self._session_responded else failures + 1
+                increment('stt_stream_errors')
+                if self.max_retries is not None and failures > self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_initial * 2 ** (failures - 1))
+                # Jitter, so many clients don't reconnect in lockstep.
+                delay *= random.uniform(0.5, 1.0)
+                self._status(f"Speech stream failed ({e}); reconnecting in {delay:.1f}s...")
+                if self._stop_event.wait(delay):
+                    return
+                increment('stt_reconnects')
+                self._status("Reconnected. Speak your next command.")
+            else:
+                if self._session_responded:
+                    failures = 0
+                if not self._stop_event.is_set() and not self._source_closed:
+                    increment('stt_rollovers')
+
+    def _run_session(self):
+        """Runs one recognizer stream until it ends, rolls over or fails."""
+        deadline = time.monotonic() + self.stream_limit
+        for response in self.recognize(self._session_audio(deadline)):
+            self._session_responded = True
+            self._handle_response(response)
+
+    def _session_audio(self, deadline):
+        self._session_start, replay = self._overlap.snapshot()
+        if replay:
+            increment('audio_chunks_replayed', len(replay))
+            yield from replay
+
+        while not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                batch = self.audio.get_batch(timeout=min(remaining, POLL_INTERVAL))
+            except queue.Empty:
+                continue
+            if batch is None:
+                self._source_closed = True
+                return
+            captured_at, data = batch
+            # How long the oldest chunk in this batch waited to be sent.
+            observe('audio_capture', time.perf_counter() - captured_at)
+            self._overlap.append(data)
+            yield data
+
+    def _handle_response(self, response):
+        if not response.results:
+            return
+        result = response.results[0]
+        if not result.alternatives:
+            return
+
+        transcript = result.alternatives[0].transcript
+        if self._utterance_started_at is None:
+            self._utterance_started_at = time.perf_counter()
+
+        if result.is_final:
+            # Time from the first partial result of the utterance to its final transcript.
+            observe('stt_final', time.perf_counter() - self._utterance_started_at)
+            self._utterance_started_at = None
+            # Audio up to the end of this result never needs replaying; audio
+            # sent after it may be the start of the next utterance.
+            end = _seconds(getattr(result, 'result_end_time', None))
+            if not end:
+                # No offset to go by: assume everything sent was transcribed.
+                self._overlap.clear()
+            else:
+                self._overlap.discard_until(self._session_start + round(end * self.bytes_per_second))
+            sys.stdout.write(f"\r{transcript}\n")
+            self._deliver(self.on_transcript, transcript)
+        elif self.on_partial is not None:
+            self._deliver(self.on_partial, transcript)
+
+    def _deliver(self, callback, transcript):
+        """
+        Runs a transcript callback. Its errors (e.g. a failed search) are not
+        the recognizer's fault, so they must not tear down a healthy stream.
+        """
+        try:
+            callback(transcript)
+        except Exception as e:
+            increment('transcript_handler_errors')
+            self._status(f"Handling '{transcript}' failed ({e}). Speak your next command.")
+
+    def _status(self, message):
+        print(message)
+        if self.on_status is not None:
+            self.on_status(message)
@@ -0,0 +1,142 @@
+"""
+Tests for the batch transcription and search pipeline.
+"""
+import json
+import os
+import sys
+import threading
+import wave
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_transcribe
+from metrics import REGISTRY
+
+
+def write_wav(path, frames=1600, rate=16000):
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x00" * frames)
+
+
+class CountingRecognizer:
+    """Fake recognizer that records how many requests run at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def recognize(self, clip):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            threading.Event().wait(0.05)
+            name = os.path.splitext(os.path.basename(clip.path))[0]
+            return None if name == "silence" else f"Show me a {name}"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestBatchTranscribe:
+    """Test cases for decoding and the end-to-end batch run."""
+
+    def test_decode_wav(self, tmp_path):
+        """Test that WAV files decode to LINEAR16 PCM."""
+        path = tmp_path / "dog.wav"
+        write_wav(path, frames=800, rate=8000)
+        clip = batch_transcribe.decode_audio_file(str(path))
+        assert clip.encoding == "LINEAR16"
+        assert clip.sample_rate == 8000
+        assert len(clip.content) == 1600
+
+    def test_decode_webm_passthrough(self, tmp_path):
+        """Test that WebM files are passed through for the Speech API without PyAV."""
+        path = tmp_path / "cat.webm"
+        path.write_bytes(b"\x1aE\xdf\xa3opus")
+        clip = batch_transcribe.decode_audio_file(str(path), decode_webm_audio=False)
+        assert clip.encoding == "WEBM_OPUS"
+        assert clip.content == b"\x1aE\xdf\xa3opus"
+
+    def test_decode_webm_to_pcm(self, tmp_path):
+        """Test that WebM/Opus is decoded to 16 kHz mono LINEAR16 with PyAV."""
+        av = pytest.importorskip("av")
+        np = pytest.importorskip("numpy")
+        path = str(tmp_path / "cat.webm")
+        with av.open(path, "w", format="webm") as container:
+            stream = container.add_stream("libopus", rate=48000)
+            stream.layout = "mono"
+            samples = np.zeros((1, 48000), dtype=np.int16)
+            frame = av.AudioFrame.from_ndarray(samples, format="s16", layout="mono")
+            frame.sample_rate = 48000
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            for packet in stream.encode(None):
+                container.mux(packet)
+
+        clip = batch_transcribe.decode_audio_file(path, decode_webm_audio=True)
+        assert clip.encoding == "LINEAR16"
+        assert (clip.sample_rate, clip.channels) == (16000, 1)
+        # About one second of 16-bit samples, give or take the codec's padding.
+        assert abs(len(clip.content) - 32000) < 3200
+
+    def test_run_batch(self, tmp_path):
+        """Test the full pipeline with a fake recognizer and search."""
+        for name in ("dog", "cat", "car", "silence"):
+            write_wav(tmp_path / f"{name}.wav")
+        (tmp_path / "broken.wav").write_bytes(b"not a wav file")
+
+        recognizer = CountingRecognizer()
+        searches = []
+        before = REGISTRY.snapshot()['stages']
+
+        def search_batch(queries, top_k):
+            searches.append(list(queries))
+            return [[f"{q}_{i}.jpg" for i in range(top_k)] for q in queries]
+
+        paths = batch_transcribe.find_audio_files(str(tmp_path))
+        records = batch_transcribe.run_batch(
+            paths, recognizer, normalize=lambda t: t.lower().split()[-1], search_batch=search_batch,
+            top_k=2, decode_workers=2, max_in_flight=4,
+        )
+        by_name = {os.path.basename(r["file"]): r for r in records}
+
+        assert by_name["dog.wav"]["results"] == ["dog_0.jpg", "dog_1.jpg"]
+        assert by_name["silence.wav"]["query"] is None
+        assert by_name["broken.wav"]["error"]
+        assert len(searches) == 1
+        assert recognizer.max_in_flight > 1
+
+        # One sample per file, not one per batch.
+        after = REGISTRY.snapshot()['stages']
+        added = {stage: after[stage]['count'] - before.get(stage, {}).get('count', 0)
+                 for stage in ('batch_audio_decode', 'batch_stt_recognize', 'batch_spacy')}
+        assert added == {'batch_audio_decode': 5, 'batch_stt_recognize': 4, 'batch_spacy': 3}
+
+        output = tmp_path / "out.jsonl"
+        batch_transcribe.write_jsonl(records, str(output))
+        assert len(output.read_text().splitlines()) == 5
+        assert json.loads(output.read_text().splitlines()[0])["file"] == paths[0]
+
+    def test_transcript_file_recognizer(self, tmp_path):
+        """Test the offline sidecar-transcript recognizer."""
+        write_wav(tmp_path / "q1.wav")
+        (tmp_path / "q1.txt").write_text("a red car\n")
+        clip = batch_transcribe.decode_audio_file(str(tmp_path / "q1.wav"))
+        assert batch_transcribe.TranscriptFileRecognizer().recognize(clip) == "a red car"
+
+    def test_unknown_recognizer(self):
+        """Test that unknown recognizer names are rejected."""
+        with pytest.raises(ValueError):
+            batch_transcribe.load_recognizer("nope")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,63 @@
+"""
+Tests for the offline benchmark suite.
+"""
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+import benchmark
+
+
+class TestBenchmark:
+    """Test cases for the synthetic corpus and measurements."""
+
+    def test_corpus_is_reproducible(self):
+        """Test that the same seed always yields the same vectors."""
+        centroids = benchmark.make_centroids(dim=32, num_clusters=8)
+        first = np.concatenate([c for _, c in benchmark.iter_corpus(500, centroids, chunk_size=128)])
+        second = np.concatenate([c for _, c in benchmark.iter_corpus(500, centroids, chunk_size=128)])
+        assert first.shape == (500, 32)
+        assert first.dtype == np.float32
+        np.testing.assert_array_equal(first, second)
+
+    def test_flat_index_has_perfect_recall(self):
+        """Test that the exact index matches the chunked ground truth."""
+        centroids = benchmark.make_centroids(dim=32, num_clusters=8)
+        queries = benchmark.make_queries(20, centroids)
+        true_ids = benchmark.ground_truth(1000, centroids, queries, top_k=5)
+        index, _ = benchmark.build_index('Flat', 1000, centroids, dim=32)
+        row = benchmark.measure_index(index, queries, true_ids, benchmark.make_image_map(1000), top_k=5)
+        assert row['recall_at_5'] == pytest.approx(1.0)
+        assert row['qps'] > 0
+
+    def test_parse_config(self):
+        """Test splitting factory strings from search parameters."""
+        assert benchmark.parse_config('IVF1024,Flat:nprobe=16') == ('IVF1024,Flat', {'nprobe': 16})
+        assert benchmark.parse_config('Flat') == ('Flat', {})
+
+    def test_compare_to_baseline(self):
+        """Test that only changes beyond the tolerances are reported."""
+        baseline = [{'config': 'Flat', 'n': 10, 'threads': 1, 'top_k': 9,
+                     'qps': 1000.0, 'p99_ms': 1.0, 'recall_at_9': 1.0}]
+        same = [dict(baseline[0], qps=950.0)]
+        worse = [dict(baseline[0], qps=500.0, p99_ms=2.0, recall_at_9=0.9)]
+        assert benchmark.compare_to_baseline(same, baseline) == []
+        assert len(benchmark.compare_to_baseline(worse, baseline)) == 3
+
+    def test_crossover_ignores_an_early_win(self):
+        """Test that the crossover is where intra-query stays ahead, not where it first wins."""
+        sizes = [1, 2, 4, 8, 16]
+        inter = [100.0] * 5
+        assert benchmark.find_crossover(sizes, [90.0, 101.0, 95.0, 120.0, 150.0], inter) == 8
+        assert benchmark.find_crossover(sizes, [90.0, 120.0, 130.0, 140.0, 99.0], inter) is None
+        assert benchmark.find_crossover(sizes, [100.0] * 5, inter) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
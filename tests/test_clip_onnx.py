@@ -0,0 +1,50 @@
+"""
+Parity tests for the ONNX CLIP encoders against the PyTorch model.
+"""
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("numpy")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+pytest.importorskip("sentence_transformers")
+
+import clip_onnx
+
+MODEL_DIR = os.environ.get("CLIP_ONNX_DIR", clip_onnx.ONNX_MODEL_DIR)
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(MODEL_DIR, clip_onnx.MANIFEST_NAME)),
+    reason="no ONNX export found; run `python clip_onnx.py export --quantize` first",
+)
+
+
+class TestClipOnnx:
+    """Test cases for the exported text encoder."""
+
+    def test_fp32_text_parity(self):
+        """Test that the fp32 export matches PyTorch embeddings."""
+        similarities = clip_onnx.check_parity(MODEL_DIR)
+        assert similarities["fp32"] > 0.999
+
+    def test_int8_text_parity(self):
+        """Test that the quantized export stays close to PyTorch embeddings."""
+        similarities = clip_onnx.check_parity(MODEL_DIR)
+        if "int8" not in similarities:
+            pytest.skip("export was made without --quantize")
+        assert similarities["int8"] > 0.97
+
+    def test_encode_shape(self):
+        """Test that encode returns one float32 row per input."""
+        encoder = clip_onnx.OnnxClipEncoder(MODEL_DIR)
+        vectors = encoder.encode(["dog", "a red car parked on the street"])
+        assert vectors.shape == (2, encoder.manifest["dim"])
+        assert vectors.dtype == "float32"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
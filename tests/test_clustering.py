@@ -0,0 +1,109 @@
+"""
+Tests for the streaming mini-batch k-means and the cluster artifacts.
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+from clustering import ClusterModel, build_clusters, build_ivf_index, embeddings_source, iter_chunks
+
+
+def make_blobs(num_blobs=4, per_blob=50, dim=16, seed=0):
+    """Well-separated unit vectors around `num_blobs` random directions."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_blobs, dim)).astype(np.float32)
+    vectors = np.repeat(centers, per_blob, axis=0) + 0.05 * rng.standard_normal((num_blobs * per_blob, dim))
+    vectors = vectors.astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    labels = np.repeat(np.arange(num_blobs), per_blob)
+    return vectors, labels
+
+
+def array_source(vectors, reads=None):
+    """A source(start, n) over an array that records the size of every read."""
+    def source(start, n):
+        if reads is not None:
+            reads.append(n)
+        return vectors[start:start + n]
+    return source
+
+
+class TestClustering:
+    """Test cases for k-means, assignment and persistence."""
+
+    def test_chunks_cover_the_source(self):
+        """Test that chunking visits every row exactly once."""
+        vectors = np.arange(10, dtype=np.float32)[:, None]
+        chunks = list(iter_chunks(array_source(vectors), 10, chunk_size=4))
+        assert [start for start, _ in chunks] == [0, 4, 8]
+        assert np.concatenate([c for _, c in chunks]).ravel().tolist() == list(range(10))
+
+    def test_recovers_separated_blobs(self):
+        """Test that each blob ends up in a single cluster."""
+        vectors, labels = make_blobs()
+        model = build_clusters(array_source(vectors), len(vectors), num_clusters=4, chunk_size=32, epochs=5)
+        for blob in range(4):
+            assert len(set(model.assignments[labels == blob].tolist())) == 1
+        assert model.sizes.sum() == len(vectors)
+
+    def test_reads_stay_within_chunk_size(self):
+        """Test that the source is never asked for more than one chunk."""
+        vectors, _ = make_blobs()
+        reads = []
+        build_clusters(array_source(vectors, reads), len(vectors), num_clusters=4, chunk_size=32)
+        assert max(reads) <= 32
+
+    def test_streams_from_memory_mapped_embeddings(self, tmp_path):
+        """Test clustering straight from an embeddings.npy opened with mmap_mode='r'."""
+        vectors, labels = make_blobs()
+        path = str(tmp_path / "embeddings.npy")
+        np.save(path, vectors)
+        embeddings = np.load(path, mmap_mode="r")
+        model = build_clusters(embeddings_source(embeddings), len(embeddings), num_clusters=4, chunk_size=32)
+        for blob in range(4):
+            assert len(set(model.assignments[labels == blob].tolist())) == 1
+
+    def test_exemplars_are_closest_members(self):
+        """Test that exemplars belong to their cluster, best first, padded with -1."""
+        vectors, _ = make_blobs(num_blobs=3, per_blob=5)
+        model = build_clusters(array_source(vectors), len(vectors), num_clusters=3, chunk_size=4,
+                               exemplars_per_cluster=8)
+        for c in range(model.num_clusters):
+            ids = model.exemplars[c][model.exemplars[c] >= 0]
+            assert len(ids) == model.sizes[c]
+            assert (model.assignments[ids] == c).all()
+            sims = vectors[ids] @ model.centroids[c]
+            assert (np.diff(sims) <= 1e-6).all()
+            assert (model.exemplars[c][len(ids):] == -1).all()
+
+    def test_save_and_load(self, tmp_path):
+        """Test that a saved clustering loads back unchanged."""
+        vectors, _ = make_blobs()
+        model = build_clusters(array_source(vectors), len(vectors), num_clusters=4)
+        path = str(tmp_path / "clusters.npz")
+        model.save(path)
+        loaded = ClusterModel.load(path)
+        assert np.array_equal(loaded.assignments, model.assignments)
+        assert np.allclose(loaded.centroids, model.centroids)
+        assert loaded.members(0).tolist() == np.flatnonzero(model.assignments == 0).tolist()
+
+    def test_centroids_as_coarse_quantizer(self):
+        """Test that an IVF index on the centroids lists each cluster's members."""
+        vectors, _ = make_blobs()
+        source = array_source(vectors)
+        model = build_clusters(source, len(vectors), num_clusters=4)
+        ivf = build_ivf_index(source, len(vectors), model.centroids, chunk_size=32)
+        assert ivf.ntotal == len(vectors)
+        for c in range(model.num_clusters):
+            assert ivf.invlists.list_size(c) == model.sizes[c]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,202 @@
+"""
+Tests for the search engine's hybrid retrieval, result cache and hot
+reload, against a tiny index built in a temporary directory.
+"""
+import os
+import pickle
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("PIL")
+
+import clip_onnx
+import index_store
+from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex, reciprocal_rank_fusion
+from metrics import REGISTRY
+from result_cache import ResultCache
+
+DIM = 8
+IMAGE_VECTORS = np.random.default_rng(0).standard_normal((6, DIM)).astype('float32')
+faiss.normalize_L2(IMAGE_VECTORS)
+DOCUMENTS = [
+    "a dog lying on the grass",
+    "a puppy chewing a shoe",
+    "a cat on a sofa",
+    "a red backpack",
+    "a busy street at night",
+    "a dog carrying a backpack",
+]
+
+
+class FakeEncoder:
+    """Encodes 'dog' as image 0's vector and anything else as image 3's."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encoder_id(self, tower='text'):
+        return 'fake'
+
+    def encode(self, texts):
+        self.calls += 1
+        return np.array([IMAGE_VECTORS[0] if 'dog' in text else IMAGE_VECTORS[3] for text in texts])
+
+
+def build_version(root, prefix, documents=None):
+    """Writes and publishes a version whose image map names images '<prefix><id>.jpg'."""
+    version_dir = index_store.new_version_dir(root)
+    index = faiss.IndexFlatIP(DIM)
+    index.add(IMAGE_VECTORS)
+    faiss.write_index(index, os.path.join(version_dir, index_store.FAISS_INDEX_NAME))
+    with open(os.path.join(version_dir, index_store.IMAGE_MAP_NAME), 'wb') as f:
+        pickle.dump({i: f"{prefix}{i}.jpg" for i in range(len(IMAGE_VECTORS))}, f)
+    extra_files = {}
+    if documents is not None:
+        LexicalIndex.build(documents).save(os.path.join(version_dir, LEXICAL_INDEX_NAME))
+        extra_files['lexical_index'] = LEXICAL_INDEX_NAME
+    index_store.write_manifest(version_dir, extra_files=extra_files)
+    return index_store.publish(version_dir, root)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """The search_engine module, searching a fresh tiny index with a fake encoder."""
+    monkeypatch.chdir(tmp_path)
+    build_version(index_store.INDEX_ROOT, 'v1/', DOCUMENTS)
+    monkeypatch.setattr(clip_onnx, 'load_encoder', lambda *args, **kwargs: FakeEncoder())
+    import search_engine
+
+    # The index paths are relative, so a watcher left running would follow
+    # the tests from one temporary directory to the next.
+    if search_engine._watcher is not None:
+        search_engine._watcher.stop()
+    monkeypatch.setattr(search_engine, '_state', search_engine.load_index_state())
+    monkeypatch.setattr(search_engine, 'model', FakeEncoder())
+    monkeypatch.setattr(search_engine, '_cache', ResultCache())
+    monkeypatch.setattr(search_engine, '_warm_queries', None)
+    monkeypatch.setattr(search_engine, 'CACHE_ENABLED', True)
+    return search_engine
+
+
+def semantic_ranking(text):
+    """The exact inner-product ranking of every image for a query."""
+    query = FakeEncoder().encode([text])[0]
+    return np.argsort(-(IMAGE_VECTORS @ query), kind='stable').tolist()
+
+
+class TestHybridSearch:
+    """Test cases for semantic, lexical and fused retrieval."""
+
+    def test_stream_yields_semantic_then_fused(self, engine):
+        """Test that the stream sends the FAISS hits first and the RRF re-ranking last."""
+        semantic, fused = engine.search_images_stream("dog", top_k=3, use_cache=False)
+        ranking = semantic_ranking("dog")
+        assert (semantic.phase, semantic.final) == ('semantic', False)
+        assert list(semantic.ids) == ranking[:3]
+        assert semantic.paths == [f"v1/{i}.jpg" for i in ranking[:3]]
+
+        lexical = engine.current_state().lexical.search("dog", engine.HYBRID_DEPTH)[0].tolist()
+        expected_ids, _ = reciprocal_rank_fusion([ranking, lexical], 3, with_scores=True)
+        assert (fused.phase, fused.final) == ('fused', True)
+        assert list(fused.ids) == expected_ids
+        assert fused.paths == [f"v1/{i}.jpg" for i in expected_ids]
+
+    def test_lexical_match_is_promoted(self, engine):
+        """Test that an image matching the caption outranks its semantic position."""
+        ranking = semantic_ranking("dog")
+        fused = list(engine.search_images_stream("dog", top_k=3, use_cache=False))[-1]
+        assert 5 in fused.ids
+        assert ranking.index(5) > fused.ids.index(5)
+
+    def test_batch_matches_stream(self, engine):
+        """Test that a batch returns the same fused results as single searches."""
+        batch = engine.search_images_batch(["dog", "backpack"], top_k=3, use_cache=False)
+        streamed = [list(engine.search_images_stream(q, top_k=3, use_cache=False))[-1].paths
+                    for q in ["dog", "backpack"]]
+        assert batch == streamed
+
+    def test_semantic_without_lexical_index(self, engine, monkeypatch):
+        """Test that hybrid falls back to one semantic update, without FAISS's -1 padding."""
+        monkeypatch.setattr(engine, '_state', engine.current_state()._replace(lexical=None))
+        updates = list(engine.search_images_stream("dog", top_k=10, use_cache=False))
+        assert [(u.phase, u.final) for u in updates] == [('semantic', True)]
+        assert list(updates[0].ids) == semantic_ranking("dog")
+        assert engine.search_images("dog", top_k=10, use_cache=False) == updates[0].paths
+
+
+class TestResultCache:
+    """Test cases for the engine's use of the result cache."""
+
+    def test_second_search_is_a_cache_hit(self, engine):
+        """Test that a repeated query is answered from the cache without encoding."""
+        hits = REGISTRY.snapshot()['counters'].get('result_cache_hits', 0)
+        first = list(engine.search_images_stream("dog", top_k=3))[-1]
+        again = list(engine.search_images_stream("dog", top_k=3))
+        assert [(u.phase, u.final) for u in again] == [('cached', True)]
+        assert again[0].ids == first.ids and again[0].paths == first.paths
+        assert engine.model.calls == 1
+        assert REGISTRY.snapshot()['counters']['result_cache_hits'] == hits + 1
+
+    def test_use_cache_false_always_searches(self, engine):
+        """Test that use_cache=False neither reads nor fills the cache."""
+        engine.search_images("dog", top_k=3, use_cache=False)
+        engine.search_images("dog", top_k=3, use_cache=False)
+        assert engine.model.calls == 2
+        assert engine._cache.stats() == {'results': 0, 'embeddings': 0}
+
+    def test_warm_cache_is_a_no_op_when_caching_is_disabled(self, engine, monkeypatch):
+        """Test that warming neither searches nor fills the cache with CACHE_ENABLED off."""
+        monkeypatch.setattr(engine, 'CACHE_ENABLED', False)
+        assert engine.warm_cache(["dog", "backpack"], top_k=3) == []
+        assert engine.model.calls == 0
+        assert engine._cache.stats() == {'results': 0, 'embeddings': 0}
+
+
+class TestReloadIndex:
+    """Test cases for swapping in a newly published index."""
+
+    def test_reload_swaps_the_state(self, engine):
+        """Test that a new version is swapped in, and its results replace the cached ones."""
+        old = engine.current_state()
+        assert engine.search_images("dog", top_k=1) == ["v1/0.jpg"]
+        assert engine.reload_index() is False
+
+        version = build_version(index_store.INDEX_ROOT, 'v2/', DOCUMENTS)
+        assert engine.reload_index() is True
+        assert engine.current_state().version == version != old.version
+        assert engine._cache.stats()['results'] == 0
+        assert engine.search_images("dog", top_k=1) == ["v2/0.jpg"]
+
+    def test_reload_rewarms_the_cache(self, engine):
+        """Test that warmed queries are cached for the new version before it goes live."""
+        engine.warm_cache(["dog"], top_k=3)
+        build_version(index_store.INDEX_ROOT, 'v2/', DOCUMENTS)
+        engine.reload_index()
+        calls = engine.model.calls
+        assert [u.phase for u in engine.search_images_stream("dog", top_k=3)] == ['cached']
+        assert engine.model.calls == calls
+
+    def test_reload_prefers_the_clustering_ivf_index(self, engine):
+        """Test that an IVF index registered by clustering.py is searched once reloaded."""
+        from clustering import IVF_INDEX_NAME, build_ivf_index, embeddings_source
+
+        version_dir = os.path.join(index_store.INDEX_ROOT, engine.current_state().version)
+        ivf = build_ivf_index(embeddings_source(IMAGE_VECTORS), len(IMAGE_VECTORS), IMAGE_VECTORS[[0, 3]])
+        faiss.write_index(ivf, os.path.join(version_dir, IVF_INDEX_NAME))
+        index_store.register_file(version_dir, 'ivf_index', IVF_INDEX_NAME)
+
+        assert engine.reload_index() is True
+        index = engine.current_state().index
+        assert faiss.extract_index_ivf(index).nprobe == engine.IVF_NPROBE
+        assert engine.search_images("dog", top_k=1, use_cache=False) == ["v1/0.jpg"]
+        assert engine.reload_index() is False
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
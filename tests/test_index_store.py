@@ -0,0 +1,132 @@
+"""
+Tests for the versioned index layout and the reload watcher.
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_store
+
+
+def make_version(root, **info):
+    version_dir = index_store.new_version_dir(str(root))
+    for name in (index_store.FAISS_INDEX_NAME, index_store.IMAGE_MAP_NAME):
+        with open(os.path.join(version_dir, name), "wb") as f:
+            f.write(b"data")
+    index_store.write_manifest(version_dir, **info)
+    return version_dir
+
+
+class TestIndexStore:
+    """Test cases for publishing and resolving index versions."""
+
+    def test_legacy_fallback(self, tmp_path):
+        """Test that the flat files are used when nothing is published."""
+        version, version_dir, faiss_path, _ = index_store.resolve(str(tmp_path))
+        assert version == index_store.LEGACY_VERSION
+        assert version_dir is None
+        assert faiss_path == index_store.LEGACY_FAISS_INDEX_PATH
+
+    def test_version_dirs_are_unique(self, tmp_path):
+        """Test that two builds in the same second get different directories."""
+        assert index_store.new_version_dir(str(tmp_path)) != index_store.new_version_dir(str(tmp_path))
+
+    def test_publish_and_resolve(self, tmp_path):
+        """Test that publishing switches what resolve returns."""
+        first = make_version(tmp_path, ntotal=10)
+        index_store.publish(first, str(tmp_path))
+        second = make_version(tmp_path, ntotal=20)
+        assert index_store.resolve(str(tmp_path))[1] == first
+
+        version = index_store.publish(second, str(tmp_path))
+        resolved_version, version_dir, faiss_path, map_path = index_store.resolve(str(tmp_path))
+        assert resolved_version == version
+        assert version_dir == second
+        assert os.path.exists(faiss_path) and os.path.exists(map_path)
+        assert index_store.read_manifest(second)["ntotal"] == 20
+
+    def test_locate_a_version_that_is_not_live(self, tmp_path):
+        """Test that a specific version's files are found regardless of CURRENT."""
+        first = make_version(tmp_path)
+        index_store.publish(first, str(tmp_path))
+        second = make_version(tmp_path)
+        version_dir, faiss_path, _ = index_store.locate(os.path.basename(second), str(tmp_path))
+        assert version_dir == second
+        assert faiss_path.startswith(second)
+        assert index_store.locate(index_store.LEGACY_VERSION, str(tmp_path))[0] is None
+
+    def test_publish_requires_manifest(self, tmp_path):
+        """Test that an unfinished build cannot be published."""
+        with pytest.raises(FileNotFoundError):
+            index_store.publish(index_store.new_version_dir(str(tmp_path)), str(tmp_path))
+
+    def test_prune_keeps_live_version(self, tmp_path):
+        """Test that pruning never deletes the published version."""
+        live = make_version(tmp_path)
+        index_store.publish(live, str(tmp_path))
+        for _ in range(3):
+            make_version(tmp_path)
+        index_store.prune(str(tmp_path), keep=1)
+        remaining = [name for name in os.listdir(tmp_path) if os.path.isdir(tmp_path / name)]
+        assert len(remaining) == 2
+        assert os.path.exists(live)
+
+    def test_fingerprint_changes_on_rebuild_in_place(self, tmp_path):
+        """Test that rewriting the files under the same version name changes the fingerprint."""
+        path = tmp_path / "image_index.faiss"
+        path.write_bytes(b"data")
+        before = index_store.fingerprint(index_store.LEGACY_VERSION, str(path))
+        assert before == index_store.fingerprint(index_store.LEGACY_VERSION, str(path))
+        path.write_bytes(b"rebuilt")
+        assert index_store.fingerprint(index_store.LEGACY_VERSION, str(path)) != before
+
+    def test_watcher_reports_new_versions(self, tmp_path):
+        """Test that the watcher calls back when CURRENT changes."""
+        index_store.publish(make_version(tmp_path), str(tmp_path))
+        seen = []
+        changed = threading.Event()
+
+        def on_change(version):
+            seen.append(version)
+            changed.set()
+
+        watcher = index_store.IndexWatcher(on_change, str(tmp_path), poll_interval=0.01)
+        watcher.start()
+        try:
+            version = index_store.publish(make_version(tmp_path), str(tmp_path))
+            assert changed.wait(timeout=2)
+            assert seen == [version]
+        finally:
+            watcher.stop()
+
+    def test_watcher_retries_a_failed_reload(self, tmp_path):
+        """Test that a version whose reload raised is reloaded again on the next poll."""
+        index_store.publish(make_version(tmp_path), str(tmp_path))
+        attempts = []
+        reloaded = threading.Event()
+
+        def on_change(version):
+            attempts.append(version)
+            if len(attempts) == 1:
+                raise OSError("index file still being copied")
+            reloaded.set()
+
+        watcher = index_store.IndexWatcher(on_change, str(tmp_path), poll_interval=0.01)
+        watcher.start()
+        try:
+            version = index_store.publish(make_version(tmp_path), str(tmp_path))
+            assert reloaded.wait(timeout=2)
+            time.sleep(0.05)
+            assert attempts == [version, version]
+        finally:
+            watcher.stop()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,80 @@
+"""
+Tests for the caption/tag BM25 index and rank fusion.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+
+from lexical_index import LexicalIndex, load_coco_documents, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [
+    "A man waiting at a traffic light on a busy street",
+    "A dog catching a frisbee in the park",
+    "Two dogs playing with a red ball",
+    "A student carrying a backpack to school",
+    "",
+]
+
+
+class TestLexicalIndex:
+    """Test cases for building, searching and persisting the index."""
+
+    def test_tokenize(self):
+        """Test stop words and plural folding."""
+        assert tokenize("The dogs and a Traffic-Light") == ["dog", "traffic", "light"]
+
+    def test_exact_object_query(self):
+        """Test that an exact object query ranks the matching image first."""
+        index = LexicalIndex.build(DOCUMENTS)
+        ids, scores = index.search("backpack", top_k=3)
+        assert ids.tolist() == [3]
+        assert scores[0] > 0
+
+    def test_multi_term_ranking(self):
+        """Test that matching more query terms ranks higher."""
+        index = LexicalIndex.build(DOCUMENTS)
+        ids, _ = index.search("dog frisbee", top_k=5)
+        assert ids[0] == 1
+        assert set(ids.tolist()) == {1, 2}
+
+    def test_no_match(self):
+        """Test that unknown words return no results."""
+        assert len(LexicalIndex.build(DOCUMENTS).search("giraffe")[0]) == 0
+
+    def test_save_and_load(self, tmp_path):
+        """Test that the CSR arrays round-trip through disk."""
+        path = str(tmp_path / "lexical.npz")
+        LexicalIndex.build(DOCUMENTS).save(path)
+        loaded = LexicalIndex.load(path)
+        assert loaded.num_docs == len(DOCUMENTS)
+        assert loaded.search("traffic light")[0].tolist() == [0]
+
+    def test_reciprocal_rank_fusion(self):
+        """Test that ids ranked well by both retrievers win."""
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], top_k=3)
+        assert fused[0] == 1
+        assert set(fused) == {1, 3, 2}
+
+    def test_load_coco_documents(self, tmp_path):
+        """Test that captions and category tags are joined per image."""
+        images = [{"id": 7, "file_name": "000007.jpg"}]
+        (tmp_path / "captions_val2017.json").write_text(json.dumps(
+            {"images": images, "annotations": [{"image_id": 7, "caption": "A bus on the road"}]}))
+        (tmp_path / "instances_val2017.json").write_text(json.dumps(
+            {"images": images, "categories": [{"id": 6, "name": "bus"}],
+             "annotations": [{"image_id": 7, "category_id": 6}]}))
+        documents = load_coco_documents(str(tmp_path), ["/data/000007.jpg", "/data/missing.jpg"])
+        assert "A bus on the road" in documents[0]
+        assert documents[1] == ""
+        assert load_coco_documents(str(tmp_path / "nope"), ["x.jpg"]) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,76 @@
+"""
+Tests for the pipeline latency metrics.
+"""
+import json
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Histogram, MetricsRegistry, add_to_trace, span, trace
+
+
+class TestMetrics:
+    """Test cases for the histogram registry and exporters."""
+
+    def test_histogram_quantiles(self):
+        """Test that quantiles are interpolated over the recorded samples."""
+        hist = Histogram()
+        for i in range(101):
+            hist.observe(i / 100)
+        assert hist.quantile(0.5) == pytest.approx(0.5)
+        assert hist.quantile(0.99) == pytest.approx(0.99)
+        assert hist.count == 101
+        assert hist.max == pytest.approx(1.0)
+
+    def test_histogram_window_is_bounded(self):
+        """Test that only the most recent samples feed the quantiles."""
+        hist = Histogram(window_size=10)
+        for _ in range(100):
+            hist.observe(10.0)
+        for _ in range(10):
+            hist.observe(1.0)
+        assert hist.quantile(0.99) == pytest.approx(1.0)
+        assert hist.count == 110
+
+    def test_empty_histogram(self):
+        """Test that an empty histogram reports zeros instead of failing."""
+        assert Histogram().summary()['p95'] == 0.0
+
+    def test_span_records_into_registry_and_trace(self):
+        """Test that spans land in both the registry and the active trace."""
+        registry = MetricsRegistry()
+        with trace() as timings:
+            with span('faiss_search', registry=registry):
+                pass
+        assert registry.histogram('faiss_search').count == 1
+        assert 'faiss_search' in timings
+
+    def test_add_to_trace(self):
+        """Test that timings measured elsewhere are added to the active trace only."""
+        add_to_trace({'text_encode': 1.0})
+        with trace() as timings:
+            add_to_trace({'text_encode': 0.25, 'faiss_search': 0.5})
+            add_to_trace({'text_encode': 0.25})
+        assert timings == {'text_encode': 0.5, 'faiss_search': 0.5}
+
+    def test_exporters(self):
+        """Test the JSON and Prometheus renderings."""
+        registry = MetricsRegistry()
+        registry.observe('text_encode', 0.02)
+        registry.increment('dropped_audio_chunks', 3)
+
+        snapshot = json.loads(registry.to_json())
+        assert snapshot['stages']['text_encode']['count'] == 1
+        assert snapshot['counters']['dropped_audio_chunks'] == 3
+
+        text = registry.to_prometheus()
+        assert 'voice_search_stage_seconds{stage="text_encode",quantile="0.99"}' in text
+        assert 'voice_search_stage_seconds_count{stage="text_encode"} 1' in text
+        assert 'voice_search_dropped_audio_chunks_total 3' in text
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
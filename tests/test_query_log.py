@@ -0,0 +1,104 @@
+"""
+Tests for the query log writer, its file format and the replay tool.
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import REGISTRY
+from query_log import QueryLogWriter, QueryRecord, decode_block, encode_block, log_files, read_log, replay
+
+RECORDS = [
+    QueryRecord(1000.0, "show me a red car", "red car", [4, 2, 9], [0.75, 0.5, 0.25],
+                {'spacy': 0.002, 'text_encode': 0.01}),
+    QueryRecord(1000.5, "", "dog", [], [], {}),
+    QueryRecord(1001.0, "cats please", "cat", [1], [0.125], {'faiss_search': 0.001}),
+]
+
+
+class TestQueryLogFormat:
+    """Test cases for the columnar block encoding."""
+
+    def test_block_round_trip(self):
+        """Test that records, including empty results and missing stages, survive encoding."""
+        decoded = decode_block(encode_block(RECORDS))
+        assert [r.query for r in decoded] == ["red car", "dog", "cat"]
+        assert decoded[0].ids == [4, 2, 9]
+        assert decoded[0].scores == [0.75, 0.5, 0.25]
+        assert decoded[1].ids == [] and decoded[1].timings == {}
+        assert decoded[2].timings == pytest.approx({'faiss_search': 0.001})
+
+
+class TestQueryLogWriter:
+    """Test cases for the background writer."""
+
+    def test_written_records_read_back(self, tmp_path):
+        """Test that logged records are flushed on close and read back in order."""
+        writer = QueryLogWriter(str(tmp_path), flush_interval=0.01)
+        writer.start()
+        for r in RECORDS:
+            writer.log(r.transcript, r.query, r.ids, r.scores, r.timings, timestamp=r.timestamp)
+        writer.close()
+        assert [r.query for r in read_log(str(tmp_path))] == ["red car", "dog", "cat"]
+
+    def test_rotation(self, tmp_path):
+        """Test that a new file is started once the current one is full."""
+        writer = QueryLogWriter(str(tmp_path), rotate_bytes=1, max_batch=1, flush_interval=0.01)
+        writer.start()
+        for r in RECORDS:
+            writer.log(r.transcript, r.query, r.ids, r.scores, r.timings, timestamp=r.timestamp)
+        writer.close()
+        assert len(log_files(str(tmp_path))) == 3
+        assert len(list(read_log(str(tmp_path)))) == 3
+
+    def test_full_queue_drops_and_counts(self, tmp_path):
+        """Test that logging never blocks when the writer falls behind."""
+        REGISTRY.reset()
+        writer = QueryLogWriter(str(tmp_path), queue_size=1)  # never started, so nothing drains
+        writer.log("a", "a")
+        writer.log("b", "b")
+        assert REGISTRY.snapshot()['counters']['query_log_dropped'] == 1
+
+    def test_truncated_block_is_ignored(self, tmp_path):
+        """Test that a block cut short by a crash doesn't break reading."""
+        writer = QueryLogWriter(str(tmp_path), flush_interval=0.01)
+        writer.start()
+        writer.log("a", "a", [1], [1.0])
+        writer.close()
+        (path,) = log_files(str(tmp_path))
+        with open(path, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00partial')
+        assert [r.query for r in read_log(path)] == ["a"]
+
+
+class TestReplay:
+    """Test cases for replaying logged traffic."""
+
+    def test_replay_reports_overlap(self):
+        """Test that every query is replayed and compared with the logged results."""
+        seen = []
+
+        def search_fn(query):
+            seen.append(query)
+            return [4, 2, 9] if query == "red car" else [7]
+
+        result = replay(RECORDS, search_fn, rate=200)
+        assert sorted(seen) == ["cat", "dog", "red car"]
+        assert result['queries'] == 3 and result['errors'] == 0
+        # "red car" matches fully, "cat" not at all, "dog" had no logged results.
+        assert result['mean_overlap_at_k'] == pytest.approx(0.5)
+
+    def test_replay_counts_errors(self):
+        """Test that failing searches are counted, not raised."""
+        def search_fn(query):
+            raise RuntimeError("down")
+
+        assert replay(RECORDS, search_fn, rate=200)['errors'] == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
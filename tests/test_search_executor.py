@@ -0,0 +1,59 @@
+"""
+Tests for the FAISS search executor.
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+from search_executor import SearchExecutor
+
+
+@pytest.fixture
+def index_and_queries():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 32)).astype("float32")
+    queries = rng.standard_normal((100, 32)).astype("float32")
+    index = faiss.IndexFlatIP(32)
+    index.add(vectors)
+    return index, queries
+
+
+class TestSearchExecutor:
+    """Test cases for the intra- and inter-query paths."""
+
+    def test_small_and_large_batches_match_faiss(self, index_and_queries):
+        """Test that both strategies return exactly what FAISS returns."""
+        index, queries = index_and_queries
+        executor = SearchExecutor(num_workers=3, crossover=50)
+        try:
+            for n in (1, 7, 49, 50, 100):
+                expected_d, expected_i = index.search(queries[:n], 5)
+                distances, indices = executor.search(index, queries[:n], 5)
+                np.testing.assert_array_equal(indices, expected_i)
+                np.testing.assert_allclose(distances, expected_d, rtol=1e-5)
+        finally:
+            executor.shutdown()
+
+    def test_concurrent_callers(self, index_and_queries):
+        """Test many threads sharing one executor."""
+        index, queries = index_and_queries
+        executor = SearchExecutor(num_workers=2)
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(pool.map(lambda i: executor.search(index, queries[i:i + 1], 3)[1], range(40)))
+            expected = index.search(queries[:40], 3)[1]
+            np.testing.assert_array_equal(np.vstack(results), expected)
+        finally:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,193 @@
+"""
+Tests for the search daemon, its wire protocol and the thin client.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not hasattr(__import__("socket"), "AF_UNIX"):
+    pytest.skip("Unix domain sockets are not available", allow_module_level=True)
+
+import search_client as search_client_module
+import search_protocol as protocol
+from metrics import trace
+from search_client import SearchClient, SearchServerError
+from search_server import SearchServer
+
+
+def fake_search(payload):
+    text_query, top_k = protocol.unpack_search(payload)
+    if text_query == "slow":
+        time.sleep(0.3)
+    if text_query == "boom":
+        raise ValueError("index not loaded")
+    return protocol.pack_strings([f"{text_query}_{i}.jpg" for i in range(top_k)])
+
+
+def fake_search_stream(payload):
+    text_query, top_k, use_cache = protocol.unpack_search_stream(payload)
+    if text_query == "boom":
+        raise ValueError("stream failed")
+    if text_query == "slow":
+        time.sleep(0.3)
+    paths = [f"{text_query}_{i}.jpg" for i in range(top_k)]
+    yield protocol.pack_update(protocol.SearchUpdate("semantic", paths, False))
+    phase = "fused" if use_cache is None else "uncached"
+    yield protocol.pack_update(protocol.SearchUpdate(phase, paths[::-1], True, timings={"faiss_search": 0.25}))
+
+
+def fake_search_batch(payload):
+    text_queries, top_k = protocol.unpack_search_batch(payload)
+    return protocol.pack_string_lists([[f"{q}_{i}.jpg" for i in range(top_k)] for q in text_queries])
+
+
+@pytest.fixture
+def client():
+    socket_path = os.path.join(tempfile.mkdtemp(), "search.sock")
+    handlers = {
+        protocol.OP_PING: lambda payload: b"",
+        protocol.OP_SEARCH: fake_search,
+        protocol.OP_SEARCH_BATCH: fake_search_batch,
+        protocol.OP_SEARCH_STREAM: fake_search_stream,
+    }
+    server = SearchServer(socket_path, handlers, max_workers=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    search_client = SearchClient(socket_path, timeout=5)
+    yield search_client
+    search_client.close()
+    server.shutdown()
+    server.server_close()
+
+
+class TestProtocol:
+    """Test cases for the payload encodings."""
+
+    def test_string_lists_round_trip(self):
+        """Test that nested string lists survive encoding."""
+        lists = [["a.jpg", "ü.jpg"], [], ["c.jpg"]]
+        assert protocol.unpack_string_lists(protocol.pack_string_lists(lists)) == lists
+
+    def test_search_round_trip(self):
+        """Test the search request encoding."""
+        assert protocol.unpack_search(protocol.pack_search("red car", 9)) == ("red car", 9)
+
+    def test_update_round_trip(self):
+        """Test that stream updates keep their ids and scores."""
+        update = protocol.SearchUpdate("fused", ["a.jpg", "b.jpg"], True, [7, 3], [0.5, 0.25])
+        assert protocol.unpack_update(protocol.pack_update(update)) == update
+
+    def test_update_with_timings_round_trip(self):
+        """Test that the server's stage timings survive encoding."""
+        update = protocol.SearchUpdate("fused", ["a.jpg"], True, [7], [0.5], {"text_encode": 0.0125, "spacy": 0.5})
+        assert protocol.unpack_update(protocol.pack_update(update)) == update
+
+    def test_search_stream_round_trip(self):
+        """Test that the no-cache flag survives encoding."""
+        assert protocol.unpack_search_stream(protocol.pack_search_stream("red car", 9)) == ("red car", 9, None)
+        assert protocol.unpack_search_stream(protocol.pack_search_stream("dog", 3, use_cache=False)) == \
+            ("dog", 3, False)
+
+
+class TestSearchServer:
+    """Test cases for the server and client over a real socket."""
+
+    def test_search(self, client):
+        """Test a single search request."""
+        assert client.search_images("dog", top_k=2) == ["dog_0.jpg", "dog_1.jpg"]
+
+    def test_batch(self, client):
+        """Test a batched search request."""
+        assert client.search_images_batch(["a", "b"], top_k=1) == [["a_0.jpg"], ["b_0.jpg"]]
+
+    def test_requests_are_multiplexed(self, client):
+        """Test that a slow request does not block a fast one on the same connection."""
+        slow = client.submit(protocol.OP_SEARCH, protocol.pack_search("slow", 1))
+        fast = client.submit(protocol.OP_SEARCH, protocol.pack_search("fast", 1))
+        fast.result(timeout=5)
+        assert not slow.done()
+        assert protocol.unpack_strings(slow.result(timeout=5))[0] == ["slow_0.jpg"]
+
+    def test_concurrent_callers_share_connection(self, client):
+        """Test many threads calling through one client."""
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda i: client.search_images(f"q{i}", top_k=1), range(32)))
+        assert results == [[f"q{i}_0.jpg"] for i in range(32)]
+
+    def test_errors_are_reported(self, client):
+        """Test that handler errors come back as SearchServerError, and the connection survives."""
+        with pytest.raises(SearchServerError, match="index not loaded"):
+            client.search_images("boom")
+        client.ping()
+
+    def test_streamed_search(self, client):
+        """Test that every phase of a streamed search arrives in order."""
+        updates = list(client.search_images_stream("cat", top_k=2))
+        assert [u.phase for u in updates] == ["semantic", "fused"]
+        assert updates[0].paths == ["cat_0.jpg", "cat_1.jpg"]
+        assert updates[1].paths == ["cat_1.jpg", "cat_0.jpg"]
+        assert updates[-1].final
+        assert updates[-1].timings == {"faiss_search": 0.25}
+
+    def test_streamed_search_without_cache(self, client):
+        """Test that use_cache=False reaches the server."""
+        updates = list(client.search_images_stream("cat", top_k=2, use_cache=False))
+        assert updates[-1].phase == "uncached"
+
+    def test_streamed_search_error(self, client):
+        """Test that a failing stream raises on the client."""
+        with pytest.raises(SearchServerError, match="stream failed"):
+            list(client.search_images_stream("boom"))
+
+    def test_timeouts_do_not_leak_requests(self, client):
+        """Test that requests given up on are no longer tracked."""
+        impatient = SearchClient(client.socket_path, timeout=0.05)
+        try:
+            with pytest.raises(TimeoutError):
+                impatient.search_images("slow")
+            with pytest.raises(TimeoutError):
+                list(impatient.search_images_stream("slow"))
+            assert impatient._pending == {}
+            # Late responses are dropped and the connection keeps working.
+            time.sleep(0.4)
+            impatient.ping()
+            assert impatient._pending == {}
+        finally:
+            impatient.close()
+
+    def test_module_stream_logs_the_query(self, client, monkeypatch):
+        """Test that a completed search is logged once, with the caller's trace and the server's timings."""
+        logged = []
+
+        class FakeWriter:
+            def log(self, *record):
+                logged.append(record)
+
+        monkeypatch.setattr(search_client_module, "get_client", lambda: client)
+        monkeypatch.setattr(search_client_module, "QUERY_LOG_ENABLED", True)
+        monkeypatch.setattr(search_client_module.query_log, "get_writer", lambda: FakeWriter())
+        with trace() as timings:
+            timings["spacy"] = 0.5
+            updates = list(search_client_module.search_images_stream("cat", top_k=2, transcript="a cat"))
+        assert len(logged) == 1
+        transcript, query, _, _, logged_timings = logged[0]
+        assert (transcript, query) == ("a cat", "cat")
+        assert logged_timings == {"spacy": 0.5, "faiss_search": 0.25}
+        assert updates[-1].final
+
+    def test_unknown_opcode(self, client):
+        """Test that unknown opcodes are rejected."""
+        with pytest.raises(SearchServerError):
+            client.call(200)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,255 @@
+"""
+Tests for the supervised audio -> recognizer pipeline, using a local fake recognizer.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import REGISTRY
+from stream_pipeline import BYTES_PER_SECOND, AudioBuffer, OverlapBuffer, StreamPipeline
+
+
+def make_response(transcript, is_final, end_bytes=0, bytes_per_second=BYTES_PER_SECOND):
+    """Builds an object shaped like a StreamingRecognizeResponse, ending `end_bytes` into the stream."""
+    alternative = SimpleNamespace(transcript=transcript)
+    result = SimpleNamespace(alternatives=[alternative], is_final=is_final,
+                             result_end_time=timedelta(seconds=end_bytes / bytes_per_second))
+    return SimpleNamespace(results=[result])
+
+
+class FakeRecognizer:
+    """
+    Treats the audio as text. Audio ending in b'.' finishes an utterance,
+    which comes back as a final transcript. The capture buffer may join
+    chunks, so words carry their own separating spaces.
+
+    Args:
+        failures (int): How many streams to fail before working.
+        respond_first (bool): Make failing streams return a partial result
+            before they fail.
+    """
+
+    def __init__(self, failures=0, respond_first=False):
+        self.failures = failures
+        self.respond_first = respond_first
+        self.streams = []
+
+    def __call__(self, audio_chunks):
+        sent = []
+        self.streams.append(sent)
+        if self.failures:
+            self.failures -= 1
+            return self._failing(audio_chunks)
+        return self._responses(audio_chunks, sent)
+
+    def _failing(self, audio_chunks):
+        # Consume a little audio, as a real stream would, before failing.
+        chunk = next(iter(audio_chunks), None)
+        if self.respond_first and chunk is not None:
+            yield make_response(chunk.decode(), False, len(chunk))
+        raise ConnectionError("stream reset")
+
+    @staticmethod
+    def _responses(audio_chunks, sent):
+        text, sent_bytes = "", 0
+        for chunk in audio_chunks:
+            sent.append(chunk)
+            sent_bytes += len(chunk)
+            text += chunk.decode()
+            if text.endswith('.'):
+                yield make_response(text.rstrip('.'), True, sent_bytes)
+                text = ""
+            else:
+                yield make_response(text.strip(), False, sent_bytes)
+
+
+class LateFinalRecognizer:
+    """
+    Sends the final result for "red car." only after more audio has been
+    streamed, then ends the stream, like a rollover right after a final.
+    """
+
+    def __init__(self):
+        self.streams = []
+
+    def __call__(self, audio_chunks):
+        sent = []
+        self.streams.append(sent)
+        return self._responses(audio_chunks, sent, first=len(self.streams) == 1)
+
+    @staticmethod
+    def _responses(audio_chunks, sent, first):
+        for chunk in audio_chunks:
+            sent.append(chunk)
+            if first and b"".join(sent).endswith(b"blue"):
+                yield make_response("red car", True, len(b"red car."))
+                return
+
+
+def feed(buffer, chunks, interval=0.0, close=True):
+    """Pushes chunks into the buffer from another thread, like the audio callback."""
+    def run():
+        for chunk in chunks:
+            buffer.put(chunk)
+            time.sleep(interval)
+        if close:
+            buffer.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def run_pipeline(buffer, recognizer, **kwargs):
+    transcripts = []
+    pipeline = StreamPipeline(buffer, recognizer, transcripts.append, on_partial=None, **kwargs)
+    pipeline.run()
+    return pipeline, transcripts
+
+
+class TestAudioBuffer:
+    """Test cases for the bounded capture buffer."""
+
+    def test_drops_oldest_when_full(self):
+        """Test that a full buffer keeps the newest audio and counts drops."""
+        REGISTRY.reset()
+        buffer = AudioBuffer(max_chunks=2)
+        for chunk in (b'a', b'b', b'c'):
+            buffer.put(chunk)
+        assert buffer.get_batch(timeout=0)[1] == b'bc'
+        assert REGISTRY.snapshot()['counters']['audio_chunks_dropped'] == 1
+
+    def test_close_marker_survives_batching(self):
+        """Test that closing is seen after the last audio, never instead of it."""
+        buffer = AudioBuffer()
+        buffer.put(b'a')
+        buffer.close()
+        assert buffer.get_batch(timeout=0)[1] == b'a'
+        assert buffer.get_batch(timeout=0) is None
+
+    def test_overlap_buffer_is_capped(self):
+        """Test that the ring buffer keeps only the newest bytes."""
+        ring = OverlapBuffer(max_bytes=4)
+        for chunk in (b'aa', b'bb', b'cc'):
+            ring.append(chunk)
+        assert ring.snapshot() == (2, [b'bb', b'cc'])
+
+    def test_overlap_buffer_discards_up_to_offset(self):
+        """Test that only the audio before an offset is dropped, splitting a chunk if needed."""
+        ring = OverlapBuffer(max_bytes=100)
+        for chunk in (b'red ', b'car.blue', b'sky'):
+            ring.append(chunk)
+        ring.discard_until(len(b'red car.'))
+        assert ring.snapshot() == (8, [b'blue', b'sky'])
+        ring.discard_until(100)
+        assert ring.snapshot() == (15, [])
+
+
+class TestStreamPipeline:
+    """Test cases for rollover, overlap replay and reconnects."""
+
+    def test_transcribes_until_closed(self):
+        """Test the plain path: every utterance is delivered once."""
+        buffer = AudioBuffer()
+        feed(buffer, [b'red ', b'car.', b'a ', b'dog.'])
+        pipeline, transcripts = run_pipeline(buffer, FakeRecognizer())
+        assert transcripts == ["red car", "a dog"]
+        assert pipeline.sessions == 1
+
+    def test_rollover_replays_unfinished_audio(self):
+        """Test that a stream cut mid-utterance replays it into the next one."""
+        REGISTRY.reset()
+        buffer = AudioBuffer()
+        recognizer = FakeRecognizer()
+        feed(buffer, [b'show ', b'me ', b'cats.'], interval=0.08)
+        pipeline, transcripts = run_pipeline(buffer, recognizer, stream_limit=0.1)
+        assert pipeline.sessions > 1
+        assert transcripts[-1] == "show me cats"
+        # The second stream started with the words the first never finalized.
+        assert recognizer.streams[1][0].startswith(b'show')
+        counters = REGISTRY.snapshot()['counters']
+        assert counters['stt_rollovers'] >= 1
+        assert counters['audio_chunks_replayed'] >= 1
+
+    def test_final_keeps_audio_sent_after_it(self):
+        """Test that a final result only clears the audio it covers."""
+        buffer = AudioBuffer()
+        recognizer = LateFinalRecognizer()
+        feed(buffer, [b'red ', b'car.', b'blue'])
+        pipeline, transcripts = run_pipeline(buffer, recognizer)
+        assert transcripts == ["red car"]
+        # The next stream starts with the audio after "red car.", not with nothing.
+        assert b"".join(recognizer.streams[1]) == b'blue'
+
+    def test_reconnects_with_backoff(self):
+        """Test that failed streams are retried and no audio is lost."""
+        REGISTRY.reset()
+        buffer = AudioBuffer()
+        feed(buffer, [b'red ', b'car.'])
+        statuses = []
+        pipeline, transcripts = run_pipeline(buffer, FakeRecognizer(failures=2), backoff_initial=0.01,
+                                             on_status=statuses.append)
+        assert transcripts == ["red car"]
+        assert pipeline.sessions == 3
+        assert REGISTRY.snapshot()['counters']['stt_reconnects'] == 2
+        assert any("reconnecting" in status for status in statuses)
+
+    def test_gives_up_after_max_retries(self):
+        """Test that a persistent failure is raised once retries run out."""
+        buffer = AudioBuffer()
+        feed(buffer, [b'a'] * 10, close=False)
+        with pytest.raises(ConnectionError):
+            run_pipeline(buffer, FakeRecognizer(failures=5), backoff_initial=0.01, max_retries=1)
+
+    def test_streams_that_responded_reset_the_backoff(self):
+        """Test that failures after useful responses don't count towards max_retries."""
+        buffer = AudioBuffer()
+        feed(buffer, [b'red ', b'car.'])
+        pipeline, transcripts = run_pipeline(buffer, FakeRecognizer(failures=3, respond_first=True),
+                                             backoff_initial=0.01, max_retries=1)
+        assert pipeline.sessions == 4
+        assert len(transcripts) == 1
+
+    def test_callback_errors_keep_the_stream(self):
+        """Test that a failing transcript callback is reported without reconnecting."""
+        REGISTRY.reset()
+        buffer = AudioBuffer()
+        feed(buffer, [b'red ', b'car.', b'a ', b'dog.'])
+        seen, statuses = [], []
+
+        def on_transcript(transcript):
+            seen.append(transcript)
+            raise RuntimeError("search server unavailable")
+
+        pipeline = StreamPipeline(buffer, FakeRecognizer(), on_transcript, on_partial=None,
+                                  on_status=statuses.append, max_retries=0)
+        pipeline.run()
+        assert seen == ["red car", "a dog"]
+        assert pipeline.sessions == 1
+        counters = REGISTRY.snapshot()['counters']
+        assert counters['transcript_handler_errors'] == 2
+        assert 'stt_stream_errors' not in counters
+        assert any("search server unavailable" in status for status in statuses)
+
+    def test_stop(self):
+        """Test that stop ends a pipeline waiting for audio."""
+        buffer = AudioBuffer()
+        pipeline = StreamPipeline(buffer, FakeRecognizer(), lambda transcript: None, on_partial=None)
+        thread = threading.Thread(target=pipeline.run)
+        thread.start()
+        time.sleep(0.05)
+        pipeline.stop()
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
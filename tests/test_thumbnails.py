@@ -0,0 +1,52 @@
+"""
+Tests for the parallel thumbnail decoder.
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Image = pytest.importorskip("PIL.Image")
+
+from metrics import trace
+from thumbnails import iter_thumbnails
+
+
+class TestThumbnails:
+    """Test cases for iter_thumbnails."""
+
+    def test_yields_every_image_with_its_rank(self, tmp_path):
+        """Test that each path comes back once, resized, with its rank."""
+        paths = []
+        for i in range(5):
+            path = str(tmp_path / f"{i}.jpg")
+            Image.new("RGB", (640, 480), (i * 40, 0, 0)).save(path)
+            paths.append(path)
+
+        results = list(iter_thumbnails(paths, size=(100, 100)))
+        assert sorted((rank, path) for rank, path, _, _ in results) == list(enumerate(paths))
+        for _, _, image, error in results:
+            assert error is None
+            assert max(image.size) <= 100
+
+    def test_decode_time_lands_in_callers_trace(self, tmp_path):
+        """Test that decodes on the pool threads are counted in the caller's trace."""
+        path = str(tmp_path / "a.jpg")
+        Image.new("RGB", (64, 64)).save(path)
+        with trace() as timings:
+            list(iter_thumbnails([path, path]))
+        assert timings.get("image_decode", 0) > 0
+
+    def test_missing_file_reports_error(self, tmp_path):
+        """Test that a missing image is reported instead of raised."""
+        ((rank, _, image, error),) = list(iter_thumbnails([str(tmp_path / "missing.jpg")]))
+        assert rank == 0
+        assert image is None
+        assert error is not None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,126 @@
+"""
+Tests for the search cache and the startup warm-up.
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_log import QueryLogWriter
+from result_cache import ResultCache
+from search_protocol import SearchUpdate
+from warmup import popular_queries, prefetch_files, warm_up
+
+
+class TestResultCache:
+    """Test cases for the embedding and result caches."""
+
+    def test_results_are_keyed_by_index(self):
+        """Test that results from another index build are misses."""
+        cache = ResultCache()
+        update = SearchUpdate('fused', ['a.jpg'], True, [1], [0.5])
+        cache.put_results('v1', 'dog', 9, 'hybrid', update)
+        assert cache.get_results('v1', 'dog', 9, 'hybrid') == update
+        assert cache.get_results('v2', 'dog', 9, 'hybrid') is None
+        assert cache.get_results('v1', 'dog', 5, 'hybrid') is None
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the cache stays bounded."""
+        cache = ResultCache(max_embeddings=2)
+        cache.put_embedding('a', [1.0])
+        cache.put_embedding('b', [2.0])
+        cache.get_embedding('a')
+        cache.put_embedding('c', [3.0])
+        assert cache.get_embedding('b') is None
+        assert cache.get_embedding('a') == [1.0]
+
+    def test_retain_index(self):
+        """Test that an index swap drops the old version's results but not embeddings."""
+        cache = ResultCache()
+        cache.put_results('v1', 'dog', 9, 'semantic', SearchUpdate('semantic', ['a.jpg'], True))
+        cache.put_embedding('dog', [1.0])
+        cache.retain_index('v2')
+        assert cache.stats() == {'results': 0, 'embeddings': 1}
+
+    def test_save_and_load(self, tmp_path):
+        """Test that a saved cache only loads back for the same encoder and index."""
+        path = str(tmp_path / "cache.pkl")
+        cache = ResultCache()
+        cache.put_results('v1', 'dog', 9, 'semantic', SearchUpdate('semantic', ['a.jpg'], True, [3], [0.9]))
+        cache.put_embedding('dog', [1.0])
+        cache.save(path, 'clip:onnx')
+
+        assert ResultCache().load(path, 'clip:torch') == 0
+        stale = ResultCache()
+        assert stale.load(path, 'clip:onnx', fingerprint='v2') == 1
+        assert stale.get_embedding('dog') == [1.0]
+        fresh = ResultCache()
+        assert fresh.load(path, 'clip:onnx', fingerprint='v1') == 2
+        assert fresh.get_results('v1', 'dog', 9, 'semantic').ids == [3]
+
+    def test_missing_or_corrupt_file(self, tmp_path):
+        """Test that a bad cache file is ignored."""
+        path = tmp_path / "cache.pkl"
+        assert ResultCache().load(str(path), 'clip') == 0
+        path.write_bytes(b"not a pickle")
+        assert ResultCache().load(str(path), 'clip') == 0
+
+
+class FakeEngine:
+    """Stands in for the search_engine module."""
+
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+        self.saved = False
+        self.warmed = None
+
+    def warm_cache(self, queries, top_k):
+        self.warmed = (list(queries), top_k)
+        return [SearchUpdate('semantic', self.image_paths[:top_k], True) for _ in queries]
+
+    def save_cache(self):
+        self.saved = True
+
+
+class TestWarmup:
+    """Test cases for choosing, precomputing and prefetching popular queries."""
+
+    def test_popular_queries_from_log(self, tmp_path):
+        """Test that logged queries come first by frequency, then the configured list."""
+        writer = QueryLogWriter(str(tmp_path), flush_interval=0.01)
+        writer.start()
+        for query in ["cat", "dog", "cat", "red car", "cat", "dog"]:
+            writer.log(query, query)
+        writer.close()
+        assert popular_queries(str(tmp_path), limit=4, extra=("dog", "pizza", "beach")) == \
+            ["cat", "dog", "red car", "pizza"]
+
+    def test_popular_queries_without_log(self, tmp_path):
+        """Test that the configured list is used when there is no history."""
+        assert popular_queries(str(tmp_path / "missing"), limit=2, extra=("a", "b", "c")) == ["a", "b"]
+
+    def test_prefetch_files(self, tmp_path):
+        """Test that readable files are counted and missing ones skipped."""
+        paths = []
+        for i in range(3):
+            path = tmp_path / f"{i}.jpg"
+            path.write_bytes(b"x" * 100)
+            paths.append(str(path))
+        assert prefetch_files(paths + [paths[0], str(tmp_path / "missing.jpg")]) == 3
+
+    def test_warm_up(self, tmp_path):
+        """Test that warm-up precomputes, prefetches and persists."""
+        image = tmp_path / "a.jpg"
+        image.write_bytes(b"x")
+        engine = FakeEngine([str(image)])
+        results = warm_up(engine, ["dog", "cat"], top_k=9)
+        assert engine.warmed == (["dog", "cat"], 9)
+        assert len(results) == 2
+        assert engine.saved
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
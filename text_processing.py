@@ -0,0 +1,39 @@
+# text_processing.py
+
+import threading
+
+# --- Configuration ---
+SPACY_MODEL = "en_core_web_sm"
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def load_nlp():
+    """
+    Loads the spaCy pipeline used to turn transcripts into keywords.
+    The pipeline is loaded once per process and shared by every caller.
+    """
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            import spacy
+
+            _nlp = spacy.load(SPACY_MODEL)
+        return _nlp
+
+
+def extract_keywords(nlp, text):
+    """
+    Reduces a transcript to its lemmatized keywords, dropping stop words
+    and punctuation.
+
+    Args:
+        nlp: A loaded spaCy pipeline.
+        text (str): The raw transcript.
+
+    Returns:
+        list[str]: The keywords, in order.
+    """
+    doc = nlp(text.lower())
+    return [token.lemma_ for token in doc if not token.is_stop and not token.is_punct]
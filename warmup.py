@@ -0,0 +1,163 @@
+# warmup.py
+
+"""
+Gets a searcher to steady-state latency before real traffic arrives.
+
+Voice traffic is heavily skewed towards a few popular queries. At startup
+we take the most frequent normalized queries from the query log (plus a
+configured list), and then:
+
+1. precompute their embeddings and top-k results in one batched pass
+   (search_engine.warm_cache), so those searches skip CLIP and FAISS;
+2. read their result images into the OS page cache, so decoding the
+   thumbnails doesn't wait on the disk;
+3. save the cache to disk, so the next restart starts warm immediately.
+
+Usage:
+    python warmup.py [--limit 200] [--top-k 9]   # warm and persist the cache offline
+"""
+
+import argparse
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import span
+from query_log import QUERY_LOG_DIR, read_log
+
+# --- Configuration ---
+WARMUP_LIMIT = 200
+TOP_K = 9
+PREFETCH_WORKERS = 8
+READ_CHUNK = 1024 * 1024
+# Always warmed, even before the query log has any history.
+WARMUP_QUERIES = (
+    'dog', 'cat', 'car', 'person', 'pizza', 'beach', 'train', 'airplane', 'bicycle', 'kitchen',
+)
+
+
+def popular_queries(log_path=QUERY_LOG_DIR, limit=WARMUP_LIMIT, extra=WARMUP_QUERIES):
+    """
+    Returns the most frequent normalized queries in the query log, most
+    frequent first, followed by any `extra` queries not already included.
+
+    Args:
+        log_path (str): A query log file or directory.
+        limit (int): Most queries to return.
+        extra (iterable[str]): Configured queries to warm regardless of the log.
+    """
+    counts = Counter()
+    if os.path.exists(log_path):
+        counts.update(record.query for record in read_log(log_path) if record.query)
+    queries = [query for query, _ in counts.most_common(limit)]
+    seen = set(queries)
+    for query in extra:
+        if len(queries) >= limit:
+            break
+        if query not in seen:
+            queries.append(query)
+            seen.add(query)
+    return queries
+
+
+def _prefetch_file(path):
+    try:
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                # Ask the kernel to read it ahead, without copying it into Python.
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while f.read(READ_CHUNK):
+                    pass
+        return True
+    except OSError:
+        return False
+
+
+def prefetch_files(paths, workers=PREFETCH_WORKERS):
+    """
+    Pulls files into the OS page cache in parallel.
+
+    Returns:
+        int: How many of the files could be read.
+    """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') as pool:
+        return sum(pool.map(_prefetch_file, paths))
+
+
+def warm_up(engine, queries=None, top_k=TOP_K, prefetch=True, save=True):
+    """
+    Warms a search engine module (normally `search_engine`).
+
+    Args:
+        engine (module): Provides warm_cache(queries, top_k) and save_cache().
+        queries (list[str]): Defaults to popular_queries().
+        top_k (int): The result count the front ends ask for.
+        prefetch (bool): Read the result images into the page cache.
+        save (bool): Persist the warmed cache to disk.
+
+    Returns:
+        list[SearchUpdate]: The warmed results.
+    """
+    queries = popular_queries() if queries is None else list(queries)
+    with span('warmup'):
+        results = engine.warm_cache(queries, top_k)
+        prefetched = prefetch_files(path for update in results for path in update.paths) if prefetch else 0
+    if save:
+        engine.save_cache()
+    print(f"🔥 Warmed {len(results)} popular queries and prefetched {prefetched} images.")
+    return results
+
+
+def warm_up_in_background(top_k=TOP_K):
+    """
+    Warms the search engine this process will use, on a daemon thread.
+    Does nothing when a shared search server is running: it warms itself.
+    """
+    def run():
+        import search_client
+
+        if search_client.server_available():
+            return
+        try:
+            import search_engine
+
+            warm_up(search_engine, top_k=top_k)
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def save_local_cache():
+    """Persists the in-process search engine's cache, if this process loaded one."""
+    engine = sys.modules.get('search_engine')
+    if engine is not None:
+        engine.save_cache()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute popular queries into the search cache.")
+    parser.add_argument('--log', default=QUERY_LOG_DIR, help="Query log file or directory.")
+    parser.add_argument('--limit', type=int, default=WARMUP_LIMIT)
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    parser.add_argument('--no-prefetch', action='store_true', help="Don't read the result images.")
+    args = parser.parse_args(argv)
+
+    import search_engine
+
+    queries = popular_queries(args.log, args.limit)
+    warm_up(search_engine, queries, args.top_k, prefetch=not args.no_prefetch)
+    print(f"Saved the search cache to '{search_engine.CACHE_PATH}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())